@@ -2,11 +2,16 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login as django_login, authenticate
 from django.contrib.auth import logout as django_logout
 from django.contrib.auth.decorators import login_required
+from django.conf import settings
 from django.contrib import messages
+from django.db.models import Count
+from django.http import FileResponse, Http404
 from django.forms import ModelForm
 from django import forms
 from productos.models import Producto, Categoria, Color, Marca, Talle, Cliente, Direccion, ProductoStock
 from productos.forms import ProductoForm
+from productos.fusion_carrito import fusionar_carrito_invitado
+from productos.perfilado import ARCHIVO_VALIDO, directorio_perfiles, requests_registrados, token_perfilado
 
 # Formularios
 # class ProductForm(ModelForm):
@@ -88,7 +93,9 @@ def iniciar_sesion(request):
         user = authenticate(request, username=username, password=password)
         
         if user is not None and user.is_staff:
+            clave_invitado = request.session.session_key
             django_login(request, user)  # 🔹 usamos la función de Django, no la vista
+            fusionar_carrito_invitado(request, clave_invitado)
             messages.success(request, f'¡Bienvenido {user.username}!')
             return redirect('dashboard')
         else:
@@ -114,7 +121,7 @@ def dashboard(request):
         'total_colores': Color.objects.count(),
         'total_marcas': Marca.objects.count(),
         'low_stock': ProductoStock.objects.filter(stock__lt=5).count(),
-        'recent_productos': Producto.objects.order_by('-created_at')[:5],
+        'recent_productos': Producto.objects.select_related('categoria').order_by('-created_at')[:5],
     }
     return render(request, 'custom_admin/dashboard.html', context)
 
@@ -192,7 +199,7 @@ def categorias(request):
     if not request.user.is_staff:
         return redirect('home')
     
-    categories = Categoria.objects.all()
+    categories = Categoria.objects.annotate(num_productos=Count('categorias'))
     return render(request, 'custom_admin/categorias.html', {'categories': categories})
 
 @login_required(login_url='login')
@@ -260,7 +267,7 @@ def colores(request):
     if not request.user.is_staff:
         return redirect('home')
     
-    colores = Color.objects.all()
+    colores = Color.objects.annotate(num_productos=Count('productos'))
     return render(request, 'custom_admin/colores.html', {'colores': colores})
 
 @login_required(login_url='login')
@@ -327,7 +334,7 @@ def marcas(request):
     if not request.user.is_staff:
         return redirect('home')
     
-    marcas = Marca.objects.all()
+    marcas = Marca.objects.annotate(num_productos=Count('productos'))
     return render(request, 'custom_admin/marcas.html', {'marcas': marcas})
 
 @login_required(login_url='login')
@@ -395,7 +402,7 @@ def talles(request):
     if not request.user.is_staff:
         return redirect('home')
     
-    talles = Talle.objects.all()
+    talles = Talle.objects.annotate(num_productos=Count('productos'))
     return render(request, 'custom_admin/talles.html', {'talles': talles})
 
 @login_required(login_url='login')
@@ -462,7 +469,7 @@ def clientes(request):
     if not request.user.is_staff:
         return redirect('home')
     
-    clientes = Cliente.objects.all()
+    clientes = Cliente.objects.select_related('grupo')
     return render(request, 'custom_admin/clientes.html', {'clientes': clientes})
 
 @login_required(login_url='login')
@@ -529,7 +536,7 @@ def direcciones(request):
     if not request.user.is_staff:
         return redirect('inicio')
     
-    direcciones = Direccion.objects.all()
+    direcciones = Direccion.objects.select_related('cliente')
     return render(request, 'custom_admin/direcciones.html', {'direcciones': direcciones})
 
 @login_required(login_url='login')
@@ -598,4 +605,34 @@ def stock(request):
         return redirect('home')
     
     stock_items = ProductoStock.objects.select_related('producto', 'color', 'talle').all()
-    return render(request, 'custom_admin/stock.html', {'stock_items': stock_items})
\ No newline at end of file
+    return render(request, 'custom_admin/stock.html', {'stock_items': stock_items})
+
+# Perfilado de requests
+@login_required(login_url='login')
+def perfiles(request):
+    if not request.user.is_staff:
+        return redirect('inicio')
+
+    registrados = requests_registrados()
+    solo_perfilados = request.GET.get('solo') == 'perfilados'
+    if solo_perfilados:
+        registrados = [r for r in registrados if r.get('perfilado')]
+    lentos = sorted(registrados, key=lambda r: r['total_ms'], reverse=True)[:100]
+    return render(request, 'custom_admin/perfiles.html', {
+        'lentos': lentos,
+        'total_registrados': len(registrados),
+        'solo_perfilados': solo_perfilados,
+        'token': token_perfilado(),
+        'token_max_age': getattr(settings, 'PERFILADO_TOKEN_MAX_AGE', 3600) // 60,
+        'url_ejemplo': request.build_absolute_uri('/productos/'),
+    })
+
+@login_required(login_url='login')
+def perfil_descargar(request, archivo):
+    if not request.user.is_staff:
+        return redirect('inicio')
+
+    ruta = directorio_perfiles() / archivo
+    if not ARCHIVO_VALIDO.match(archivo) or not ruta.is_file():
+        raise Http404('Perfil inexistente')
+    return FileResponse(open(ruta, 'rb'), as_attachment=True, filename=archivo, content_type='text/plain')
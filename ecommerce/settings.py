@@ -52,6 +52,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'productos.perfilado.PerfiladoMiddleware',
+    'productos.middleware.PresupuestoConsultasMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -64,7 +66,8 @@ ROOT_URLCONF = 'ecommerce.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates que además mide el render en los requests perfilados
+        'BACKEND': 'productos.perfilado.DjangoTemplatesMedidos',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -81,9 +84,101 @@ TEMPLATES = [
 
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 SESSION_COOKIE_AGE = 86400  # 24 horas
+# El badge del carrito se lee de un resumen en la sesión; se recalcula pasado este tiempo
+CARRITO_RESUMEN_TTL = 300
+# Las unidades en un carrito quedan reservadas; se liberan tras este tiempo sin actividad
+# (comando liberar_reservas, pensado para correr desde cron)
+CARRITO_RESERVA_MINUTOS = 60
+# Comando purgar_carritos: carritos de invitados sin actividad y carritos vacíos que se borran
+CARRITO_INVITADO_DIAS = 7
+CARRITO_VACIO_HORAS = 24
+# Eventos en tiempo real (/eventos/, sólo bajo ASGI). El broker por defecto vive en
+# memoria del proceso; con varios workers usar uno externo con la misma interfaz
+# EVENTOS_BROKER = 'productos.eventos.BrokerLocal'
+
+# Catálogo: tamaño de página de /productos/ (se puede pedir con ?page_size=)
+CATALOGO_PAGE_SIZE = 24
+CATALOGO_PAGE_SIZE_MAX = 96
+
+# Búsqueda de productos: por defecto FTS5 en SQLite (ver productos/search.py)
+# BUSQUEDA_BACKEND = 'productos.search.SQLiteFTSBackend'
+BUSQUEDA_MAX_RESULTADOS = 1000
+# El ranking BM25 se calcula sobre los N matches más recientes
+BUSQUEDA_VENTANA_CANDIDATOS = 2000
+
+# Autocompletado: índice de prefijos en memoria por proceso
+AUTOCOMPLETE_MAX_ENTRADAS = 200000
+AUTOCOMPLETE_TTL = 300  # segundos, para tomar cambios hechos en otros workers
+
+# Formatos de las variantes de imagen (JPEG siempre se genera como fallback).
+# Agregar 'avif' si la instalación de Pillow lo soporta; es más lento de codificar
+IMAGENES_FORMATOS = ['webp', 'jpeg']
+
+# Worker de imágenes (procesar_imagenes): un trabajo tomado hace más de estos
+# segundos se considera abandonado y vuelve a la cola. Tiene que superar lo que
+# tarda un lote
+IMAGENES_RECLAMO_SEGUNDOS = 600
+
+# Imágenes de productos y logos se guardan por contenido (productos/storage.py).
+# Un archivo sin referencias se borra sólo si no se tocó en estos segundos
+MEDIA_GC_GRACIA = 600
+
+# /media/r/<ancho>x<alto>/<ruta>: redimensionado a pedido con cache LRU en disco.
+# Por defecto se permiten los tamaños de las variantes y el 450x563 original
+# IMAGENES_TAMANOS_PERMITIDOS = [(120, 150), (360, 450), (720, 900), (1440, 1800), (450, 563)]
+IMAGENES_CACHE_DIR = BASE_DIR / 'media_cache'
+IMAGENES_CACHE_MAX_BYTES = 512 * 1024 * 1024
+IMAGENES_CACHE_MAX_AGE = 60 * 60 * 24 * 365
+
+# Máximo de consultas SQL por request (productos/middleware.py). Las claves son
+# nombres de URL con namespace ('admin:productos_producto_change'); 'default'
+# vale para el resto y None desactiva el control. Al pasarse se registra un
+# warning; los tests usan 'error' para que un N+1 nuevo haga fallar la suite
+PRESUPUESTO_CONSULTAS = {
+    'default': 12,
+    # El primer agregado de un invitado crea la sesión y el carrito; los
+    # siguientes hacen entre 15 y 19
+    'agregar_al_carrito': 22,
+    # Fijo sin importar la cantidad de operaciones (reservas.reservar_lote);
+    # el primer lote además crea el carrito y lo guarda en la sesión
+    'carrito_batch': 21,
+    # login() rota la clave de sesión (6 consultas) y el carrito del invitado
+    # se fusiona con el del usuario en una cantidad fija de consultas (la
+    # reserva condicional va en un savepoint)
+    'login_cliente': 25,
+    'productos': 20,
+    'dashboard': 15,
+    # Los widgets de autocompletado del inline de stock consultan por fila
+    'admin:productos_producto_change': 60,
+}
+PRESUPUESTO_CONSULTAS_ACCION = 'log'
+# Header X-Consultas con la cantidad de consultas de cada respuesta; bench_http
+# lo usa para reportar consultas por request. Expone detalles internos: sólo
+# activarlo fuera de producción
+PRESUPUESTO_CONSULTAS_HEADER = DEBUG
+
+# Benchmarks (bench_http, bench_micro): dónde se guardan los resultados JSON
+BENCH_RESULTADOS_DIR = BASE_DIR / 'benchmarks'
+
+# Perfilado de requests (productos/perfilado.py, /panel/perfiles/). Se perfila
+# esta fracción de los requests (0 = ninguno) más los que traen el header
+# X-Perfilar con un token firmado, válido PERFILADO_TOKEN_MAX_AGE segundos
+PERFILADO_FRACCION = 0.0
+PERFILADO_TOKEN_MAX_AGE = 3600
+# Cada cuántos segundos se toma una muestra de la pila del request
+PERFILADO_INTERVALO = 0.005
+# Los requests no perfilados que tardan más que esto también se registran
+PERFILADO_LENTO_MS = 500
+# Perfiles .folded y registro de requests; al pasar el tamaño el registro rota
+# y se borran los perfiles de la rotación anterior
+PERFILADO_DIR = BASE_DIR / 'perfiles'
+PERFILADO_REGISTRO_MAX_BYTES = 1024 * 1024
 
 WSGI_APPLICATION = 'ecommerce.wsgi.application'
 
+# Los tests no escriben en perfiles/ ni en benchmarks/ (ver ecommerce/test_runner.py)
+TEST_RUNNER = 'ecommerce.test_runner.TestRunner'
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -0,0 +1,28 @@
+import tempfile
+from pathlib import Path
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Runner de `manage.py test`: los perfiles y requests lentos que registra
+    PerfiladoMiddleware, y los resultados de los benchmarks, van a un
+    directorio temporal en lugar de perfiles/ y benchmarks/ del repo.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._temporal = tempfile.TemporaryDirectory()
+        directorio = Path(self._temporal.name)
+        self._ajustes = override_settings(
+            PERFILADO_DIR=directorio / 'perfiles',
+            BENCH_RESULTADOS_DIR=directorio / 'benchmarks',
+        )
+        self._ajustes.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._ajustes.disable()
+        self._temporal.cleanup()
+        super().teardown_test_environment(**kwargs)
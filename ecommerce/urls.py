@@ -19,20 +19,26 @@ from django.urls import path
 from django.shortcuts import redirect
 from django.conf import settings
 from django.conf.urls.static import static
-from productos.views import producto_list, home, producto_detail
+from productos.views import producto_list, home, producto_detail, autocomplete
 from contact.views import contact
 from custom_admin import views as admin_views
-from productos import cart_views
+from productos import cart_views, sse_views
+from productos.media_views import imagen_redimensionada
 from productos import cliente_auth
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', home, name='inicio'),
     path('productos/', producto_list, name='productos'),
+    path('productos/autocomplete/', autocomplete, name='autocomplete'),
     path('productos/<int:producto_id>/', producto_detail, name='producto_detail'),
     path('contacto/', contact, name='contact'),
     path('inicio/', lambda request: redirect('inicio')),
 
+    # Imágenes redimensionadas a pedido (antes que el static de media).
+    # En producción el servidor web tiene que pasar /media/r/ a Django
+    path('media/r/<int:ancho>x<int:alto>/<path:ruta>', imagen_redimensionada, name='imagen_redimensionada'),
+
     path('panel/', admin_views.dashboard, name='dashboard'),
     path('panel/login/', admin_views.iniciar_sesion, name='login'),
     path('panel/logout/', admin_views.cerrar_sesion, name='logout'),
@@ -95,9 +101,15 @@ urlpatterns = [
     path('carrito/actualizar/', cart_views.actualizar_cantidad, name='actualizar_cantidad'),
     path('carrito/eliminar/', cart_views.eliminar_item_del_carrito, name='eliminar_item_del_carrito'),
     path('carrito/vaciar/', cart_views.vaciar_carrito, name='vaciar_carrito'),
+    path('carrito/batch/', cart_views.carrito_batch, name='carrito_batch'),
+    path('eventos/', sse_views.eventos, name='eventos'),
 
     # Stock
     path('panel/stock/', admin_views.stock, name='stock'),
+
+    # Perfilado de requests
+    path('panel/perfiles/', admin_views.perfiles, name='perfiles'),
+    path('panel/perfiles/<str:archivo>/', admin_views.perfil_descargar, name='perfil_descargar'),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
 
 if settings.DEBUG:
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce.settings')
 
 application = get_wsgi_application()
+
+# Precargar el índice de autocompletado antes de atender requests
+from productos.autocomplete import indice  # noqa: E402
+indice.warm_up()
@@ -1,19 +1,25 @@
 from django.contrib import admin
+from django.db.models import Count
 from django.utils.html import format_html
 from .models import Categoria, Color, Talle, Marca, Producto, ProductoStock, Cliente, GrupoCliente, Direccion, Carrito, CarritoItem
+from .search import get_backend
+from .stock import anotar_stock
 
 @admin.register(Categoria)
 class CategoriaAdmin(admin.ModelAdmin):
     list_display = ['nombre', 'descripcion', 'producto_count']
     search_fields = ['nombre']
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(num_productos=Count('categorias'))
+    
     def producto_count(self, obj):
-        count = obj.categorias.count()  # ← Corregido
         return format_html(
             '<span style="background: #e3f2fd; padding: 3px 10px; border-radius: 10px; font-weight: bold;">{} productos</span>',  # ← Corregido
-            count
+            obj.num_productos
         )
     producto_count.short_description = 'Cantidad de productos'  # ← Corregido
+    producto_count.admin_order_field = 'num_productos'
 
 
 @admin.register(Color)
@@ -31,10 +37,13 @@ class ColorAdmin(admin.ModelAdmin):
         )
     color_preview.short_description = 'Vista previa'
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(num_productos=Count('productos'))
+    
     def producto_count(self, obj):
-        count = obj.productos.count()
-        return f"{count} productos"  # ← Corregido
+        return f"{obj.num_productos} productos"  # ← Corregido
     producto_count.short_description = 'En productos'  # ← Corregido
+    producto_count.admin_order_field = 'num_productos'
 
 
 @admin.register(Talle)
@@ -44,10 +53,13 @@ class TalleAdmin(admin.ModelAdmin):
     search_fields = ['nombre', 'abbreviation']
     ordering = ['order']
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(num_productos=Count('productos'))
+    
     def producto_count(self, obj):
-        count = obj.productos.count()
-        return f"{count} productos"
+        return f"{obj.num_productos} productos"
     producto_count.short_description = 'En productos'  # ← Corregido
+    producto_count.admin_order_field = 'num_productos'
 
 
 @admin.register(Marca)
@@ -77,13 +89,16 @@ class MarcaAdmin(admin.ModelAdmin):
         return "Sin logo"
     logo_preview.short_description = 'Vista previa del logo'
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(num_productos=Count('productos'))
+    
     def producto_count(self, obj):
-        count = obj.productos.count()
         return format_html(
             '<span style="background: #e8f5e9; padding: 3px 10px; border-radius: 10px; font-weight: bold;">{} productos</span>',  # ← Corregido
-            count
+            obj.num_productos
         )
     producto_count.short_description = 'Productos'
+    producto_count.admin_order_field = 'num_productos'
 
 
 class ProductoStockInline(admin.TabularInline):  # ← Nombre corregido
@@ -92,6 +107,9 @@ class ProductoStockInline(admin.TabularInline):  # ← Nombre corregido
     fields = ['color', 'talle', 'stock']
     autocomplete_fields = ['color', 'talle']
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('producto', 'color', 'talle')
+    
 
 @admin.register(Producto)
 class ProductoAdmin(admin.ModelAdmin):  # ← Nombre corregido
@@ -99,9 +117,10 @@ class ProductoAdmin(admin.ModelAdmin):  # ← Nombre corregido
     list_filter = ['categoria', 'marca', 'colores', 'created_at']
     search_fields = ['nombre', 'descripcion', 'marca__nombre']
     inlines = [ProductoStockInline]
-    readonly_fields = ['image_preview', 'created_at', 'updated_at']
+    readonly_fields = ['image_preview', 'imagen_estado', 'created_at', 'updated_at']
     filter_horizontal = ['colores']
     autocomplete_fields = ['marca', 'categoria']
+    list_select_related = ['marca', 'categoria']
     
     fieldsets = (
         ('Información básica', {
@@ -113,8 +132,8 @@ class ProductoAdmin(admin.ModelAdmin):  # ← Nombre corregido
             'description': 'Colores disponibles para este producto'  # ← Corregido
         }),
         ('Imagen', {
-            'fields': ('imagen', 'image_preview'),
-            'description': '⚠️ La imagen se redimensionará automáticamente a 450x563px al guardar'  # ← Corregido
+            'fields': ('imagen', 'image_preview', 'imagen_estado'),
+            'description': 'Se guarda la imagen original; las variantes (thumb, card, detail, zoom en WebP/JPEG) las genera el worker de imágenes (procesar_imagenes)'
         }),
         ('Fechas', {
             'fields': ('created_at', 'updated_at'),
@@ -122,12 +141,22 @@ class ProductoAdmin(admin.ModelAdmin):  # ← Nombre corregido
         }),
     )
 
+    def get_queryset(self, request):
+        # colores_display: los colores de toda la página en una consulta
+        return super().get_queryset(request).prefetch_related('colores')
+
+    def get_search_results(self, request, queryset, search_term):
+        """Usar el índice de búsqueda en lugar de icontains sobre cada columna"""
+        if not search_term:
+            return queryset, False
+        return get_backend().filtrar(queryset, search_term, todos=True), False
+
     def image_thumbnail(self, obj):
         """Miniatura para la lista de productos"""
         if obj.imagen:  # ← Corregido (era obj.image)
             return format_html(
                 '<img src="{}" style="width: 50px; height: 62.5px; object-fit: cover; border-radius: 5px;" />',
-                obj.imagen.url  # ← Corregido
+                obj.imagen_variante_url('thumb') or obj.imagen_url
             )
         return "❌"
     image_thumbnail.short_description = '🖼️'
@@ -138,22 +167,24 @@ class ProductoAdmin(admin.ModelAdmin):  # ← Nombre corregido
             return format_html(
                 '<div style="margin-top: 10px;">'
                 '<img src="{}" style="max-width: 450px; border-radius: 10px; box-shadow: 0 2px 8px rgba(0,0,0,0.1);" />'
-                '<p style="color: #666; margin-top: 10px;">✅ Esta imagen está en formato 450x563px</p>'
+                '<p style="color: #666; margin-top: 10px;">{}</p>'
                 '</div>',
-                obj.imagen.url  # ← Corregido
+                obj.imagen_url,
+                '✅ Variantes responsivas listas' if obj.imagen_estado == 'lista' else '⏳ Mostrando el original mientras se procesa'
             )
         return '<p style="color: #999;">No hay imagen cargada</p>'
     image_preview.short_description = 'Vista previa actual'
     
     def colores_display(self, obj):
         """Mostrar colores disponibles"""
-        colores = obj.colores.all()[:3]
+        todos = obj.colores.all()
+        colores = todos[:3]
         html = ''
         for color in colores:
             border = 'border: 1px solid #ccc;' if color.hex_code in ['#FFFFFF', '#ffffff'] else ''
             html += f'<span style="display: inline-block; width: 20px; height: 20px; background: {color.hex_code}; border-radius: 50%; margin-right: 3px; {border}"></span>'
         
-        total = obj.colores.count()
+        total = len(todos)
         if total > 3:
             html += f' <small>+{total - 3}</small>'
         
@@ -167,6 +198,7 @@ class ProductoStockAdmin(admin.ModelAdmin):  # ← Nombre corregido
     list_filter = ['color', 'talle', 'producto__categoria', 'producto__marca']
     search_fields = ['producto__nombre']
     list_editable = ['stock']
+    list_select_related = ['producto', 'color', 'talle']
     ordering = ['producto', 'color__order', 'talle__order']
     autocomplete_fields = ['producto', 'color', 'talle']
 
@@ -206,6 +238,7 @@ class ClienteAdmin(admin.ModelAdmin):
     list_display = ['id', 'nombre', 'apellidos', 'email', 'grupo', 'activado', 'fecha_registro']
     list_filter = ['activado', 'boletin', 'grupo']
     search_fields = ['nombre', 'apellidos', 'email']
+    list_select_related = ['grupo']
 
 @admin.register(Direccion)
 class DireccionAdmin(admin.ModelAdmin):
@@ -218,6 +251,19 @@ class CarritoItemInline(admin.TabularInline):
     readonly_fields = ['agregado', 'get_subtotal_display']
     fields = ['producto', 'color', 'talle', 'cantidad', 'get_subtotal_display', 'agregado']
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('producto', 'color', 'talle')
+    
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        """Las opciones de producto/color/talle se consultan una vez, no una por fila del inline"""
+        field = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        if db_field.name in ('producto', 'color', 'talle'):
+            opciones = request.__dict__.setdefault('_opciones_carrito_item', {})
+            if db_field.name not in opciones:
+                opciones[db_field.name] = list(field.choices)
+            field.choices = opciones[db_field.name]
+        return field
+    
     def get_subtotal_display(self, obj):
         if obj.id:
             return format_html(
@@ -236,6 +282,9 @@ class CarritoAdmin(admin.ModelAdmin):
     readonly_fields = ['creado', 'actualizado', 'total_display']
     inlines = [CarritoItemInline]
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('usuario').con_totales()
+    
     fieldsets = (
         ('Información del Carrito', {
             'fields': ('usuario', 'session_key')
@@ -262,13 +311,13 @@ class CarritoAdmin(admin.ModelAdmin):
     usuario_display.short_description = 'Usuario'
     
     def items_count(self, obj):
-        count = obj.items.count()
-        cantidad = obj.get_cantidad_total()
+        resumen = obj.get_resumen()
         return format_html(
             '<span style="background: #e3f2fd; padding: 3px 10px; border-radius: 10px;">{} items ({} productos)</span>',
-            count, cantidad
+            resumen['items'], resumen['cantidad_total']
         )
     items_count.short_description = 'Productos'
+    items_count.admin_order_field = 'resumen_cantidad'
     
     def total_display(self, obj):
         return format_html(
@@ -276,6 +325,7 @@ class CarritoAdmin(admin.ModelAdmin):
             obj.get_total()
         )
     total_display.short_description = 'Total'
+    total_display.admin_order_field = 'resumen_total'
 
 
 @admin.register(CarritoItem)
@@ -284,6 +334,10 @@ class CarritoItemAdmin(admin.ModelAdmin):
     list_filter = ['color', 'talle', 'agregado']
     search_fields = ['producto__nombre', 'carrito__usuario__username']
     readonly_fields = ['agregado', 'subtotal_display', 'stock_disponible']
+    list_select_related = ['carrito__usuario', 'producto', 'color', 'talle']
+    
+    def get_queryset(self, request):
+        return anotar_stock(super().get_queryset(request))
     
     def color_badge(self, obj):
         border = 'border: 1px solid #ccc;' if obj.color.hex_code in ['#FFFFFF', '#ffffff'] else ''
@@ -315,4 +369,5 @@ class CarritoItemAdmin(admin.ModelAdmin):
             return format_html('<span style="color: #ff9800;">⚠️ {} unidades</span>', stock)
         else:
             return format_html('<span style="color: #4caf50;">✅ {} unidades</span>', stock)
-    stock_disponible.short_description = 'Stock'
\ No newline at end of file
+    stock_disponible.short_description = 'Stock'
+    stock_disponible.admin_order_field = 'stock_libre'
\ No newline at end of file
@@ -5,3 +5,6 @@ class ProductosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'productos'
     verbose_name = 'Catálogo'
+
+    def ready(self):
+        from . import signals  # noqa: F401
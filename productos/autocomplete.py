@@ -0,0 +1,210 @@
+import logging
+import sys
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+
+from .models import Producto, Marca, Categoria
+
+logger = logging.getLogger(__name__)
+
+# Orden en que se muestran los tipos de sugerencia
+PRIORIDAD = {'categoria': 0, 'marca': 1, 'producto': 2}
+
+
+def normalizar(texto):
+    """Minúsculas y sin acentos, para comparar prefijos"""
+    texto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+
+
+class PrefixIndex:
+    """
+    Índice de prefijos en memoria para el autocompletado.
+
+    Guarda una lista ordenada de claves (cada palabra normalizada de cada
+    nombre) y busca con bisect, así que una consulta cuesta O(log n + k) sin
+    tocar la base de datos. Las altas y bajas son incrementales, y la
+    cantidad de entradas está acotada por AUTOCOMPLETE_MAX_ENTRADAS.
+    """
+
+    max_palabras = 6
+    max_etiqueta = 80
+
+    def __init__(self, max_entradas=None):
+        self.max_entradas = max_entradas or getattr(settings, 'AUTOCOMPLETE_MAX_ENTRADAS', 200000)
+        self._lock = threading.Lock()
+        self._claves = []      # [(palabra, tipo, id)] ordenada
+        self._etiquetas = {}   # (tipo, id) -> (nombre, nombre normalizado, palabras)
+        self.construido = None
+        # Lo tiene quien está reconstruyendo; los demás siguen usando el índice viejo
+        self._reconstruyendo = threading.Lock()
+        # Altas y bajas llegadas durante una reconstrucción, para aplicarlas al nuevo
+        self._pendientes = None
+
+    def __len__(self):
+        return len(self._claves)
+
+    def _palabras(self, nombre):
+        palabras = normalizar(nombre).split()
+        return list(dict.fromkeys(palabras))[:self.max_palabras]
+
+    def _quitar(self, tipo, pk):
+        etiqueta = self._etiquetas.pop((tipo, pk), None)
+        if etiqueta is None:
+            return
+        for palabra in etiqueta[2]:
+            i = bisect_left(self._claves, (palabra, tipo, pk))
+            if i < len(self._claves) and self._claves[i] == (palabra, tipo, pk):
+                del self._claves[i]
+
+    def agregar(self, tipo, pk, nombre):
+        with self._lock:
+            if self._pendientes is not None:
+                self._pendientes.append((self.agregar, (tipo, pk, nombre)))
+            self._quitar(tipo, pk)
+            palabras = self._palabras(nombre)
+            if len(self._claves) + len(palabras) > self.max_entradas:
+                logger.warning('Índice de autocompletado lleno, se omite %s %s', tipo, pk)
+                return
+            nombre = nombre[:self.max_etiqueta]
+            self._etiquetas[(tipo, pk)] = (nombre, normalizar(nombre), palabras)
+            for palabra in palabras:
+                insort(self._claves, (palabra, tipo, pk))
+
+    def quitar(self, tipo, pk):
+        with self._lock:
+            if self._pendientes is not None:
+                self._pendientes.append((self.quitar, (tipo, pk)))
+            self._quitar(tipo, pk)
+
+    def construir(self):
+        """Reconstruye el índice completo desde la base de datos"""
+        with self._lock:
+            self._pendientes = []
+        try:
+            claves, etiquetas = self._leer()
+        except BaseException:
+            with self._lock:
+                self._pendientes = None
+            raise
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, None
+            self._claves = claves
+            self._etiquetas = etiquetas
+            self.construido = time.monotonic()
+        for operacion, args in pendientes:
+            operacion(*args)
+
+    def _leer(self):
+        claves = []
+        etiquetas = {}
+        fuentes = (
+            ('categoria', Categoria.objects.values_list('id', 'nombre')),
+            ('marca', Marca.objects.values_list('id', 'nombre')),
+            ('producto', Producto.objects.order_by('-created_at').values_list('id', 'nombre')),
+        )
+        for tipo, filas in fuentes:
+            for pk, nombre in filas.iterator():
+                palabras = self._palabras(nombre)
+                if len(claves) + len(palabras) > self.max_entradas:
+                    logger.warning('Índice de autocompletado lleno con %s entradas', len(claves))
+                    break
+                nombre = nombre[:self.max_etiqueta]
+                etiquetas[(tipo, pk)] = (nombre, normalizar(nombre), palabras)
+                claves.extend((palabra, tipo, pk) for palabra in palabras)
+        claves.sort()
+        return claves, etiquetas
+
+    def warm_up(self):
+        """Construye el índice al arrancar el proceso, sin romper si no hay base"""
+        try:
+            self.construir()
+        except DatabaseError as e:
+            logger.warning('No se pudo precargar el autocompletado: %s', e)
+
+    def refrescar(self):
+        """
+        Reconstruye el índice si venció el TTL sin frenar al request que lo
+        nota: lo hace un hilo aparte (uno solo por proceso) mientras los
+        requests siguen usando el índice anterior. Sólo la primera
+        construcción es síncrona, y los requests que llegan mientras tanto la
+        esperan en vez de construir cada uno la suya.
+        """
+        if not self.vencido():
+            return
+        if self.construido is None:
+            with self._reconstruyendo:
+                if self.construido is None:
+                    self.construir()
+            return
+        if self._reconstruyendo.acquire(blocking=False):
+            threading.Thread(target=self._reconstruir_en_fondo, name='autocompletado', daemon=True).start()
+
+    def _reconstruir_en_fondo(self):
+        try:
+            self.construir()
+        except DatabaseError as e:
+            logger.warning('No se pudo reconstruir el autocompletado: %s', e)
+        finally:
+            # La conexión es de este hilo: ningún request la va a cerrar
+            connection.close()
+            self._reconstruyendo.release()
+
+    def vencido(self):
+        ttl = getattr(settings, 'AUTOCOMPLETE_TTL', 300)
+        return self.construido is None or time.monotonic() - self.construido > ttl
+
+    def buscar(self, q, limite=10):
+        terminos = normalizar(q).split()
+        if not terminos:
+            return []
+        prefijo = terminos[-1]
+        resto = terminos[:-1]
+
+        vistos = set()
+        resultados = []
+        with self._lock:
+            i = bisect_left(self._claves, (prefijo,))
+            fin = min(len(self._claves), i + limite * 50)
+            while i < fin and len(resultados) < limite * 5:
+                palabra, tipo, pk = self._claves[i]
+                i += 1
+                if not palabra.startswith(prefijo):
+                    break
+                if (tipo, pk) in vistos:
+                    continue
+                vistos.add((tipo, pk))
+                nombre, nombre_normalizado, _ = self._etiquetas[(tipo, pk)]
+                if all(termino in nombre_normalizado for termino in resto):
+                    resultados.append({'tipo': tipo, 'id': pk, 'texto': nombre})
+
+        resultados.sort(key=lambda r: (PRIORIDAD[r['tipo']], r['texto']))
+        return resultados[:limite]
+
+    def memoria(self):
+        """Tamaño aproximado en bytes de las estructuras del índice"""
+        total = sys.getsizeof(self._claves) + sys.getsizeof(self._etiquetas)
+        for palabra, tipo, pk in self._claves:
+            total += sys.getsizeof(palabra) + 64
+        for nombre, normalizado, palabras in self._etiquetas.values():
+            total += sys.getsizeof(nombre) + sys.getsizeof(normalizado) + sys.getsizeof(palabras) + 64
+        return total
+
+
+indice = PrefixIndex()
+
+
+def get_indice():
+    """
+    Índice del proceso, refrescado en segundo plano si venció el TTL.
+
+    Las señales actualizan el índice del proceso que hizo el cambio; el TTL
+    cubre los cambios hechos desde otros workers.
+    """
+    indice.refrescar()
+    return indice
@@ -0,0 +1,143 @@
+"""
+Utilidades de los benchmarks (bench_http, bench_micro): medición de tiempos,
+percentiles, archivos JSON con el commit medido y comparación entre corridas.
+"""
+import json
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import django
+from django.conf import settings
+
+
+def percentil(ordenados, p):
+    """Percentil `p` (0-1) de una lista ya ordenada"""
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+def resumen_tiempos(tiempos):
+    """p50/p95/p99 y media en milisegundos de una lista de duraciones en segundos"""
+    if not tiempos:
+        return {'p50': None, 'p95': None, 'p99': None, 'media': None}
+    ordenados = sorted(tiempos)
+    return {
+        'p50': percentil(ordenados, 0.50) * 1000,
+        'p95': percentil(ordenados, 0.95) * 1000,
+        'p99': percentil(ordenados, 0.99) * 1000,
+        'media': sum(ordenados) / len(ordenados) * 1000,
+    }
+
+
+def medir(funcion, rondas=10, tiempo_minimo=0.05):
+    """
+    Tiempo por llamada de `funcion`, al estilo de pytest-benchmark: calibra
+    cuántas iteraciones hacen falta para que una ronda dure `tiempo_minimo`
+    segundos y repite `rondas` rondas. Devuelve estadísticas en segundos.
+    """
+    funcion()  # calentamiento: imports, caches y compilación de consultas
+    iteraciones = 1
+    while True:
+        inicio = time.perf_counter()
+        for _ in range(iteraciones):
+            funcion()
+        duracion = time.perf_counter() - inicio
+        if duracion >= tiempo_minimo:
+            break
+        iteraciones = max(iteraciones * 2, int(iteraciones * tiempo_minimo / duracion * 1.2)) if duracion else iteraciones * 10
+
+    tiempos = []
+    for _ in range(rondas):
+        inicio = time.perf_counter()
+        for _ in range(iteraciones):
+            funcion()
+        tiempos.append((time.perf_counter() - inicio) / iteraciones)
+    mediana = statistics.median(tiempos)
+    return {
+        'min': min(tiempos),
+        'mediana': mediana,
+        'media': statistics.fmean(tiempos),
+        'desvio': statistics.stdev(tiempos) if len(tiempos) > 1 else 0.0,
+        'ops': 1 / mediana if mediana else None,
+        'rondas': rondas,
+        'iteraciones': iteraciones,
+    }
+
+
+def commit_actual():
+    """Commit del árbol medido (con sufijo -dirty si hay cambios), o None fuera de git"""
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True, timeout=10,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def directorio_resultados():
+    return Path(getattr(settings, 'BENCH_RESULTADOS_DIR', settings.BASE_DIR / 'benchmarks'))
+
+
+def guardar_resultado(tipo, datos, ruta=None):
+    """
+    Guarda `datos` con la fecha, el commit y las versiones usadas. Sin `ruta`
+    va a BENCH_RESULTADOS_DIR/<tipo>-<fecha>-<commit>.json, así las corridas
+    quedan ordenadas por fecha. Devuelve la ruta escrita.
+    """
+    ahora = datetime.now(timezone.utc)
+    commit = commit_actual()
+    resultado = {
+        'tipo': tipo,
+        'fecha': ahora.isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        **datos,
+    }
+    if ruta is None:
+        ruta = directorio_resultados() / f'{tipo}-{ahora:%Y%m%dT%H%M%S}-{commit or "sin-git"}.json'
+    ruta = Path(ruta)
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    ruta.write_text(json.dumps(resultado, indent=2, ensure_ascii=False))
+    return ruta
+
+
+def cargar_resultado(ruta):
+    return json.loads(Path(ruta).read_text())
+
+
+def ultimo_resultado(tipo, excepto=None):
+    """Ruta de la corrida más reciente de `tipo` en BENCH_RESULTADOS_DIR, o None"""
+    rutas = sorted(
+        ruta for ruta in directorio_resultados().glob(f'{tipo}-*.json')
+        if excepto is None or ruta.resolve() != Path(excepto).resolve()
+    )
+    return rutas[-1] if rutas else None
+
+
+def historial(tipo, ultimas):
+    """Las últimas `ultimas` corridas guardadas de `tipo`, de la más vieja a la más nueva"""
+    rutas = sorted(directorio_resultados().glob(f'{tipo}-*.json'))[-ultimas:]
+    return [cargar_resultado(ruta) for ruta in rutas]
+
+
+def comparar(anterior, actual, metricas, tolerancia):
+    """
+    Compara {nombre: {métrica: valor}} de dos corridas, para métricas donde
+    más es peor (latencias, consultas). Devuelve las filas
+    (nombre, métrica, antes, ahora, cambio relativo, ¿regresión?) de los
+    nombres presentes en las dos corridas.
+    """
+    filas = []
+    for nombre in sorted(set(anterior) & set(actual)):
+        for metrica in metricas:
+            antes, ahora = anterior[nombre].get(metrica), actual[nombre].get(metrica)
+            if antes is None or ahora is None:
+                continue
+            cambio = (ahora - antes) / antes if antes else (0.0 if ahora == antes else float('inf'))
+            filas.append((nombre, metrica, antes, ahora, cambio, cambio > tolerancia))
+    return filas
@@ -2,49 +2,118 @@
 
 from django.shortcuts import render, redirect, get_object_or_404
 from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
 from django.contrib import messages
 from django.views.decorators.http import require_POST
+from django.db import transaction
+from django.db.models import Max
 from .models import Carrito, CarritoItem, Producto, Color, Talle, ProductoStock
+from .resumen_carrito import actualizar_resumen, buscar_carrito, guardar_resumen
+from .stock import adjuntar_stock, resolver_stock
+from .reservas import ConflictoReserva, StockInsuficiente, quitar_items, reservar, reservar_lote
 import json
 
+CARRITO_VACIO = {'items': [], 'cantidad_total': 0, 'total': '0'}
+
+
 def get_or_create_cart(request):
-    """Obtiene o crea un carrito para el usuario actual"""
+    """
+    Obtiene o crea un carrito para el usuario actual. Sólo lo usan las vistas
+    que agregan productos: las de lectura usan `buscar_carrito`, que no crea
+    ni sesión ni carrito.
+    """
     if request.user.is_authenticated:
         carrito, created = Carrito.objects.get_or_create(usuario=request.user)
     else:
         if not request.session.session_key:
+            # Sesión nueva: no puede tener carrito, no hace falta buscarlo
             request.session.create()
+            return Carrito.objects.create(session_key=request.session.session_key)
         session_key = request.session.session_key
         carrito, created = Carrito.objects.get_or_create(session_key=session_key)
     
     return carrito
 
 
-def get_cart_data(request):
-    """Obtiene los datos del carrito en formato JSON para el navbar"""
-    carrito = get_or_create_cart(request)
+def resumen_json(request, carrito):
+    """
+    Totales del carrito para las respuestas JSON, en una sola consulta.
+    También actualiza el resumen de la sesión que usa el badge del navbar.
+    """
+    resumen = carrito.get_resumen()
+    guardar_resumen(request, resumen)
+    return {
+        'cantidad_total': resumen['cantidad_total'],
+        'total': str(resumen['total']),
+    }
+
+
+def datos_carrito(request, carrito):
+    """Items y totales del carrito, tal como los consume el navbar"""
     items = []
+    cantidad_total = 0
+    total = 0
     
-    for item in carrito.items.select_related('producto', 'color', 'talle'):
+    # Los totales salen de las mismas filas, sin volver a consultar el carrito
+    carrito_items = adjuntar_stock(list(carrito.items.select_related('producto', 'color', 'talle')))
+    for item in carrito_items:
+        subtotal = item.get_subtotal()
+        cantidad_total += item.cantidad
+        total += subtotal
         items.append({
             'id': item.id,
             'producto_id': item.producto.id,
             'nombre': item.producto.nombre,
-            'imagen': item.producto.imagen.url if item.producto.imagen else None,
+            'imagen': item.producto.imagen_variante_url('thumb') or item.producto.imagen_url,
+            'imagen_srcset': item.producto.imagen_srcset(),
+            'imagen_srcset_webp': item.producto.imagen_srcset('webp'),
             'color': item.color.nombre,
             'color_hex': item.color.hex_code,
             'talle': item.talle.abbreviation,
             'precio': str(item.producto.precio),
             'cantidad': item.cantidad,
-            'subtotal': str(item.get_subtotal()),
+            'subtotal': str(subtotal),
             'stock_disponible': item.get_stock_disponible()
         })
     
-    return JsonResponse({
+    # Sólo escribe la sesión si el carrito cambió por otro lado (admin, otro dispositivo)
+    actualizar_resumen(request, {'cantidad_total': cantidad_total, 'total': total})
+    return {
         'items': items,
-        'cantidad_total': carrito.get_cantidad_total(),
-        'total': str(carrito.get_total())
-    })
+        'cantidad_total': cantidad_total,
+        'total': str(total)
+    }
+
+
+def get_cart_data(request):
+    """
+    Obtiene los datos del carrito en formato JSON para el navbar.
+
+    La respuesta lleva ETag (id y versión del carrito, más la última
+    modificación de sus productos: precio, nombre o imagen) y Last-Modified;
+    si el navegador ya tiene la versión actual se contesta 304 sin cargar
+    items. Las dos versiones salen de la misma consulta que busca el carrito.
+    El stock disponible de cada item puede quedar desactualizado hasta el
+    próximo cambio del carrito: el que vale es el que se valida al reservar.
+    """
+    carrito = buscar_carrito(request, Carrito.objects.annotate(productos_actualizados=Max('items__producto__updated_at')))
+    if carrito is None:
+        respuesta = JsonResponse(CARRITO_VACIO)
+    else:
+        productos = carrito.productos_actualizados
+        productos_version = int(productos.timestamp() * 1_000_000) if productos else 0
+        etag = f'"carrito-{carrito.pk}-{carrito.version}-{productos_version}"'
+        ultima_modificacion = int(max(carrito.actualizado, productos or carrito.actualizado).timestamp())
+        respuesta = get_conditional_response(request, etag=etag, last_modified=ultima_modificacion)
+        if respuesta is None:
+            respuesta = JsonResponse(datos_carrito(request, carrito))
+        respuesta.headers['ETag'] = etag
+        respuesta.headers['Last-Modified'] = http_date(ultima_modificacion)
+    # Siempre se revalida; la respuesta depende de la sesión
+    patch_cache_control(respuesta, private=True, no_cache=True)
+    patch_vary_headers(respuesta, ['Cookie'])
+    return respuesta
 
 
 @require_POST
@@ -63,20 +132,24 @@ def agregar_al_carrito(request):
                 'success': False,
                 'message': 'Faltan datos requeridos'
             }, status=400)
+        if cantidad < 1:
+            return JsonResponse({
+                'success': False,
+                'message': 'La cantidad debe ser al menos 1'
+            }, status=400)
         
-        # Obtener objetos
-        producto = get_object_or_404(Producto, id=producto_id)
-        color = get_object_or_404(Color, id=color_id)
-        talle = get_object_or_404(Talle, id=talle_id)
-        
-        # Verificar stock disponible
+        # Verificar stock disponible. La variante alcanza para validar
+        # producto, color y talle: sólo si falta se busca cuál no existe
         try:
             stock = ProductoStock.objects.get(
-                producto=producto,
-                color=color,
-                talle=talle
+                producto_id=producto_id,
+                color_id=color_id,
+                talle_id=talle_id
             )
         except ProductoStock.DoesNotExist:
+            get_object_or_404(Producto, id=producto_id)
+            get_object_or_404(Color, id=color_id)
+            get_object_or_404(Talle, id=talle_id)
             return JsonResponse({
                 'success': False,
                 'message': 'No hay stock disponible para esta combinación'
@@ -85,34 +158,35 @@ def agregar_al_carrito(request):
         # Obtener o crear carrito
         carrito = get_or_create_cart(request)
         
-        # Buscar si ya existe este item en el carrito
-        item, created = CarritoItem.objects.get_or_create(
-            carrito=carrito,
-            producto=producto,
-            color=color,
-            talle=talle,
-            defaults={'cantidad': 0}  # Iniciar en 0 para sumar después
-        )
-        
-        # Calcular nueva cantidad
-        nueva_cantidad = item.cantidad + cantidad
-        
-        # Verificar que no exceda el stock
-        if nueva_cantidad > stock.stock:
-            stock_disponible = stock.stock - item.cantidad
+        # Buscar o crear el item y reservar las unidades nuevas. Si no hay
+        # stock, la transacción deshace también la creación del item
+        try:
+            with transaction.atomic():
+                item, created = CarritoItem.objects.get_or_create(
+                    carrito=carrito,
+                    producto_id=stock.producto_id,
+                    color_id=stock.color_id,
+                    talle_id=stock.talle_id,
+                    defaults={'cantidad': 0}  # Iniciar en 0 para sumar después
+                )
+                cantidad_previa = item.cantidad
+                reservar(item, item.cantidad + cantidad)
+        except StockInsuficiente as e:
+            stock_disponible = e.disponible - cantidad_previa
             if stock_disponible <= 0:
                 return JsonResponse({
                     'success': False,
-                    'message': f'Ya tienes el máximo disponible ({item.cantidad} unidades) en el carrito'
+                    'message': f'Ya tienes el máximo disponible ({cantidad_previa} unidades) en el carrito'
                 }, status=400)
             return JsonResponse({
                 'success': False,
                 'message': f'Solo puedes agregar {stock_disponible} unidades más. Stock total: {stock.stock}'
             }, status=400)
-        
-        # Actualizar cantidad
-        item.cantidad = nueva_cantidad
-        item.save()
+        except ConflictoReserva:
+            return JsonResponse({
+                'success': False,
+                'message': 'El carrito cambió mientras se actualizaba, intentá de nuevo'
+            }, status=409)
         
         mensaje = f'Se {"agregó" if created else "actualizó"} el producto en el carrito'
         
@@ -120,8 +194,7 @@ def agregar_al_carrito(request):
             'success': True,
             'message': mensaje,
             'cantidad_item': item.cantidad,
-            'cantidad_total': carrito.get_cantidad_total(),
-            'total': str(carrito.get_total())
+            **resumen_json(request, carrito)
         })
         
     except Exception as e:
@@ -145,26 +218,28 @@ def actualizar_cantidad(request):
                 'message': 'La cantidad debe ser al menos 1'
             }, status=400)
         
-        carrito = get_or_create_cart(request)
+        carrito = buscar_carrito(request)
         item = get_object_or_404(CarritoItem, id=item_id, carrito=carrito)
         
-        # Verificar stock
-        stock_disponible = item.get_stock_disponible()
-        if cantidad > stock_disponible:
+        # Reservar (o liberar) la diferencia contra el stock
+        try:
+            reservar(item, cantidad)
+        except StockInsuficiente as e:
             return JsonResponse({
                 'success': False,
-                'message': f'Solo hay {stock_disponible} unidades disponibles'
+                'message': f'Solo hay {e.disponible} unidades disponibles'
             }, status=400)
-        
-        item.cantidad = cantidad
-        item.save()
+        except ConflictoReserva:
+            return JsonResponse({
+                'success': False,
+                'message': 'El carrito cambió mientras se actualizaba, intentá de nuevo'
+            }, status=409)
         
         return JsonResponse({
             'success': True,
             'message': 'Cantidad actualizada',
             'subtotal': str(item.get_subtotal()),
-            'cantidad_total': carrito.get_cantidad_total(),
-            'total': str(carrito.get_total())
+            **resumen_json(request, carrito)
         })
         
     except Exception as e:
@@ -181,15 +256,14 @@ def eliminar_item_del_carrito(request):
         data = json.loads(request.body)
         item_id = data.get('item_id')
         
-        carrito = get_or_create_cart(request)
+        carrito = buscar_carrito(request)
         item = get_object_or_404(CarritoItem, id=item_id, carrito=carrito)
         item.delete()
         
         return JsonResponse({
             'success': True,
             'message': 'Producto eliminado del carrito',
-            'cantidad_total': carrito.get_cantidad_total(),
-            'total': str(carrito.get_total())
+            **resumen_json(request, carrito)
         })
         
     except Exception as e:
@@ -200,6 +274,134 @@ def eliminar_item_del_carrito(request):
 
 def vaciar_carrito(request):
     """Vacía el carrito completamente"""
-    carrito = get_or_create_cart(request)
-    carrito.items.all().delete()
-    return JsonResponse({"success": True, "message": "Carrito vaciado correctamente"})
\ No newline at end of file
+    carrito = buscar_carrito(request)
+    if carrito is not None:
+        quitar_items(carrito.items.all())
+    guardar_resumen(request, {'cantidad_total': 0, 'total': 0})
+    return JsonResponse({"success": True, "message": "Carrito vaciado correctamente"})
+
+MAX_OPERACIONES_BATCH = 50
+
+
+def _leer_operaciones(operaciones, items):
+    """
+    Aplica en memoria las operaciones sobre las cantidades actuales.
+    Devuelve ({variante: cantidad final}, variantes tocadas, errores).
+    """
+    por_id = {item.id: item for item in items}
+    objetivo = {(i.producto_id, i.color_id, i.talle_id): i.cantidad for i in items}
+    tocadas = set()
+    errores = []
+    for numero, operacion in enumerate(operaciones):
+        try:
+            tipo = operacion['op']
+            if tipo == 'vaciar':
+                objetivo = dict.fromkeys(objetivo, 0)
+                tocadas.update(objetivo)
+                continue
+            if tipo == 'agregar':
+                clave = (int(operacion['producto_id']), int(operacion['color_id']), int(operacion['talle_id']))
+                cantidad = int(operacion.get('cantidad', 1))
+                if cantidad < 1:
+                    raise ValueError(cantidad)
+                objetivo[clave] = objetivo.get(clave, 0) + cantidad
+            elif tipo in ('actualizar', 'eliminar'):
+                item = por_id.get(int(operacion['item_id']))
+                if item is None:
+                    errores.append({'operacion': numero, 'message': 'El item no está en el carrito'})
+                    continue
+                clave = (item.producto_id, item.color_id, item.talle_id)
+                cantidad = 0 if tipo == 'eliminar' else int(operacion['cantidad'])
+                if tipo == 'actualizar' and cantidad < 1:
+                    raise ValueError(cantidad)
+                objetivo[clave] = cantidad
+            else:
+                errores.append({'operacion': numero, 'message': f'Operación desconocida: {tipo}'})
+                continue
+            tocadas.add(clave)
+        except (KeyError, TypeError, ValueError):
+            errores.append({'operacion': numero, 'message': 'Operación inválida'})
+    return objetivo, tocadas, errores
+
+
+@require_POST
+def carrito_batch(request):
+    """
+    Aplica varias operaciones del carrito en un solo request y devuelve el
+    carrito resultante (mismo formato que /carrito/data/).
+
+    Body: {"operaciones": [
+        {"op": "agregar", "producto_id": 1, "color_id": 2, "talle_id": 3, "cantidad": 1},
+        {"op": "actualizar", "item_id": 10, "cantidad": 2},
+        {"op": "eliminar", "item_id": 11},
+        {"op": "vaciar"}
+    ]}
+
+    El stock de todas las variantes que aumentan se valida con una sola
+    consulta, y los cambios se aplican en una transacción con
+    reservas.reservar_lote: o se aplican todas las operaciones o ninguna,
+    y la cantidad de consultas no depende de la cantidad de operaciones.
+    """
+    try:
+        operaciones = json.loads(request.body)['operaciones']
+        if not isinstance(operaciones, list) or not operaciones:
+            raise ValueError('operaciones')
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({
+            'success': False,
+            'message': 'Se esperaba {"operaciones": [...]}'
+        }, status=400)
+    if len(operaciones) > MAX_OPERACIONES_BATCH:
+        return JsonResponse({
+            'success': False,
+            'message': f'Como máximo {MAX_OPERACIONES_BATCH} operaciones por request'
+        }, status=400)
+
+    carrito = buscar_carrito(request)
+    items = list(carrito.items.all()) if carrito is not None else []
+    objetivo, tocadas, errores = _leer_operaciones(operaciones, items)
+    if errores:
+        return JsonResponse({'success': False, 'message': 'Operaciones inválidas', 'errores': errores}, status=400)
+
+    # Validación de stock de todo el lote en una consulta
+    por_variante = {(i.producto_id, i.color_id, i.talle_id): i for i in items}
+    reservado = {clave: item.reservado for clave, item in por_variante.items()}
+    suben = [clave for clave in tocadas if objetivo[clave] > reservado.get(clave, 0)]
+    libres = resolver_stock(suben)
+    for clave in suben:
+        disponible = libres[clave] + reservado.get(clave, 0)
+        if objetivo[clave] > disponible:
+            errores.append({
+                'producto_id': clave[0],
+                'color_id': clave[1],
+                'talle_id': clave[2],
+                'disponible': disponible,
+                'message': f'Solo hay {disponible} unidades disponibles'
+            })
+    if errores:
+        return JsonResponse({'success': False, 'message': 'No hay stock suficiente', 'errores': errores}, status=400)
+    if carrito is None:
+        if not any(objetivo.values()):
+            return JsonResponse({'success': True, **CARRITO_VACIO})
+        carrito = get_or_create_cart(request)
+
+    try:
+        with transaction.atomic():
+            nuevos = CarritoItem.objects.bulk_create(
+                CarritoItem(carrito=carrito, producto_id=c[0], color_id=c[1], talle_id=c[2], cantidad=0)
+                for c in tocadas if objetivo[c] > 0 and c not in por_variante
+            )
+            for item in nuevos:
+                por_variante[(item.producto_id, item.color_id, item.talle_id)] = item
+            # Altas, cambios y bajas del lote en unos pocos UPDATE, no cinco consultas por item
+            reservar_lote(carrito.id, [(por_variante[c], objetivo[c]) for c in tocadas if c in por_variante])
+    except StockInsuficiente as e:
+        # Otro comprador tomó el stock entre la validación y la reserva
+        return JsonResponse({'success': False, 'message': str(e)}, status=409)
+    except ConflictoReserva:
+        return JsonResponse({
+            'success': False,
+            'message': 'El carrito cambió mientras se actualizaba, intentá de nuevo'
+        }, status=409)
+
+    return JsonResponse({'success': True, **datos_carrito(request, carrito)})
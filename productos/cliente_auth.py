@@ -7,6 +7,7 @@ from django.contrib.auth.models import User
 from django.contrib import messages
 from django.db import transaction
 from .models import Cliente, Direccion
+from .fusion_carrito import fusionar_carrito_invitado
 from django import forms
 
 # ========== FORMULARIOS ==========
@@ -170,7 +171,9 @@ def registro_cliente(request):
                     # O usar una relación OneToOne si prefieres
                     
                     # Login automático después del registro
+                    clave_invitado = request.session.session_key
                     login(request, user)
+                    fusionar_carrito_invitado(request, clave_invitado)
                     messages.success(request, f'¡Bienvenido {user.first_name}! Tu cuenta ha sido creada exitosamente.')
                     return redirect('inicio')
             except Exception as e:
@@ -205,7 +208,9 @@ def login_cliente(request):
                     pass
             
             if user is not None:
+                clave_invitado = request.session.session_key
                 login(request, user)
+                fusionar_carrito_invitado(request, clave_invitado)
                 
                 # Configurar duración de la sesión
                 if not recordar:
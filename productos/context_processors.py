@@ -1,26 +1,36 @@
-from .models import Carrito
+from django.utils.functional import SimpleLazyObject
+
+from .resumen_carrito import aobtener_resumen, buscar_carrito, obtener_resumen
+
 
 def cart_processor(request):
-    """Context processor para hacer el carrito disponible en todos los templates"""
-    carrito = None
-    cantidad_total = 0
-    
-    if request.user.is_authenticated:
-        try:
-            carrito = Carrito.objects.get(usuario=request.user)
-            cantidad_total = carrito.get_cantidad_total()
-        except Carrito.DoesNotExist:
-            pass
-    else:
-        session_key = request.session.session_key
-        if session_key:
-            try:
-                carrito = Carrito.objects.get(session_key=session_key)
-                cantidad_total = carrito.get_cantidad_total()
-            except Carrito.DoesNotExist:
-                pass
-    
+    """
+    Context processor para hacer el carrito disponible en todos los templates.
+
+    Todo es perezoso: si el template no usa `carrito` ni el badge, no se toca
+    ni la sesión ni la base. `carrito_cantidad` sale del resumen guardado en
+    la sesión, así que el badge del navbar no hace consultas propias.
+    """
+    return {
+        'carrito': SimpleLazyObject(lambda: buscar_carrito(request)),
+        'carrito_resumen': SimpleLazyObject(lambda: obtener_resumen(request)),
+        'carrito_cantidad': SimpleLazyObject(lambda: obtener_resumen(request)['cantidad']),
+    }
+
+
+async def acart_processor(request):
+    """
+    Equivalente async de `cart_processor` para las vistas async. Django no
+    admite context processors async y los valores perezosos de arriba
+    consultarían la base desde el event loop, así que la vista resuelve el
+    resumen antes de renderizar y lo pasa en su propio contexto, que tiene
+    prioridad sobre el de los processors.
+
+    No incluye `carrito`: ninguna plantilla de la tienda lo usa y costaría
+    una consulta por página.
+    """
+    resumen = await aobtener_resumen(request)
     return {
-        'carrito': carrito,
-        'carrito_cantidad': cantidad_total
-    }
\ No newline at end of file
+        'carrito_resumen': resumen,
+        'carrito_cantidad': resumen['cantidad'],
+    }
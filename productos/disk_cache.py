@@ -0,0 +1,98 @@
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+
+from django.core.files import locks
+
+
+class CacheDisco:
+    """
+    Cache de archivos en disco con tamaño máximo y desalojo LRU.
+
+    Cada entrada es un archivo `<directorio>/<clave[:2]>/<clave>`; el mtime
+    se actualiza en cada acierto y, cuando se supera `max_bytes`, se borran
+    las entradas menos usadas hasta bajar al 90%. El total se lleva en
+    memoria y se recalcula al desalojar, así que varios procesos pueden
+    compartir el mismo directorio.
+    """
+
+    def __init__(self, directorio, max_bytes):
+        self.directorio = str(directorio)
+        self.max_bytes = max_bytes
+        self._total = None
+        self._lock = threading.Lock()
+
+    def ruta(self, clave):
+        return os.path.join(self.directorio, clave[:2], clave)
+
+    def get(self, clave):
+        """Ruta de la entrada si existe (y la marca como usada), o None"""
+        ruta = self.ruta(clave)
+        try:
+            os.utime(ruta)
+        except FileNotFoundError:
+            return None
+        return ruta
+
+    def put(self, clave, contenido):
+        ruta = self.ruta(clave)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        temporal = f'{ruta}.{uuid.uuid4().hex[:8]}.tmp'
+        with open(temporal, 'wb') as archivo:
+            archivo.write(contenido)
+        os.replace(temporal, ruta)
+
+        with self._lock:
+            if self._total is None:
+                self._total = self._escanear_total()
+            else:
+                self._total += len(contenido)
+            if self._total > self.max_bytes:
+                self._desalojar()
+        return ruta
+
+    @contextmanager
+    def bloqueo(self, clave):
+        """
+        Lock exclusivo por clave, entre hilos y procesos: sólo uno genera la
+        entrada y el resto espera y la lee de la cache.
+        """
+        ruta = self.ruta(clave) + '.lock'
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(ruta, 'wb') as archivo:
+            locks.lock(archivo, locks.LOCK_EX)
+            try:
+                yield
+            finally:
+                locks.unlock(archivo)
+
+    def _entradas(self):
+        for carpeta, _, archivos in os.walk(self.directorio):
+            for nombre in archivos:
+                if nombre.endswith(('.lock', '.tmp')):
+                    continue
+                ruta = os.path.join(carpeta, nombre)
+                try:
+                    estado = os.stat(ruta)
+                except FileNotFoundError:
+                    continue
+                yield estado.st_mtime, estado.st_size, ruta
+
+    def _escanear_total(self):
+        return sum(tamano for _, tamano, _ in self._entradas())
+
+    def _desalojar(self):
+        entradas = sorted(self._entradas())
+        total = sum(tamano for _, tamano, _ in entradas)
+        objetivo = self.max_bytes * 0.9
+        for _, tamano, ruta in entradas:
+            if total <= objetivo:
+                break
+            for archivo in (ruta, ruta + '.lock'):
+                try:
+                    os.remove(archivo)
+                except FileNotFoundError:
+                    pass
+            total -= tamano
+        self._total = total
@@ -0,0 +1,140 @@
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+
+from .models import Producto, ProductoStock, ProductoDisponibilidad, Color, Talle
+
+
+def calcular_disponibilidad(producto_ids):
+    """
+    Filas de disponibilidad (sin guardar) de los productos dados, calculadas
+    con una sola consulta sobre ProductoStock
+    """
+    colores = defaultdict(set)
+    talles = defaultdict(set)
+    variantes = ProductoStock.objects.filter(
+        producto_id__in=producto_ids, stock__gt=0
+    ).values_list('producto_id', 'color_id', 'talle_id')
+    for producto_id, color_id, talle_id in variantes:
+        colores[producto_id].add(color_id)
+        talles[producto_id].add(talle_id)
+
+    return [
+        ProductoDisponibilidad(
+            producto_id=producto_id,
+            colores=sorted(colores[producto_id]),
+            talles=sorted(talles[producto_id]),
+        )
+        for producto_id in producto_ids
+    ]
+
+
+def recalcular_disponibilidad(producto_ids):
+    """
+    Recalcula el índice de colores/talles con stock para los productos dados.
+
+    Hace una sola consulta sobre ProductoStock y un upsert en bloque, así que
+    el costo no depende de cuántas variantes tenga cada producto.
+    Devuelve un dict {producto_id: ProductoDisponibilidad}.
+    """
+    producto_ids = set(
+        Producto.objects.filter(id__in=set(producto_ids)).values_list('id', flat=True)
+    )
+    if not producto_ids:
+        return {}
+
+    filas = calcular_disponibilidad(producto_ids)
+    ProductoDisponibilidad.objects.bulk_create(
+        filas,
+        update_conflicts=True,
+        unique_fields=['producto'],
+        update_fields=['colores', 'talles', 'actualizado'],
+    )
+    return {fila.producto_id: fila for fila in filas}
+
+
+def adjuntar_disponibilidad(productos):
+    """
+    Asigna a cada producto sus colores y talles con stock.
+
+    Usa la fila de disponibilidad si ya vino con select_related('disponibilidad'),
+    y trae las que falten en una sola consulta. Si un producto todavía no tiene
+    fila se calcula desde el stock sin guardarla: las lecturas no escriben, el
+    índice lo mantienen las señales, la migración y recalcular_disponibilidad.
+    Los objetos Color/Talle se resuelven con una consulta por tabla para toda
+    la lista.
+    """
+    productos = list(productos)
+    if not productos:
+        return productos
+
+    indice, faltantes = _precargadas(productos)
+    if faltantes:
+        for fila in ProductoDisponibilidad.objects.filter(producto_id__in=faltantes):
+            indice[fila.producto_id] = fila
+        sin_indice = [pid for pid in faltantes if pid not in indice]
+        if sin_indice:
+            indice.update((fila.producto_id, fila) for fila in calcular_disponibilidad(sin_indice))
+
+    color_ids, talle_ids = _ids_usados(indice)
+    colores = Color.objects.in_bulk(color_ids) if color_ids else {}
+    talles = Talle.objects.in_bulk(talle_ids) if talle_ids else {}
+    return _asignar(productos, indice, colores, talles)
+
+
+async def aadjuntar_disponibilidad(productos):
+    """Versión async de `adjuntar_disponibilidad`"""
+    productos = list(productos)
+    if not productos:
+        return productos
+
+    indice, faltantes = _precargadas(productos)
+    if faltantes:
+        async for fila in ProductoDisponibilidad.objects.filter(producto_id__in=faltantes):
+            indice[fila.producto_id] = fila
+        sin_indice = [pid for pid in faltantes if pid not in indice]
+        if sin_indice:
+            filas = await sync_to_async(calcular_disponibilidad)(sin_indice)
+            indice.update((fila.producto_id, fila) for fila in filas)
+
+    color_ids, talle_ids = _ids_usados(indice)
+    colores = await Color.objects.ain_bulk(color_ids) if color_ids else {}
+    talles = await Talle.objects.ain_bulk(talle_ids) if talle_ids else {}
+    return _asignar(productos, indice, colores, talles)
+
+
+def _precargadas(productos):
+    """Filas de disponibilidad que ya vinieron con select_related, y los ids que faltan"""
+    indice = {}
+    faltantes = []
+    for producto in productos:
+        if 'disponibilidad' in producto._state.fields_cache:
+            fila = producto._state.fields_cache['disponibilidad']
+            if fila is not None:
+                indice[producto.id] = fila
+                continue
+        faltantes.append(producto.id)
+    return indice, faltantes
+
+
+def _ids_usados(indice):
+    color_ids = set()
+    talle_ids = set()
+    for fila in indice.values():
+        color_ids.update(fila.colores)
+        talle_ids.update(fila.talles)
+    return color_ids, talle_ids
+
+
+def _asignar(productos, indice, colores, talles):
+    for producto in productos:
+        fila = indice.get(producto.id)
+        producto._colores_con_stock = sorted(
+            (colores[i] for i in (fila.colores if fila else []) if i in colores),
+            key=lambda c: (c.order, c.nombre),
+        )
+        producto._talles_con_stock = sorted(
+            (talles[i] for i in (fila.talles if fila else []) if i in talles),
+            key=lambda t: (t.order, t.nombre),
+        )
+    return productos
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils.module_loading import import_string
+
+from .models import ProductoStock
+
+
+class Suscripcion:
+    """Cola de eventos de un cliente conectado, atada a su event loop"""
+
+    def __init__(self, broker, canales, max_pendientes=100):
+        self.broker = broker
+        self.canales = frozenset(canales)
+        self._loop = asyncio.get_running_loop()
+        self._cola = asyncio.Queue(maxsize=max_pendientes)
+
+    def entregar(self, mensaje):
+        """Thread-safe: se llama desde el hilo que publica"""
+        try:
+            self._loop.call_soon_threadsafe(self._encolar, mensaje)
+        except RuntimeError:
+            # El loop ya se cerró: el cliente se fue
+            pass
+
+    def _encolar(self, mensaje):
+        try:
+            self._cola.put_nowait(mensaje)
+        except asyncio.QueueFull:
+            # Cliente lento: los eventos son avisos de "algo cambió", perder
+            # algunos no importa mientras quede alguno en la cola
+            pass
+
+    async def recibir(self, timeout):
+        """Próximo evento, o None si pasan `timeout` segundos sin ninguno"""
+        try:
+            return await asyncio.wait_for(self._cola.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def cerrar(self):
+        self.broker.desuscribir(self)
+
+
+class BrokerLocal:
+    """
+    Pub/sub en memoria del proceso. Una suscripción es una cola asyncio, no
+    un hilo. Alcanza con un solo worker ASGI (las vistas síncronas corren en
+    hilos del mismo proceso); con varios workers se configura
+    EVENTOS_BROKER con una clase de la misma interfaz (`suscribir`,
+    `publicar`, `escuchando`) sobre un broker externo.
+    """
+
+    def __init__(self):
+        self._suscriptores = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def suscribir(self, canales):
+        """Debe llamarse desde el event loop que va a consumir los eventos"""
+        suscripcion = Suscripcion(self, canales)
+        with self._lock:
+            for canal in suscripcion.canales:
+                self._suscriptores[canal].add(suscripcion)
+        return suscripcion
+
+    def desuscribir(self, suscripcion):
+        with self._lock:
+            for canal in suscripcion.canales:
+                suscriptores = self._suscriptores.get(canal)
+                if suscriptores is not None:
+                    suscriptores.discard(suscripcion)
+                    if not suscriptores:
+                        del self._suscriptores[canal]
+
+    def escuchando(self, canal):
+        return canal in self._suscriptores
+
+    def publicar(self, canal, datos):
+        with self._lock:
+            suscriptores = list(self._suscriptores.get(canal, ()))
+        if not suscriptores:
+            return 0
+        mensaje = (canal.split(':', 1)[0], json.dumps(datos))
+        for suscripcion in suscriptores:
+            suscripcion.entregar(mensaje)
+        return len(suscriptores)
+
+
+_broker = None
+
+
+def get_broker():
+    """Broker configurado en EVENTOS_BROKER, o el local en memoria"""
+    global _broker
+    if _broker is None:
+        ruta = getattr(settings, 'EVENTOS_BROKER', None)
+        _broker = import_string(ruta)() if ruta else BrokerLocal()
+    return _broker
+
+
+# Canales:
+#   carrito:<id>  el carrito cambió (el cliente vuelve a pedir /carrito/data/)
+#   stock:<id>    cambió el stock libre de alguna variante del producto
+
+def _publicar_carrito(carrito_id):
+    get_broker().publicar(f'carrito:{carrito_id}', {'carrito_id': carrito_id})
+
+
+def _publicar_stock(producto_ids):
+    broker = get_broker()
+    producto_ids = [pk for pk in producto_ids if broker.escuchando(f'stock:{pk}')]
+    if not producto_ids:
+        # Nadie mirando esos productos: no se consulta la base
+        return
+    variantes = defaultdict(list)
+    filas = ProductoStock.objects.filter(producto_id__in=producto_ids).values_list(
+        'producto_id', 'color_id', 'talle_id', 'stock', F('stock') - F('reservado')
+    )
+    for producto_id, color_id, talle_id, stock, libre in filas:
+        variantes[producto_id].append({
+            'color_id': color_id, 'talle_id': talle_id, 'stock': stock, 'libre': max(libre, 0),
+        })
+    for producto_id in producto_ids:
+        broker.publicar(f'stock:{producto_id}', {
+            'producto_id': producto_id, 'variantes': variantes[producto_id],
+        })
+
+
+def avisar_carrito(carrito_id):
+    """Publica el cambio del carrito cuando la transacción confirma"""
+    transaction.on_commit(lambda: _publicar_carrito(carrito_id), robust=True)
+
+
+def avisar_stock(producto_ids):
+    """Publica el stock libre de los productos cuando la transacción confirma"""
+    producto_ids = set(producto_ids)
+    if producto_ids:
+        transaction.on_commit(lambda: _publicar_stock(producto_ids), robust=True)
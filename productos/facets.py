@@ -0,0 +1,133 @@
+import hashlib
+
+from django.core.cache import cache
+from django.db.models import Count, F, Value, CharField
+
+from .models import ContadorVersion, Producto
+from .search import get_backend
+
+# faceta (parámetro GET) -> campo por el que se filtra y agrupa
+FACETAS = {
+    'categoria': 'categoria_id',
+    'color': 'colores__id',
+    'talle': 'stock_items__talle_id',
+    'marca': 'marca_id',
+}
+
+FACETAS_CACHE_TIMEOUT = 60 * 15
+FACETAS_VERSION_KEY = 'facetas:version'
+
+
+def filtros_activos(params):
+    """Extrae los filtros de facetas (y la búsqueda `q`) de un QueryDict, ignorando valores vacíos"""
+    filtros = {}
+    for faceta in FACETAS:
+        valor = params.get(faceta)
+        if valor and valor.isdigit():
+            filtros[faceta] = valor
+    q = params.get('q', '').strip()
+    if q:
+        filtros['q'] = q
+    return filtros
+
+
+def aplicar_filtros(queryset, filtros, excluir=None):
+    """Aplica los filtros de facetas al queryset (opcionalmente salvo uno)"""
+    distinct = False
+    for faceta, valor in filtros.items():
+        if faceta == excluir:
+            continue
+        if faceta == 'q':
+            queryset = get_backend().filtrar(queryset, valor)
+            continue
+        campo = FACETAS[faceta]
+        queryset = queryset.filter(**{campo: valor})
+        distinct = distinct or '__' in campo
+    return queryset.distinct() if distinct else queryset
+
+
+def _union_facetas(filtros):
+    """
+    Cuenta productos por valor de cada faceta en una sola consulta.
+
+    Cada faceta se agrupa con el resto de filtros activos aplicados (pero no
+    el propio), y los cuatro GROUP BY viajan juntos en un UNION ALL.
+    """
+    consultas = []
+    for faceta, campo in FACETAS.items():
+        qs = aplicar_filtros(Producto.objects.order_by(), filtros, excluir=faceta)
+        consultas.append(
+            qs.filter(**{f'{campo}__isnull': False})
+            .annotate(faceta=Value(faceta, output_field=CharField()), valor=F(campo))
+            .values('faceta', 'valor')
+            .annotate(total=Count('id', distinct=True))
+            .order_by()
+        )
+    return consultas[0].union(*consultas[1:], all=True)
+
+
+def _calcular_facetas(filtros):
+    conteos = {faceta: {} for faceta in FACETAS}
+    for fila in _union_facetas(filtros):
+        conteos[fila['faceta']][fila['valor']] = fila['total']
+    return conteos
+
+
+async def _acalcular_facetas(filtros):
+    conteos = {faceta: {} for faceta in FACETAS}
+    async for fila in _union_facetas(filtros):
+        conteos[fila['faceta']][fila['valor']] = fila['total']
+    return conteos
+
+
+# La versión vive en la base y no en la cache: la cache por defecto es por
+# proceso, y un cambio hecho en un worker tiene que invalidar los conteos
+# cacheados en todos. Leerla es una consulta por clave primaria
+
+def get_version():
+    return ContadorVersion.objects.filter(clave=FACETAS_VERSION_KEY).values_list('valor', flat=True).first() or 0
+
+
+async def aget_version():
+    return await ContadorVersion.objects.filter(clave=FACETAS_VERSION_KEY).values_list('valor', flat=True).afirst() or 0
+
+
+def invalidar_facetas():
+    """Invalida todas las combinaciones cacheadas de facetas, en todos los workers"""
+    if not ContadorVersion.objects.filter(clave=FACETAS_VERSION_KEY).update(valor=F('valor') + 1):
+        _, creado = ContadorVersion.objects.get_or_create(clave=FACETAS_VERSION_KEY, defaults={'valor': 1})
+        if not creado:
+            ContadorVersion.objects.filter(clave=FACETAS_VERSION_KEY).update(valor=F('valor') + 1)
+
+
+def _clave(filtros, version):
+    combinacion = '&'.join(f'{k}={v}' for k, v in sorted(filtros.items()))
+    return 'facetas:{}:{}'.format(version, hashlib.md5(combinacion.encode()).hexdigest())
+
+
+def contar_facetas(filtros):
+    """Conteos por faceta para la combinación de filtros dada, cacheados por versión"""
+    clave = _clave(filtros, get_version())
+    conteos = cache.get(clave)
+    if conteos is None:
+        conteos = _calcular_facetas(filtros)
+        cache.set(clave, conteos, FACETAS_CACHE_TIMEOUT)
+    return conteos
+
+
+async def acontar_facetas(filtros):
+    """Versión async de `contar_facetas`"""
+    clave = _clave(filtros, await aget_version())
+    conteos = await cache.aget(clave)
+    if conteos is None:
+        conteos = await _acalcular_facetas(filtros)
+        await cache.aset(clave, conteos, FACETAS_CACHE_TIMEOUT)
+    return conteos
+
+
+def anotar_conteos(objetos, conteos):
+    """Asigna `num_productos` a cada valor de faceta para mostrarlo en el sidebar"""
+    objetos = list(objetos)
+    for obj in objetos:
+        obj.num_productos = conteos.get(obj.id, 0)
+    return objetos
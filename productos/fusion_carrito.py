@@ -0,0 +1,162 @@
+import logging
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .eventos import avisar_carrito, avisar_stock
+from .models import Carrito, CarritoItem, ProductoStock
+from .reservas import _SinStock, _sumar_reservas
+from .resumen_carrito import CLAVE_SESION
+
+logger = logging.getLogger(__name__)
+
+
+def _variante(item):
+    return (item.producto_id, item.color_id, item.talle_id)
+
+
+def _stock_libre(producto_ids):
+    """Stock libre (sin reservas) de las variantes de esos productos"""
+    filas = ProductoStock.objects.filter(producto_id__in=producto_ids).values_list(
+        'producto_id', 'color_id', 'talle_id', F('stock') - F('reservado'),
+    )
+    return {(p, c, t): max(libre, 0) for p, c, t, libre in filas}
+
+
+def _reservar_hasta(clave, delta):
+    """
+    Reserva hasta `delta` unidades de la variante, las que alcance el stock
+    libre, con el mismo UPDATE condicional de reservas.reservar. Devuelve
+    cuántas se reservaron.
+    """
+    variante = ProductoStock.objects.filter(producto_id=clave[0], color_id=clave[1], talle_id=clave[2])
+    while delta > 0:
+        if variante.filter(stock__gte=F('reservado') + delta).update(reservado=F('reservado') + delta):
+            return delta
+        libre = variante.values_list(F('stock') - F('reservado'), flat=True).first() or 0
+        delta = min(delta, max(libre, 0))
+    return 0
+
+
+def fusionar_carritos(invitado, usuario):
+    """
+    Pasa los items del carrito `invitado` al carrito de `usuario`.
+
+    Las cantidades de una misma variante se suman y se recortan al stock
+    disponible (stock libre más lo que ya reservaban los dos carritos). La
+    cantidad de consultas no depende del tamaño de los carritos: una para
+    los items, una para el stock, UPDATEs con CASE para ajustar las reservas
+    (condicionales para las que suben) y un upsert sobre la clave única
+    (carrito, producto, color, talle). Si otro request tomó stock desde la
+    lectura, las variantes afectadas se achican a lo que quede libre.
+    Devuelve el carrito del usuario.
+    """
+    return _fusionar(invitado, Carrito.objects.filter(usuario=usuario).first(), usuario)
+
+
+def _fusionar(invitado, destino, usuario):
+    if destino is None:
+        # Caso más común: el usuario no tenía carrito, se adopta el del invitado
+        Carrito.objects.filter(pk=invitado.pk).update(
+            usuario=usuario, session_key=None, version=F('version') + 1, actualizado=timezone.now()
+        )
+        invitado.usuario, invitado.session_key = usuario, None
+        avisar_carrito(invitado.pk)
+        return invitado
+
+    invitado_id = invitado.pk
+    with transaction.atomic():
+        items = list(CarritoItem.objects.filter(carrito__in=[invitado, destino]))
+        propios = {_variante(i): i for i in items if i.carrito_id == destino.pk}
+        ajenos = [i for i in items if i.carrito_id == invitado.pk]
+        libres = _stock_libre({i.producto_id for i in ajenos})
+
+        # Cantidad buscada de cada variante, recortada al stock leído. La
+        # lectura puede quedar vieja: las reservas son condicionales (abajo)
+        cantidades, reservado_antes, deltas = {}, {}, {}
+        for ajeno in ajenos:
+            clave = _variante(ajeno)
+            propio = propios.get(clave)
+            cantidad = ajeno.cantidad + (propio.cantidad if propio else 0)
+            reservado_antes[clave] = ajeno.reservado + (propio.reservado if propio else 0)
+            libre = libres.get(clave)
+            cantidades[clave] = min(cantidad, (libre or 0) + reservado_antes[clave])
+            if libre is not None and cantidades[clave] != reservado_antes[clave]:
+                deltas[clave] = cantidades[clave] - reservado_antes[clave]
+
+        suben = {clave: delta for clave, delta in deltas.items() if delta > 0}
+        if suben:
+            try:
+                with transaction.atomic():
+                    # Sólo se toma si alcanza el stock libre, como en reservas.reservar_lote
+                    tomadas = _sumar_reservas(suben, condicion=lambda delta: Q(stock__gte=F('reservado') + delta))
+                    if tomadas != len(suben):
+                        raise _SinStock()
+            except _SinStock:
+                # Otro comprador tomó stock desde la lectura: variante por
+                # variante, se reserva lo que quede y el item se achica
+                for clave, delta in suben.items():
+                    tomado = _reservar_hasta(clave, delta)
+                    cantidades[clave] -= delta - tomado
+                    deltas[clave] = tomado
+        bajan = {clave: delta for clave, delta in deltas.items() if delta < 0}
+        if bajan:
+            _sumar_reservas(bajan)
+
+        upsert, vacios = [], []
+        for clave, cantidad in cantidades.items():
+            if cantidad:
+                upsert.append(CarritoItem(
+                    carrito=destino, producto_id=clave[0], color_id=clave[1], talle_id=clave[2],
+                    cantidad=cantidad, reservado=cantidad,
+                ))
+            elif clave in propios:
+                vacios.append(propios[clave].pk)
+        if upsert:
+            CarritoItem.objects.bulk_create(
+                upsert,
+                update_conflicts=True,
+                unique_fields=['carrito', 'producto', 'color', 'talle'],
+                update_fields=['cantidad', 'reservado'],
+            )
+
+        # Las reservas de los items borrados ya están en `deltas`: las señales
+        # post_delete reconocen estos borrados y no las devuelven otra vez
+        # al stock (ver signals.py)
+        if vacios:
+            borrados = CarritoItem.objects.filter(pk__in=vacios)
+            borrados.reservas_liberadas = True
+            borrados.delete()
+        invitado.reservas_liberadas = True
+        invitado.delete()
+        Carrito.objects.filter(pk=destino.pk).tocar()
+        avisar_carrito(destino.pk)
+        avisar_stock(clave[0] for clave, delta in deltas.items() if delta)
+
+    logger.info('Carrito %s fusionado en %s (%s items)', invitado_id, destino.pk, len(ajenos))
+    return destino
+
+
+def fusionar_carrito_invitado(request, session_key):
+    """
+    Llamar justo después de `login()` con la session_key que tenía el
+    invitado: `login()` rota la clave y el carrito quedaría huérfano.
+    """
+    if not session_key:
+        return None
+    # El carrito del invitado y el del usuario en una sola consulta
+    invitado = destino = None
+    for carrito in Carrito.objects.filter(
+        Q(session_key=session_key, usuario__isnull=True) | Q(usuario=request.user)
+    ):
+        if carrito.usuario_id is None:
+            invitado = carrito
+        elif destino is None:
+            destino = carrito
+    if invitado is None:
+        return None
+    carrito = _fusionar(invitado, destino, request.user)
+    # El resumen del badge era el del invitado
+    request.session.pop(CLAVE_SESION, None)
+    return carrito
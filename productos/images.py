@@ -0,0 +1,163 @@
+import hashlib
+from io import BytesIO
+
+from django.conf import settings
+from PIL import Image, __version__ as PILLOW_VERSION
+
+# Tamaño del derivado principal de Producto.imagen
+TAMANO_DERIVADO = (450, 563)
+
+
+def hash_archivo(archivo):
+    """SHA-256 del contenido de un archivo, leído por bloques"""
+    sha = hashlib.sha256()
+    posicion = archivo.tell() if hasattr(archivo, 'tell') else None
+    archivo.seek(0)
+    for bloque in iter(lambda: archivo.read(64 * 1024), b''):
+        sha.update(bloque)
+    if posicion is not None:
+        archivo.seek(posicion)
+    return sha.hexdigest()
+
+
+def componer_canvas(img, tamano=TAMANO_DERIVADO):
+    """
+    Ajusta la imagen dentro de `tamano` manteniendo proporción y la centra
+    sobre un canvas blanco. Las transparencias se aplanan sobre blanco.
+    """
+    ancho, alto = tamano
+
+    # Convertir a RGB si es necesario (para PNG con transparencia)
+    if img.mode in ('RGBA', 'LA', 'P'):
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        if img.mode in ('P', 'LA'):
+            img = img.convert('RGBA')
+        background.paste(img, mask=img.split()[-1])
+        img = background
+    elif img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    # Calcular las nuevas dimensiones manteniendo proporción
+    img.thumbnail((ancho, alto), Image.Resampling.LANCZOS)
+
+    # Centrar la imagen en un canvas con fondo blanco
+    canvas = Image.new('RGB', (ancho, alto), (255, 255, 255))
+    offset_x = (ancho - img.width) // 2
+    offset_y = (alto - img.height) // 2
+    canvas.paste(img, (offset_x, offset_y))
+    return canvas
+
+
+def redimensionar(contenido, tamano=TAMANO_DERIVADO, formato='PNG', **opciones):
+    """
+    Genera un derivado a partir de los bytes de la imagen original.
+
+    Trabaja sólo con bytes para poder ejecutarse en un proceso aparte
+    (ProcessPoolExecutor) sin pasarle objetos de Django.
+    """
+    with Image.open(BytesIO(contenido)) as img:
+        img.draft('RGB', tamano)  # JPEG: decodificar ya reducido cuando se puede
+        canvas = componer_canvas(img, tamano)
+    output = BytesIO()
+    if formato == 'PNG':
+        opciones.setdefault('optimize', True)
+    canvas.save(output, format=formato, **opciones)
+    return output.getvalue()
+
+
+# Variantes responsivas (todas con la proporción 4:5 del derivado principal)
+VARIANTES = {
+    'thumb': (120, 150),
+    'card': (360, 450),
+    'detail': (720, 900),
+    'zoom': (1440, 1800),
+}
+
+# formato -> (formato de Pillow, content type, extensión, opciones de guardado)
+FORMATOS = {
+    'avif': ('AVIF', 'image/avif', 'avif', {'quality': 55}),
+    'webp': ('WEBP', 'image/webp', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'image/jpeg', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# Formato que entienden todos los navegadores, usado en <img src>
+FORMATO_FALLBACK = 'jpeg'
+
+
+def huella_formato(formato):
+    """
+    Resumen de cómo se codifica `formato`: sus opciones de guardado y la
+    versión de Pillow. Va en el nombre de los derivados, así un cambio de
+    calidad o de encoder genera archivos nuevos en lugar de reutilizar los
+    que ya existen.
+    """
+    formato_pil, _, _, opciones = FORMATOS[formato]
+    datos = f'{formato_pil}:{sorted(opciones.items())}:{PILLOW_VERSION}'
+    return hashlib.md5(datos.encode()).hexdigest()[:8]
+
+
+def formatos_activos():
+    """
+    Formatos configurados en IMAGENES_FORMATOS que la instalación de Pillow
+    puede escribir. El fallback siempre está incluido.
+    """
+    Image.init()
+    configurados = getattr(settings, 'IMAGENES_FORMATOS', ['webp', 'jpeg'])
+    activos = [f for f in FORMATOS if f in configurados and FORMATOS[f][0] in Image.SAVE]
+    if FORMATO_FALLBACK not in activos:
+        activos.append(FORMATO_FALLBACK)
+    return activos
+
+
+def generar_variantes(contenido, formatos=(FORMATO_FALLBACK,)):
+    """
+    Genera todas las variantes de VARIANTES en los formatos pedidos.
+
+    Se saltean los tamaños más grandes que el original (no tiene sentido
+    ampliar una foto chica), salvo el más chico. Como `redimensionar`, trabaja
+    sólo con bytes para poder correr en un ProcessPoolExecutor.
+    Devuelve {nombre: {formato: bytes}}.
+    """
+    tamanos = sorted(VARIANTES.items(), key=lambda item: item[1][0])
+    resultado = {}
+    with Image.open(BytesIO(contenido)) as img:
+        img.draft('RGB', tamanos[-1][1])
+        img.load()
+        for i, (nombre, tamano) in enumerate(tamanos):
+            if i > 0 and tamano[0] > img.width and tamano[1] > img.height:
+                break
+            canvas = componer_canvas(img.copy(), tamano)
+            resultado[nombre] = {}
+            for formato in formatos:
+                formato_pil, _, _, opciones = FORMATOS[formato]
+                output = BytesIO()
+                canvas.save(output, format=formato_pil, **opciones)
+                resultado[nombre][formato] = output.getvalue()
+    return resultado
+
+
+# Opciones de recompresión sin cambiar el formato ni la resolución
+RECOMPRESION = {
+    'PNG': {'optimize': True},
+    'JPEG': {'quality': 'keep', 'optimize': True, 'progressive': True},
+    'WEBP': {'lossless': True, 'method': 6},
+}
+
+
+def optimizar(contenido):
+    """
+    Recomprime una imagen en su mismo formato (para logos y originales que
+    no tienen variantes). Devuelve los bytes nuevos, o None si el formato no
+    se soporta o el resultado no es más chico que el original.
+    """
+    with Image.open(BytesIO(contenido)) as img:
+        opciones = RECOMPRESION.get(img.format)
+        if opciones is None:
+            return None
+        formato = img.format
+        if img.info.get('icc_profile'):
+            opciones = {**opciones, 'icc_profile': img.info['icc_profile']}
+        output = BytesIO()
+        img.save(output, format=formato, **opciones)
+    resultado = output.getvalue()
+    return resultado if len(resultado) < len(contenido) else None
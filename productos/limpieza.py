@@ -0,0 +1,77 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import Carrito
+
+logger = logging.getLogger(__name__)
+
+# Motores de sesión que guardan las sesiones en django_session
+MOTORES_SESION_DB = (
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+)
+
+
+def _borrar_por_lotes(queryset, lote, simular=False):
+    """
+    Borra las filas de `queryset` de a `lote`, cada lote en su propia
+    transacción, para no bloquear la tabla con un DELETE enorme.
+    Devuelve la cantidad de filas (principales) borradas.
+    """
+    if simular:
+        return queryset.count()
+    borradas = 0
+    while True:
+        claves = list(queryset.values_list('pk', flat=True)[:lote])
+        if not claves:
+            return borradas
+        queryset.model.objects.filter(pk__in=claves).delete()
+        borradas += len(claves)
+
+
+def sesiones_vencidas():
+    return Session.objects.filter(expire_date__lt=timezone.now())
+
+
+def carritos_vacios(horas=None):
+    """Carritos sin items y sin actividad en las últimas `horas`"""
+    if horas is None:
+        horas = getattr(settings, 'CARRITO_VACIO_HORAS', 24)
+    limite = timezone.now() - timedelta(hours=horas)
+    return Carrito.objects.filter(actualizado__lt=limite, items__isnull=True)
+
+
+def carritos_invitados_vencidos(dias=None):
+    """
+    Carritos de invitados abandonados: sin actividad en CARRITO_INVITADO_DIAS
+    o cuya sesión ya no existe (nadie puede volver a abrirlos).
+    """
+    if dias is None:
+        dias = getattr(settings, 'CARRITO_INVITADO_DIAS', 7)
+    vencidos = Q(actualizado__lt=timezone.now() - timedelta(days=dias))
+    if settings.SESSION_ENGINE in MOTORES_SESION_DB:
+        vencidos |= ~Exists(Session.objects.filter(session_key=OuterRef('session_key')))
+    return Carrito.objects.filter(vencidos, usuario__isnull=True)
+
+
+def purgar(lote=500, dias=None, horas=None, simular=False):
+    """
+    Borra sesiones vencidas, carritos vacíos y carritos de invitados
+    abandonados, en lotes de `lote` filas. Las sesiones van primero para que
+    sus carritos queden huérfanos y caigan en la misma pasada. Al borrar un
+    carrito sus items liberan el stock reservado (ver signals.py).
+    Devuelve un dict con la cantidad borrada de cada tipo.
+    """
+    resultado = {}
+    if settings.SESSION_ENGINE in MOTORES_SESION_DB:
+        resultado['sesiones'] = _borrar_por_lotes(sesiones_vencidas(), lote, simular)
+    resultado['carritos_vacios'] = _borrar_por_lotes(carritos_vacios(horas), lote, simular)
+    resultado['carritos_invitados'] = _borrar_por_lotes(carritos_invitados_vencidos(dias), lote, simular)
+    if not simular and any(resultado.values()):
+        logger.info('Purga de carritos: %s', resultado)
+    return resultado
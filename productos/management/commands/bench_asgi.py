@@ -0,0 +1,140 @@
+import asyncio
+import io
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+RUTAS = ['/', '/productos/', '/productos/?q=remera']
+HOST = 'localhost'
+
+
+def _percentil(tiempos, p):
+    return tiempos[min(len(tiempos) - 1, int(len(tiempos) * p))]
+
+
+def _resumen(tiempos, duracion, errores):
+    tiempos.sort()
+    return {
+        'rps': len(tiempos) / duracion if duracion else 0,
+        'p50': statistics.median(tiempos) * 1000,
+        'p99': _percentil(tiempos, 0.99) * 1000,
+        'errores': errores,
+    }
+
+
+def _separar(ruta):
+    path, _, query = ruta.partition('?')
+    return path, query
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara requests/s y latencia p99 de la tienda servida por el handler '
+        'WSGI (un hilo por request concurrente) y por el handler ASGI (una '
+        'corrutina por request) a la misma concurrencia. Corre dentro del '
+        'proceso, sin servidor HTTP: mide la pila de Django (middleware, '
+        'vistas, ORM y plantillas) y no la red. Usa la base configurada, así '
+        'que conviene correrlo contra un catálogo cargado (ver seed_catalog).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rutas', nargs='+', default=RUTAS)
+        parser.add_argument('--concurrencia', type=int, nargs='+', default=[1, 16, 64])
+        parser.add_argument('--requests', type=int, default=300,
+                            help='Requests por ruta, modo y nivel de concurrencia')
+        parser.add_argument('--calentamiento', type=int, default=10)
+
+    def handle(self, *args, **options):
+        wsgi = WSGIHandler()
+        asgi = ASGIHandler()
+        self.stdout.write(
+            f'{"ruta":<28} {"modo":<5} {"conc":>5} {"req/s":>9} {"p50 ms":>9} {"p99 ms":>9} {"errores":>8}'
+        )
+        for ruta in options['rutas']:
+            for concurrencia in options['concurrencia']:
+                for modo, medir in (('wsgi', self._medir_wsgi), ('asgi', self._medir_asgi)):
+                    handler = wsgi if modo == 'wsgi' else asgi
+                    medir(handler, ruta, options['calentamiento'], concurrencia)
+                    r = medir(handler, ruta, options['requests'], concurrencia)
+                    self.stdout.write(
+                        f'{ruta:<28} {modo:<5} {concurrencia:>5} {r["rps"]:>9.1f} '
+                        f'{r["p50"]:>9.2f} {r["p99"]:>9.2f} {r["errores"]:>8}'
+                    )
+
+    # WSGI: como un servidor con un pool de hilos (gunicorn --threads)
+
+    def _medir_wsgi(self, handler, ruta, total, concurrencia):
+        path, query = _separar(ruta)
+
+        def pedir(_):
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query,
+                'SCRIPT_NAME': '', 'SERVER_NAME': HOST, 'SERVER_PORT': '80',
+                'HTTP_HOST': HOST, 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'wsgi.input': io.BytesIO(), 'wsgi.errors': io.StringIO(),
+                'wsgi.url_scheme': 'http', 'wsgi.version': (1, 0),
+                'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+            }
+            estado = []
+            inicio = time.perf_counter()
+            respuesta = handler(environ, lambda status, headers, exc_info=None: estado.append(status))
+            try:
+                for _ in respuesta:
+                    pass
+            finally:
+                respuesta.close()
+                connections.close_all()
+            return time.perf_counter() - inicio, not estado[0].startswith('200')
+
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+            resultados = list(pool.map(pedir, range(total)))
+        duracion = time.perf_counter() - inicio
+        return _resumen([t for t, _ in resultados], duracion, sum(e for _, e in resultados))
+
+    # ASGI: todas las requests en un event loop, como uvicorn/daphne
+
+    def _medir_asgi(self, handler, ruta, total, concurrencia):
+        return asyncio.run(self._asgi(handler, ruta, total, concurrencia))
+
+    async def _asgi(self, handler, ruta, total, concurrencia):
+        path, query = _separar(ruta)
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+            'query_string': query.encode(), 'root_path': '',
+            'headers': [(b'host', HOST.encode())],
+            'client': ('127.0.0.1', 50000), 'server': (HOST, 80),
+        }
+        semaforo = asyncio.Semaphore(concurrencia)
+
+        async def pedir():
+            async with semaforo:
+                estado = []
+                enviado = False
+
+                async def receive():
+                    nonlocal enviado
+                    if not enviado:
+                        enviado = True
+                        return {'type': 'http.request', 'body': b'', 'more_body': False}
+                    # Django escucha la desconexión mientras responde: no llega nunca
+                    await asyncio.Future()
+
+                async def send(mensaje):
+                    if mensaje['type'] == 'http.response.start':
+                        estado.append(mensaje['status'])
+
+                inicio = time.perf_counter()
+                await handler(dict(scope), receive, send)
+                return time.perf_counter() - inicio, estado[0] != 200
+
+        inicio = time.perf_counter()
+        resultados = await asyncio.gather(*(pedir() for _ in range(total)))
+        duracion = time.perf_counter() - inicio
+        return _resumen([t for t, _ in resultados], duracion, sum(e for _, e in resultados))
@@ -0,0 +1,100 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from productos.models import Categoria, Marca, Producto
+from productos.search import get_backend, BasicSearchBackend
+
+PALABRAS = [
+    'remera', 'pantalón', 'camisa', 'campera', 'buzo', 'vestido', 'pollera',
+    'algodón', 'lino', 'jean', 'cuero', 'lana', 'seda', 'básico', 'clásico',
+    'urbano', 'deportivo', 'elegante', 'verano', 'invierno', 'estampado',
+    'liso', 'rayado', 'oversize', 'slim', 'recto', 'acampanado', 'corto',
+    'largo', 'manga', 'cuello', 'botón', 'cierre', 'bolsillo', 'capucha',
+]
+
+# Vocabulario de relleno para las descripciones, para que la frecuencia de
+# los términos se parezca a la de un catálogo real
+SILABAS = ['ma', 'te', 'ri', 'lo', 'sa', 'no', 'ca', 'de', 'tu', 'pe', 'vi', 'ro', 'gan', 'tel', 'bor']
+
+CONSULTAS = ['pantalon', 'camisa lino', 'algod', 'campera cuero invierno', 'remera estampado']
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide la latencia de la búsqueda de productos a distintos tamaños de '
+        'catálogo. Todo se genera dentro de una transacción que se descarta.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+        parser.add_argument('--repeticiones', type=int, default=20)
+        parser.add_argument('--limite', type=int, default=24)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--comparar-icontains', action='store_true')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._bench(options)
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _medir(self, backend, limite, repeticiones):
+        tiempos = []
+        for _ in range(repeticiones):
+            for q in CONSULTAS:
+                inicio = time.perf_counter()
+                backend.buscar(q, limite)
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+        tiempos.sort()
+        return statistics.median(tiempos), tiempos[int(len(tiempos) * 0.95) - 1]
+
+    def _bench(self, options):
+        rng = random.Random(options['seed'])
+        backend = get_backend()
+        basico = BasicSearchBackend()
+        relleno = [
+            ''.join(rng.choices(SILABAS, k=rng.randint(2, 4))) for _ in range(5000)
+        ]
+        categoria = Categoria.objects.create(nombre='Benchmark')
+        marcas = Marca.objects.bulk_create(
+            Marca(nombre=f'Marca bench {i}') for i in range(50)
+        )
+
+        self.stdout.write(f'Backend: {type(backend).__name__}')
+        encabezado = f'{"productos":>10} {"p50 ms":>9} {"p95 ms":>9}'
+        if options['comparar_icontains']:
+            encabezado += f' {"icontains p50":>14}'
+        self.stdout.write(encabezado)
+
+        total = 0
+        for size in sorted(options['sizes']):
+            nuevos = [
+                Producto(
+                    nombre=' '.join(rng.sample(PALABRAS, 3)).capitalize(),
+                    descripcion=' '.join(rng.choices(PALABRAS, k=2) + rng.choices(relleno, k=18)),
+                    precio=rng.randint(1000, 90000),
+                    categoria=categoria,
+                    marca=rng.choice(marcas),
+                )
+                for _ in range(size - total)
+            ]
+            creados = Producto.objects.bulk_create(nuevos, batch_size=1000)
+            backend.indexar([p.id for p in creados])
+            total = size
+
+            p50, p95 = self._medir(backend, options['limite'], options['repeticiones'])
+            linea = f'{size:>10} {p50:>9.2f} {p95:>9.2f}'
+            if options['comparar_icontains']:
+                basico_p50, _ = self._medir(basico, options['limite'], max(1, options['repeticiones'] // 5))
+                linea += f' {basico_p50:>14.2f}'
+            self.stdout.write(linea)
@@ -0,0 +1,355 @@
+import http.client
+import json
+import multiprocessing
+import random
+import time
+from collections import Counter, defaultdict
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.urls import reverse
+
+from productos.bench import comparar, cargar_resultado, guardar_resultado, resumen_tiempos, ultimo_resultado
+from productos.models import Categoria, Color, Marca, Producto, ProductoStock, Talle
+
+# Términos del vocabulario de seed_catalog
+TERMINOS = ['remera', 'campera cuero', 'jean', 'algodón', 'buzo capucha', 'vestido lino']
+PANEL = ['dashboard', 'admin_productos', 'categorias', 'colores', 'marcas', 'talles', 'clientes', 'direcciones', 'stock']
+ESCENARIOS = {'tienda': 6, 'carrito': 3, 'panel': 1}
+METRICAS_COMPARADAS = ['p50', 'p95', 'consultas']
+
+
+class Cliente:
+    """Cliente HTTP/1.1 con keep-alive y cookies: una sesión de navegador sin JS"""
+
+    def __init__(self, url, timeout):
+        partes = urlsplit(url)
+        self.clase = http.client.HTTPSConnection if partes.scheme == 'https' else http.client.HTTPConnection
+        self.host, self.puerto = partes.hostname, partes.port
+        self.base = partes.path.rstrip('/')
+        self.timeout = timeout
+        self.cookies = {}
+        self.conexion = None
+
+    def pedir(self, metodo, ruta, cuerpo=None, headers=None):
+        """Devuelve (respuesta, cuerpo, segundos)"""
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v}' for k, v in self.cookies.items())
+        for intento in range(2):
+            if self.conexion is None:
+                self.conexion = self.clase(self.host, self.puerto, timeout=self.timeout)
+            try:
+                inicio = time.perf_counter()
+                self.conexion.request(metodo, self.base + ruta, body=cuerpo, headers=headers)
+                respuesta = self.conexion.getresponse()
+                contenido = respuesta.read()
+                duracion = time.perf_counter() - inicio
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # El servidor cerró la conexión keep-alive: se reintenta una vez
+                self.conexion.close()
+                self.conexion = None
+                if intento:
+                    raise
+        if respuesta.getheader('Connection', '').lower() == 'close':
+            self.conexion.close()
+            self.conexion = None
+        for valor in respuesta.headers.get_all('Set-Cookie') or []:
+            for nombre, morsel in SimpleCookie(valor).items():
+                if morsel.value and morsel['max-age'] != '0':
+                    self.cookies[nombre] = morsel.value
+                else:
+                    self.cookies.pop(nombre, None)
+        return respuesta, contenido, duracion
+
+
+class Visita:
+    """Un usuario virtual: hace requests con su Cliente y registra cada paso"""
+
+    def __init__(self, cliente, muestras):
+        self.cliente = cliente
+        self.muestras = muestras
+        self.registrar = False
+
+    def _pedir(self, paso, metodo, ruta, cuerpo=None, headers=None):
+        respuesta, contenido, duracion = self.cliente.pedir(metodo, ruta, cuerpo, headers)
+        if self.registrar and paso:
+            consultas = respuesta.getheader('X-Consultas')
+            self.muestras.append((paso, respuesta.status, duracion, int(consultas) if consultas else None))
+        return respuesta, contenido
+
+    def get(self, paso, ruta):
+        return self._pedir(paso, 'GET', ruta)
+
+    def post(self, paso, ruta, datos, formulario=False):
+        headers = {'X-CSRFToken': self.cliente.cookies.get('csrftoken', '')}
+        if formulario:
+            datos = {**datos, 'csrfmiddlewaretoken': headers['X-CSRFToken']}
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            cuerpo = urlencode(datos)
+        else:
+            headers['Content-Type'] = 'application/json'
+            cuerpo = json.dumps(datos)
+        return self._pedir(paso, 'POST', ruta, cuerpo, headers)
+
+
+# Escenarios: cada uno es un flujo de varias páginas de un mismo usuario
+
+def tienda(visita, rng, datos):
+    rutas = datos['rutas']
+    visita.get('inicio', rutas['inicio'])
+    visita.get('catalogo', rutas['productos'])
+    filtros = {
+        clave: rng.choice(datos[clave])
+        for clave in rng.sample(['categoria', 'marca', 'color', 'talle'], rng.randint(1, 2))
+    }
+    visita.get('catalogo_filtros', f"{rutas['productos']}?{urlencode(filtros)}")
+    visita.get('busqueda', f"{rutas['productos']}?{urlencode({'q': rng.choice(TERMINOS)})}")
+    producto_id = rng.choice(datos['variantes'])[0]
+    visita.get('detalle', rutas['detalle'].format(producto_id))
+
+
+def carrito(visita, rng, datos):
+    """Un invitado nuevo agrega, cambia y saca un producto (la reserva vuelve al stock)"""
+    rutas = datos['rutas']
+    visita.cliente.cookies.clear()
+    # Las páginas de la tienda no fijan la cookie CSRF: se toma del login
+    visita.get(None, rutas['login_cliente'])
+    producto_id, color_id, talle_id = rng.choice(datos['variantes'])
+    visita.get('detalle', rutas['detalle'].format(producto_id))
+    visita.post('carrito_agregar', rutas['agregar_al_carrito'], {
+        'producto_id': producto_id, 'color_id': color_id, 'talle_id': talle_id, 'cantidad': 1,
+    })
+    respuesta, contenido = visita.get('carrito_data', rutas['cart_data'])
+    items = json.loads(contenido).get('items', []) if respuesta.status == 200 else []
+    for item in items:
+        visita.post('carrito_actualizar', rutas['actualizar_cantidad'], {'item_id': item['id'], 'cantidad': 2})
+        visita.post('carrito_eliminar', rutas['eliminar_item_del_carrito'], {'item_id': item['id']})
+
+
+def panel(visita, rng, datos):
+    nombre = rng.choice(PANEL)
+    visita.get(f'panel_{nombre}', datos['rutas'][nombre])
+
+
+def iniciar_sesion_panel(visita, datos):
+    rutas = datos['rutas']
+    visita.get(None, rutas['login'])
+    respuesta, _ = visita.post(None, rutas['login'], datos['credenciales'], formulario=True)
+    if respuesta.status != 302:
+        raise RuntimeError(f'No se pudo iniciar sesión en el panel como {datos["credenciales"]["username"]}')
+
+
+def _trabajador(argumentos):
+    """Un proceso generador de carga: repite escenarios hasta que se acaba el tiempo"""
+    numero, config, datos = argumentos
+    rng = random.Random(config['seed'] * 1000 + numero)
+    muestras = []
+    visitas = {nombre: Visita(Cliente(config['url'], config['timeout']), muestras) for nombre in config['escenarios']}
+    if 'panel' in visitas:
+        iniciar_sesion_panel(visitas['panel'], datos)
+    funciones = {'tienda': tienda, 'carrito': carrito, 'panel': panel}
+    nombres = list(config['escenarios'])
+    pesos = [config['escenarios'][nombre] for nombre in nombres]
+
+    inicio_medicion = time.monotonic() + config['calentamiento']
+    fin = inicio_medicion + config['duracion']
+    errores = Counter()
+    while (ahora := time.monotonic()) < fin:
+        nombre = rng.choices(nombres, pesos)[0]
+        visitas[nombre].registrar = ahora >= inicio_medicion
+        try:
+            funciones[nombre](visitas[nombre], rng, datos)
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            errores[f'{nombre}: {type(e).__name__}'] += 1
+            visitas[nombre].cliente.conexion = None
+    return muestras, time.monotonic() - inicio_medicion, dict(errores)
+
+
+class Command(BaseCommand):
+    help = (
+        'Prueba de carga HTTP contra un servidor corriendo (runserver, gunicorn, '
+        'uvicorn): varios procesos recorren la tienda, el carrito y los listados '
+        'del panel, y se reporta requests/s, latencia p50/p95/p99 y consultas '
+        'por request (header X-Consultas, ver PRESUPUESTO_CONSULTAS_HEADER). El '
+        'resultado se guarda en JSON y se puede comparar con una corrida '
+        'anterior. Pensado para una base cargada con seed_catalog; los ids se '
+        'leen de la base configurada, que tiene que ser la del servidor. El '
+        'escenario panel inicia sesión con --usuario-panel y --password-panel.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--procesos', type=int, default=4, help='Usuarios virtuales, uno por proceso')
+        parser.add_argument('--duracion', type=float, default=30, help='Segundos de medición')
+        parser.add_argument('--calentamiento', type=float, default=5, help='Segundos sin registrar al empezar')
+        parser.add_argument('--escenarios', nargs='+', choices=list(ESCENARIOS), default=list(ESCENARIOS))
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--timeout', type=float, default=60)
+        parser.add_argument('--usuario-panel', help='Usuario staff para el escenario panel')
+        parser.add_argument('--password-panel')
+        parser.add_argument('--crear-usuario', action='store_true',
+                            help='Crear el usuario del panel (staff) si no existe')
+        parser.add_argument('--salida', help='Archivo JSON (default: BENCH_RESULTADOS_DIR/http-<fecha>-<commit>.json)')
+        parser.add_argument('--comparar', nargs='?', const='ultimo',
+                            help='Resultado anterior con el que comparar (sin valor: la última corrida guardada). '
+                                 'Termina con error si alguna métrica empeora más que --tolerancia')
+        parser.add_argument('--tolerancia', type=float, default=0.15)
+
+    def handle(self, *args, **options):
+        escenarios = {nombre: ESCENARIOS[nombre] for nombre in options['escenarios']}
+        datos = self._datos(options)
+        config = {
+            'url': options['url'], 'procesos': options['procesos'], 'duracion': options['duracion'],
+            'calentamiento': options['calentamiento'], 'escenarios': escenarios,
+            'seed': options['seed'], 'timeout': options['timeout'],
+        }
+        self._verificar_servidor(config)
+
+        # Los procesos hijos sólo hablan HTTP: no heredan conexiones a la base
+        connections.close_all()
+        contexto = multiprocessing.get_context('fork')
+        with contexto.Pool(options['procesos']) as pool:
+            resultados = pool.map(_trabajador, [(n, config, datos) for n in range(options['procesos'])])
+
+        ventana = max(duracion for _, duracion, _ in resultados)
+        muestras = [muestra for parcial, _, _ in resultados for muestra in parcial]
+        excepciones = Counter()
+        for _, _, errores in resultados:
+            excepciones.update(errores)
+        pasos = self._agregar(muestras, ventana)
+        self._imprimir(pasos, excepciones)
+
+        ruta = guardar_resultado('http', {
+            'config': config,
+            'catalogo': {'productos': Producto.objects.count(), 'stock': ProductoStock.objects.count()},
+            'pasos': pasos,
+            'excepciones': dict(excepciones),
+        }, options['salida'])
+        self.stdout.write(f'Resultado guardado en {ruta}')
+
+        if options['comparar']:
+            self._comparar(options['comparar'], ruta, options['tolerancia'])
+
+    def _datos(self, options):
+        """Ids para armar las requests, elegidos con la seed"""
+        rng = random.Random(options['seed'])
+        producto_ids = list(Producto.objects.values_list('id', flat=True))
+        if not producto_ids:
+            raise CommandError('No hay productos: cargá un catálogo con seed_catalog')
+        muestra = rng.sample(producto_ids, min(len(producto_ids), 500))
+        variantes = list(
+            ProductoStock.objects.filter(producto_id__in=muestra, stock__gte=10)
+            .order_by('id').values_list('producto_id', 'color_id', 'talle_id')
+        )
+        if not variantes:
+            raise CommandError('Ningún producto de la muestra tiene stock')
+
+        credenciales = None
+        if 'panel' in options['escenarios']:
+            credenciales = self._credenciales_panel(options)
+
+        rutas = {nombre: reverse(nombre) for nombre in [
+            'inicio', 'productos', 'login_cliente', 'cart_data', 'agregar_al_carrito',
+            'actualizar_cantidad', 'eliminar_item_del_carrito', 'login', *PANEL,
+        ]}
+        # Plantilla para str.format con el id del producto
+        rutas['detalle'] = reverse('producto_detail', args=[123456789]).replace('123456789', '{}')
+        return {
+            'rutas': rutas,
+            'variantes': variantes,
+            'categoria': list(Categoria.objects.values_list('id', flat=True)),
+            'marca': list(Marca.objects.values_list('id', flat=True)),
+            'color': list(Color.objects.values_list('id', flat=True)),
+            'talle': list(Talle.objects.values_list('id', flat=True)),
+            'credenciales': credenciales,
+        }
+
+    def _credenciales_panel(self, options):
+        usuario, password = options['usuario_panel'], options['password_panel']
+        if not usuario or not password:
+            raise CommandError(
+                'El escenario panel necesita --usuario-panel y --password-panel '
+                '(o sacarlo de --escenarios)'
+            )
+        if not User.objects.filter(username=usuario).exists():
+            if not options['crear_usuario']:
+                raise CommandError(f'No existe el usuario {usuario}: usar --crear-usuario para crearlo')
+            User.objects.create_user(usuario, password=password, is_staff=True)
+            self.stdout.write(f'Usuario staff {usuario} creado')
+        return {'username': usuario, 'password': password}
+
+    def _verificar_servidor(self, config):
+        try:
+            respuesta, _, _ = Cliente(config['url'], config['timeout']).pedir('GET', '/')
+        except OSError as e:
+            raise CommandError(f'No responde {config["url"]}: {e}')
+        if respuesta.getheader('X-Consultas') is None:
+            self.stderr.write(
+                'El servidor no manda X-Consultas (DEBUG o PRESUPUESTO_CONSULTAS_HEADER): '
+                'no se van a reportar consultas por request'
+            )
+
+    def _agregar(self, muestras, ventana):
+        por_paso = defaultdict(list)
+        for muestra in muestras:
+            por_paso[muestra[0]].append(muestra)
+        por_paso['total'] = muestras
+
+        pasos = {}
+        for paso, filas in sorted(por_paso.items()):
+            consultas = [c for _, _, _, c in filas if c is not None]
+            pasos[paso] = {
+                'requests': len(filas),
+                'errores': sum(1 for _, estado, _, _ in filas if estado >= 400),
+                'estados': dict(Counter(str(estado) for _, estado, _, _ in filas)),
+                'rps': len(filas) / ventana if ventana else 0,
+                **resumen_tiempos([duracion for _, _, duracion, _ in filas]),
+                'consultas': sum(consultas) / len(consultas) if consultas else None,
+            }
+        return pasos
+
+    def _imprimir(self, pasos, excepciones):
+        self.stdout.write(
+            f'{"paso":<24} {"requests":>9} {"req/s":>8} {"p50 ms":>9} {"p95 ms":>9} '
+            f'{"p99 ms":>9} {"consultas":>10} {"errores":>8}'
+        )
+        for paso, r in pasos.items():
+            # Sin muestras (p. ej. todo falló) las métricas quedan en None
+            p50, p95, p99, consultas = (
+                f'{r[metrica]:.1f}' if r[metrica] is not None else '-'
+                for metrica in ('p50', 'p95', 'p99', 'consultas')
+            )
+            self.stdout.write(
+                f'{paso:<24} {r["requests"]:>9} {r["rps"]:>8.1f} {p50:>9} {p95:>9} '
+                f'{p99:>9} {consultas:>10} {r["errores"]:>8}'
+            )
+        if not pasos['total']['requests']:
+            self.stderr.write('No se registró ningún request: revisar --duracion y los errores de abajo')
+        for error, cantidad in excepciones.items():
+            self.stderr.write(f'{error}: {cantidad}')
+
+    def _comparar(self, anterior, actual, tolerancia):
+        if anterior == 'ultimo':
+            anterior = ultimo_resultado('http', excepto=actual)
+            if anterior is None:
+                self.stdout.write('No hay una corrida anterior con la que comparar')
+                return
+        antes, ahora = cargar_resultado(anterior), cargar_resultado(actual)
+        self.stdout.write(f'\nComparación con {anterior} ({antes.get("commit")})')
+        if antes.get('catalogo') != ahora.get('catalogo'):
+            self.stderr.write(f'Los catálogos no son iguales: {antes.get("catalogo")} vs {ahora.get("catalogo")}')
+
+        filas = comparar(antes['pasos'], ahora['pasos'], METRICAS_COMPARADAS, tolerancia)
+        for paso, metrica, valor_antes, valor_ahora, cambio, regresion in filas:
+            marca = '  << regresión' if regresion else ''
+            self.stdout.write(
+                f'{paso:<24} {metrica:<10} {valor_antes:>9.1f} -> {valor_ahora:>9.1f} {cambio:>+8.1%}{marca}'
+            )
+        regresiones = [f'{paso} {metrica}' for paso, metrica, *_, regresion in filas if regresion]
+        if regresiones:
+            raise CommandError(f'Regresiones de más de {tolerancia:.0%}: {", ".join(regresiones)}')
@@ -0,0 +1,256 @@
+from decimal import Decimal
+from io import BytesIO
+
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.http import QueryDict
+from django.test import RequestFactory
+from PIL import Image
+
+from productos.bench import cargar_resultado, comparar, guardar_resultado, historial, medir, ultimo_resultado
+from productos.cart_views import get_cart_data
+from productos.context_processors import cart_processor
+from productos.facets import aplicar_filtros, filtros_activos
+from productos.images import formatos_activos, generar_variantes, optimizar
+from productos.models import Carrito, CarritoItem, Categoria, Color, Marca, Producto, ProductoStock, Talle
+from productos.resumen_carrito import guardar_resumen
+
+# Benchmarks registrados: (grupo, nombre, preparar). `preparar(datos)` arma lo
+# necesario fuera de la medición y devuelve la función que se mide
+BENCHMARKS = []
+
+
+def benchmark(grupo, nombre):
+    def registrar(preparar):
+        BENCHMARKS.append((grupo, nombre, preparar))
+        return preparar
+    return registrar
+
+
+class _Rollback(Exception):
+    pass
+
+
+# Imágenes: tamaños típicos de subida y los modos que componer_canvas trata
+# distinto (transparencia, paleta, escala de grises)
+
+TAMANOS = {'chica': (400, 500), 'mediana': (1600, 2000), 'grande': (3000, 3750)}
+MODOS = ['RGB', 'RGBA', 'P', 'L']
+
+
+def _imagen(tamano, modo):
+    """Imagen sintética con degradés (comprime como una foto, no como ruido)"""
+    gris = Image.radial_gradient('L').resize(tamano)
+    img = Image.merge('RGB', (gris, Image.linear_gradient('L').resize(tamano), gris.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    if modo == 'RGBA':
+        img.putalpha(Image.linear_gradient('L').rotate(90).resize(tamano))
+    elif modo == 'P':
+        img = img.convert('P', palette=Image.Palette.ADAPTIVE, colors=64)
+    elif modo == 'L':
+        img = gris
+    salida = BytesIO()
+    # Fotos en JPEG; transparencia y paleta en PNG, como llegan del admin
+    img.save(salida, format='JPEG' if modo in ('RGB', 'L') else 'PNG', quality=90)
+    return salida.getvalue()
+
+
+def _variantes(tamano, modo):
+    def preparar(datos):
+        contenido = _imagen(TAMANOS[tamano], modo)
+        formatos = formatos_activos()
+        return lambda: generar_variantes(contenido, formatos)
+    return preparar
+
+
+def _optimizar(tamano, modo):
+    def preparar(datos):
+        contenido = _imagen(TAMANOS[tamano], modo)
+        return lambda: optimizar(contenido)
+    return preparar
+
+
+# Lo que hacen los workers con cada foto subida y reprocess_images con cada logo
+for _tamano in TAMANOS:
+    for _modo in MODOS:
+        benchmark('imagenes', f'generar_variantes[{_tamano}-{_modo}]')(_variantes(_tamano, _modo))
+        benchmark('imagenes', f'optimizar[{_tamano}-{_modo}]')(_optimizar(_tamano, _modo))
+
+
+@benchmark('carrito', 'Carrito.get_total')
+def _get_total(datos):
+    carrito = datos['carrito']
+    return carrito.get_total
+
+
+@benchmark('carrito', 'get_cart_data')
+def _get_cart_data(datos):
+    request = datos['request']
+    return lambda: get_cart_data(request)
+
+
+@benchmark('catalogo', 'producto_list: construir queryset con todos los filtros')
+def _construir(datos):
+    params = datos['params']
+    return lambda: aplicar_filtros(
+        Producto.objects.select_related('categoria', 'marca', 'disponibilidad'), filtros_activos(params)
+    )
+
+
+@benchmark('catalogo', 'producto_list: construir y compilar SQL')
+def _compilar(datos):
+    params = datos['params']
+
+    def compilar():
+        qs = aplicar_filtros(
+            Producto.objects.select_related('categoria', 'marca', 'disponibilidad'), filtros_activos(params)
+        )
+        return qs.query.get_compiler(DEFAULT_DB_ALIAS).as_sql()
+    return compilar
+
+
+@benchmark('contexto', 'cart_processor')
+def _cart_processor(datos):
+    request = datos['request']
+    return lambda: cart_processor(request)
+
+
+@benchmark('contexto', 'cart_processor + badge')
+def _cart_processor_badge(datos):
+    request = datos['request']
+    # Lo que hace cada página: el navbar muestra la cantidad
+    return lambda: str(cart_processor(request)['carrito_cantidad'])
+
+
+class Command(BaseCommand):
+    help = (
+        'Micro-benchmarks de los caminos calientes: variantes y recompresión de imágenes, '
+        'totales y JSON del carrito, armado del queryset del catálogo y el '
+        'context processor del carrito. Reporta tiempo por llamada (mín, '
+        'mediana, desvío) y guarda el resultado en JSON para compararlo con '
+        'corridas anteriores. Los datos se crean dentro de una transacción '
+        'que se descarta.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('-k', '--filtro', nargs='+',
+                            help='Sólo los benchmarks cuyo grupo o nombre contenga alguno de estos textos')
+        parser.add_argument('--rondas', type=int, default=10)
+        parser.add_argument('--tiempo-minimo', type=float, default=0.05,
+                            help='Segundos mínimos por ronda (se calibran las iteraciones)')
+        parser.add_argument('--items', type=int, default=20, help='Items del carrito de prueba')
+        parser.add_argument('--salida', help='Archivo JSON (default: BENCH_RESULTADOS_DIR/micro-<fecha>-<commit>.json)')
+        parser.add_argument('--comparar', nargs='?', const='ultimo',
+                            help='Resultado anterior con el que comparar (sin valor: la última corrida guardada). '
+                                 'Termina con error si alguna mediana empeora más que --tolerancia')
+        parser.add_argument('--tolerancia', type=float, default=0.15)
+        parser.add_argument('--historial', type=int, nargs='?', const=8, metavar='N',
+                            help='No mide: muestra las medianas de las últimas N corridas guardadas')
+
+    def handle(self, *args, **options):
+        if options['historial']:
+            return self._historial(options['historial'])
+        seleccionados = [
+            (grupo, nombre, preparar) for grupo, nombre, preparar in BENCHMARKS
+            if not options['filtro'] or any(f in f'{grupo} {nombre}' for f in options['filtro'])
+        ]
+        if not seleccionados:
+            raise CommandError('Ningún benchmark coincide con el filtro')
+
+        resultados = {}
+        try:
+            with transaction.atomic():
+                datos = self._datos(options['items'])
+                self.stdout.write(f'{"benchmark":<58} {"mín µs":>11} {"mediana µs":>11} {"desvío":>9} {"ops/s":>10}')
+                for grupo, nombre, preparar in seleccionados:
+                    r = medir(preparar(datos), options['rondas'], options['tiempo_minimo'])
+                    resultados[nombre] = {'grupo': grupo, **r}
+                    self.stdout.write(
+                        f'{nombre:<58} {r["min"] * 1e6:>11.1f} {r["mediana"] * 1e6:>11.1f} '
+                        f'{r["desvio"] / r["mediana"]:>8.1%} {r["ops"]:>10.0f}'
+                    )
+                raise _Rollback
+        except _Rollback:
+            pass
+
+        ruta = guardar_resultado('micro', {
+            'config': {'rondas': options['rondas'], 'tiempo_minimo': options['tiempo_minimo'], 'items': options['items']},
+            'benchmarks': resultados,
+        }, options['salida'])
+        self.stdout.write(f'Resultado guardado en {ruta}')
+
+        if options['comparar']:
+            self._comparar(options['comparar'], ruta, options['tolerancia'])
+
+    def _datos(self, items):
+        """Catálogo mínimo, un carrito de invitado con `items` items y su request"""
+        categoria = Categoria.objects.create(nombre='Bench')
+        marca = Marca.objects.create(nombre='Marca bench micro')
+        colores = Color.objects.bulk_create(
+            Color(nombre=f'Color bench {i}', hex_code='#000000', order=i) for i in range(4)
+        )
+        talles = Talle.objects.bulk_create(
+            Talle(nombre=f'Talle bench {i}', abbreviation=f'B{i}', order=i) for i in range(4)
+        )
+        productos = Producto.objects.bulk_create(
+            Producto(nombre=f'Remera bench {i}', descripcion='Algodón', precio=Decimal(1000 + i),
+                     categoria=categoria, marca=marca, talle=talles[0])
+            for i in range(items)
+        )
+        ProductoStock.objects.bulk_create(
+            ProductoStock(producto=producto, color=colores[i % 4], talle=talles[i % 4], stock=50)
+            for i, producto in enumerate(productos)
+        )
+
+        sesion = SessionStore()
+        sesion.create()
+        carrito = Carrito.objects.create(session_key=sesion.session_key)
+        CarritoItem.objects.bulk_create(
+            CarritoItem(carrito=carrito, producto=producto, color=colores[i % 4], talle=talles[i % 4],
+                        cantidad=1 + i % 3)
+            for i, producto in enumerate(productos)
+        )
+
+        request = RequestFactory().get('/')
+        request.session = sesion
+        request.user = AnonymousUser()
+        guardar_resumen(request, carrito.get_resumen())
+
+        params = QueryDict(mutable=True)
+        params.update({
+            'categoria': str(categoria.pk), 'marca': str(marca.pk), 'color': str(colores[0].pk),
+            'talle': str(talles[0].pk), 'q': 'remera algodón',
+        })
+        return {'carrito': carrito, 'request': request, 'params': params}
+
+    def _historial(self, ultimas):
+        corridas = historial('micro', ultimas)
+        if not corridas:
+            raise CommandError('No hay corridas guardadas en BENCH_RESULTADOS_DIR')
+        self.stdout.write('Mediana en µs por corrida')
+        self.stdout.write(f'{"benchmark":<58}' + ''.join(f' {(c["commit"] or "?")[:12]:>12}' for c in corridas))
+        nombres = dict.fromkeys(nombre for c in corridas for nombre in c['benchmarks'])
+        for nombre in nombres:
+            valores = [c['benchmarks'].get(nombre, {}).get('mediana') for c in corridas]
+            self.stdout.write(f'{nombre:<58}' + ''.join(
+                f' {v * 1e6:>12.1f}' if v is not None else f' {"-":>12}' for v in valores
+            ))
+
+    def _comparar(self, anterior, actual, tolerancia):
+        if anterior == 'ultimo':
+            anterior = ultimo_resultado('micro', excepto=actual)
+            if anterior is None:
+                self.stdout.write('No hay una corrida anterior con la que comparar')
+                return
+        antes, ahora = cargar_resultado(anterior), cargar_resultado(actual)
+        self.stdout.write(f'\nComparación con {anterior} ({antes.get("commit")})')
+        filas = comparar(antes['benchmarks'], ahora['benchmarks'], ['mediana'], tolerancia)
+        for nombre, _, valor_antes, valor_ahora, cambio, regresion in filas:
+            marca = '  << regresión' if regresion else ''
+            self.stdout.write(
+                f'{nombre:<58} {valor_antes * 1e6:>11.1f} -> {valor_ahora * 1e6:>11.1f} µs {cambio:>+8.1%}{marca}'
+            )
+        regresiones = [nombre for nombre, *_, regresion in filas if regresion]
+        if regresiones:
+            raise CommandError(f'Regresiones de más de {tolerancia:.0%}: {", ".join(regresiones)}')
@@ -0,0 +1,118 @@
+import os
+import re
+import time
+
+from django.conf import settings
+from django.core.files import File
+from django.core.management.base import BaseCommand
+
+from productos.models import Marca, Producto
+from productos.storage import PREFIJO_CONTENIDO, storage_contenido
+
+# Directorios de MEDIA_ROOT que administra el storage por contenido; en
+# productos/ y marcas/ quedan los derivados y los archivos subidos antes
+DIRECTORIOS = (PREFIJO_CONTENIDO, 'productos', 'marcas')
+
+NOMBRE_POR_CONTENIDO = re.compile(rf'^{PREFIJO_CONTENIDO}/[0-9a-f]{{2}}/[0-9a-f]{{64}}\.\w+$')
+
+
+def _formato_bytes(n):
+    for unidad in ('B', 'KB', 'MB'):
+        if n < 1024:
+            return f'{n:.1f} {unidad}'
+        n /= 1024
+    return f'{n:.1f} GB'
+
+
+class Command(BaseCommand):
+    help = (
+        'Elimina de media/ los archivos de productos y marcas que ya no '
+        'referencia ninguna fila, e informa cuántos bytes se recuperaron. '
+        'Con --consolidar, primero pasa los archivos con nombre viejo al '
+        'almacenamiento por contenido, unificando duplicados.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Sólo informar, sin borrar ni modificar nada')
+        parser.add_argument('--consolidar', action='store_true',
+                            help='Renombrar por contenido los archivos subidos antes del cambio de storage')
+        parser.add_argument('--min-edad', type=int, default=None,
+                            help='No borrar archivos modificados hace menos de N segundos (por defecto MEDIA_GC_GRACIA)')
+
+    def handle(self, *args, **options):
+        if options['consolidar']:
+            self._consolidar(options['dry_run'])
+
+        min_edad = options['min_edad']
+        if min_edad is None:
+            min_edad = getattr(settings, 'MEDIA_GC_GRACIA', 600)
+        limite = time.time() - min_edad
+
+        referenciados = self._referenciados()
+        revisados = borrados = bytes_liberados = bytes_en_uso = 0
+        for nombre, ruta in self._archivos():
+            revisados += 1
+            estado = os.stat(ruta)
+            if nombre in referenciados:
+                bytes_en_uso += estado.st_size
+                continue
+            if estado.st_mtime > limite:
+                continue
+            borrados += 1
+            bytes_liberados += estado.st_size
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  huérfano: {nombre}')
+            if not options['dry_run']:
+                os.remove(ruta)
+
+        accion = 'Se borrarían' if options['dry_run'] else 'Borrados'
+        self.stdout.write(
+            f'Archivos revisados: {revisados}, en uso: {_formato_bytes(bytes_en_uso)}'
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'{accion}: {borrados} archivos huérfanos, {_formato_bytes(bytes_liberados)} recuperados'
+        ))
+
+    def _referenciados(self):
+        nombres = set()
+        filas = Producto.objects.values_list('imagen', 'imagen_derivada', 'imagen_variantes')
+        for imagen, derivada, variantes in filas.iterator():
+            nombres.update((imagen, derivada))
+            for por_nombre in (variantes or {}).values():
+                nombres.update(por_nombre.values())
+        nombres.update(Marca.objects.values_list('logo', flat=True).iterator())
+        nombres.discard(None)
+        nombres.discard('')
+        return nombres
+
+    def _archivos(self):
+        raiz = storage_contenido.location
+        for directorio in DIRECTORIOS:
+            for carpeta, _, archivos in os.walk(os.path.join(raiz, directorio)):
+                for archivo in archivos:
+                    ruta = os.path.join(carpeta, archivo)
+                    yield os.path.relpath(ruta, raiz).replace(os.sep, '/'), ruta
+
+    def _consolidar(self, dry_run):
+        """
+        Pasa Producto.imagen y Marca.logo con nombres viejos (incluidos los
+        por contenido dentro de productos/ y marcas/) al directorio compartido
+        """
+        movidos = 0
+        for modelo, campo in ((Producto, 'imagen'), (Marca, 'logo')):
+            filas = modelo.objects.exclude(**{campo: ''}).exclude(**{f'{campo}__isnull': True})
+            for pk, nombre in filas.values_list('pk', campo).iterator():
+                if NOMBRE_POR_CONTENIDO.search(nombre):
+                    continue
+                if not storage_contenido.exists(nombre):
+                    self.stderr.write(f'{modelo.__name__} {pk}: falta el archivo {nombre}')
+                    continue
+                movidos += 1
+                if dry_run:
+                    continue
+                with storage_contenido.open(nombre, 'rb') as archivo:
+                    nuevo = storage_contenido.save(nombre, File(archivo, name=nombre))
+                modelo.objects.filter(pk=pk).update(**{campo: nuevo})
+        verbo = 'Se renombrarían' if dry_run else 'Renombrados'
+        self.stdout.write(f'{verbo} por contenido: {movidos} archivos')
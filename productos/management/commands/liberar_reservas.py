@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from productos.reservas import liberar_reservas_vencidas
+
+
+class Command(BaseCommand):
+    help = 'Libera el stock reservado por carritos abandonados (ver CARRITO_RESERVA_MINUTOS)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--minutos', type=int, default=None,
+                            help='Minutos sin actividad para considerar abandonado un carrito')
+
+    def handle(self, *args, **options):
+        liberados = liberar_reservas_vencidas(options['minutos'])
+        self.stdout.write(f'Items con reserva liberada: {liberados}')
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from productos.tasks import liberar_colgados, procesar_pendientes
+
+
+class Command(BaseCommand):
+    help = 'Worker que genera las variantes de las imágenes de productos pendientes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Procesos para Pillow (por defecto, uno por CPU; 0 = en este proceso)')
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--intervalo', type=float, default=5.0,
+                            help='Segundos entre consultas a la cola cuando está vacía')
+        parser.add_argument('--once', action='store_true',
+                            help='Vaciar la cola y terminar en lugar de quedarse escuchando')
+
+    def handle(self, *args, **options):
+        while True:
+            # Reclamos vencidos de workers caídos (también de otros hosts)
+            liberados = liberar_colgados()
+            if liberados:
+                self.stdout.write(f'{liberados} trabajos interrumpidos vuelven a la cola')
+            procesados, errores = procesar_pendientes(options['workers'], options['batch_size'])
+            if procesados or errores:
+                self.stdout.write(f'Procesadas: {procesados}, con error: {errores}')
+            if options['once']:
+                break
+            time.sleep(options['intervalo'])
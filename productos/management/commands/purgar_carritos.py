@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from productos.limpieza import purgar
+
+
+class Command(BaseCommand):
+    help = 'Borra sesiones vencidas, carritos vacíos y carritos de invitados abandonados (pensado para cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=500,
+                            help='Filas por DELETE (default: 500)')
+        parser.add_argument('--dias', type=int, default=None,
+                            help='Días sin actividad para borrar un carrito de invitado (default: CARRITO_INVITADO_DIAS)')
+        parser.add_argument('--horas', type=int, default=None,
+                            help='Horas sin actividad para borrar un carrito vacío (default: CARRITO_VACIO_HORAS)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Sólo cuenta lo que se borraría')
+
+    def handle(self, *args, **options):
+        resultado = purgar(
+            lote=options['lote'], dias=options['dias'], horas=options['horas'],
+            simular=options['dry_run'],
+        )
+        verbo = 'A borrar' if options['dry_run'] else 'Borrados'
+        for tipo, cantidad in resultado.items():
+            self.stdout.write(f'{verbo} ({tipo.replace("_", " ")}): {cantidad}')
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from productos.disponibilidad import recalcular_disponibilidad
+from productos.models import Producto
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el índice de colores/talles con stock de todos los productos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        ids = list(Producto.objects.order_by('id').values_list('id', flat=True))
+        for inicio in range(0, len(ids), batch_size):
+            recalcular_disponibilidad(ids[inicio:inicio + batch_size])
+        self.stdout.write(self.style.SUCCESS(f'Disponibilidad recalculada para {len(ids)} productos'))
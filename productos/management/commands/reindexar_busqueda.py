@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from productos.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el índice de búsqueda de productos'
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        backend.reindexar_todo()
+        self.stdout.write(self.style.SUCCESS(f'Índice reconstruido con {type(backend).__name__}'))
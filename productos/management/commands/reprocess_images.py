@@ -0,0 +1,187 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from productos.images import optimizar
+from productos.models import Marca, Producto
+from productos.storage import liberar_archivos, storage_contenido
+from productos.tasks import procesar_lote, reclamar
+
+# Se reprocesan todas menos las que está procesando un worker en este momento
+ESTADOS_REPROCESABLES = ('', 'pendiente', 'lista', 'error')
+
+
+def _formato_bytes(n):
+    signo = '-' if n < 0 else ''
+    n = abs(n)
+    for unidad in ('B', 'KB', 'MB'):
+        if n < 1024:
+            return f'{signo}{n:.1f} {unidad}'
+        n /= 1024
+    return f'{signo}{n:.1f} GB'
+
+
+class Command(BaseCommand):
+    help = (
+        'Regenera las variantes de todas las imágenes de productos y recomprime '
+        'los logos de marcas, repartiendo el trabajo de Pillow en un pool de '
+        'procesos. Guarda un checkpoint por lote: si se interrumpe, volver a '
+        'correrlo retoma desde donde quedó.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Procesos para Pillow (0 = en este proceso)')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Imágenes por lote (por defecto, 8 por worker)')
+        parser.add_argument('--solo', choices=['productos', 'marcas'], default=None)
+        parser.add_argument('--checkpoint', default=None,
+                            help='Archivo de progreso (por defecto MEDIA_ROOT/.reprocess_images.json)')
+        parser.add_argument('--reiniciar', action='store_true',
+                            help='Ignorar el checkpoint y empezar de cero')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        self.batch_size = options['batch_size'] or max(workers, 1) * 8
+        self.checkpoint_path = options['checkpoint'] or os.path.join(settings.MEDIA_ROOT, '.reprocess_images.json')
+        self.checkpoint = {} if options['reiniciar'] else self._leer_checkpoint()
+        if self.checkpoint:
+            self.stdout.write(f'Retomando desde el checkpoint: {self.checkpoint}')
+
+        self.procesadas = self.errores = 0
+        self.bytes_antes = self.bytes_despues = 0
+        self.inicio = time.perf_counter()
+
+        executor = ProcessPoolExecutor(max_workers=workers) if workers else None
+        try:
+            if options['solo'] != 'marcas':
+                self._productos(executor)
+            if options['solo'] != 'productos':
+                self._marcas(executor)
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('Interrumpido; volver a correr el comando para retomar'))
+            self._reporte()
+            return
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        self._reporte()
+
+    def _leer_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as archivo:
+                return json.load(archivo)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _guardar_checkpoint(self, clave, ultimo_id):
+        self.checkpoint[clave] = ultimo_id
+        temporal = f'{self.checkpoint_path}.tmp'
+        with open(temporal, 'w') as archivo:
+            json.dump(self.checkpoint, archivo)
+        os.replace(temporal, self.checkpoint_path)
+
+    def _progreso(self, etiqueta, ultimo_id):
+        transcurrido = time.perf_counter() - self.inicio
+        self.stdout.write(
+            f'{etiqueta} hasta id {ultimo_id}: {self.procesadas} imágenes, '
+            f'{self.procesadas / transcurrido:.1f} img/s'
+        )
+
+    def _reporte(self):
+        transcurrido = time.perf_counter() - self.inicio
+        ahorro = self.bytes_antes - self.bytes_despues
+        self.stdout.write(self.style.SUCCESS(
+            f'Procesadas: {self.procesadas}, con error: {self.errores}, '
+            f'en {transcurrido:.1f}s ({self.procesadas / transcurrido if transcurrido else 0:.1f} img/s)'
+        ))
+        self.stdout.write(
+            f'Bytes: {_formato_bytes(self.bytes_antes)} -> {_formato_bytes(self.bytes_despues)} '
+            f'(ahorro {_formato_bytes(ahorro)})'
+        )
+
+    @staticmethod
+    def _tamano_variantes(producto_ids):
+        total = 0
+        filas = Producto.objects.filter(id__in=producto_ids).values_list('imagen_variantes', 'imagen_derivada')
+        for variantes, derivada in filas:
+            rutas = {ruta for por_nombre in (variantes or {}).values() for ruta in por_nombre.values()}
+            if derivada:
+                rutas.add(derivada)
+            for ruta in rutas:
+                try:
+                    total += default_storage.size(ruta)
+                except OSError:
+                    pass
+        return total
+
+    def _productos(self, executor):
+        ultimo = self.checkpoint.get('productos', 0)
+        con_imagen = Producto.objects.exclude(imagen='').exclude(imagen__isnull=True).order_by('id')
+        while True:
+            ids = list(con_imagen.filter(id__gt=ultimo).values_list('id', flat=True)[:self.batch_size])
+            if not ids:
+                break
+            ultimo = ids[-1]
+            # Mismo reclamo que procesar_imagenes: las que ya tiene un worker se saltean
+            ids = reclamar(ids, estados=ESTADOS_REPROCESABLES)
+            self.bytes_antes += self._tamano_variantes(ids)
+            procesadas, errores = procesar_lote(ids, executor)
+            self.bytes_despues += self._tamano_variantes(ids)
+            self.procesadas += procesadas
+            self.errores += errores
+            self._guardar_checkpoint('productos', ultimo)
+            self._progreso('Productos', ultimo)
+
+    def _marcas(self, executor):
+        ultimo = self.checkpoint.get('marcas', 0)
+        con_logo = Marca.objects.exclude(logo='').exclude(logo__isnull=True).order_by('id')
+        while True:
+            marcas = list(con_logo.filter(id__gt=ultimo).values_list('id', 'logo')[:self.batch_size])
+            if not marcas:
+                break
+            trabajos = []
+            for marca_id, nombre in marcas:
+                try:
+                    with storage_contenido.open(nombre, 'rb') as archivo:
+                        contenido = archivo.read()
+                except OSError as e:
+                    self.stderr.write(f'Marca {marca_id}: no se pudo leer {nombre}: {e}')
+                    self.errores += 1
+                    continue
+                trabajo = executor.submit(optimizar, contenido) if executor is not None else contenido
+                trabajos.append((marca_id, nombre, len(contenido), trabajo))
+
+            reemplazados = []
+            for marca_id, nombre, tamano, trabajo in trabajos:
+                try:
+                    optimizado = trabajo.result() if executor is not None else optimizar(trabajo)
+                except Exception as e:
+                    self.stderr.write(f'Marca {marca_id}: error al recomprimir {nombre}: {e}')
+                    self.errores += 1
+                    continue
+                self.procesadas += 1
+                self.bytes_antes += tamano
+                if optimizado is None:
+                    self.bytes_despues += tamano
+                    continue
+                nuevo = storage_contenido.save(nombre, ContentFile(optimizado))
+                # Condicional: si el logo cambió mientras tanto, no se pisa
+                if Marca.objects.filter(id=marca_id, logo=nombre).update(logo=nuevo):
+                    self.bytes_despues += len(optimizado)
+                    reemplazados.append(nombre)
+                else:
+                    self.bytes_despues += tamano
+            liberar_archivos(reemplazados)
+            ultimo = marcas[-1][0]
+            self._guardar_checkpoint('marcas', ultimo)
+            self._progreso('Marcas', ultimo)
@@ -0,0 +1,251 @@
+import random
+import time
+from decimal import Decimal
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from productos.disponibilidad import recalcular_disponibilidad
+from productos.facets import invalidar_facetas
+from productos.models import (
+    Carrito, CarritoItem, Categoria, Cliente, Color, Direccion, GrupoCliente,
+    Marca, Producto, ProductoStock, Talle,
+)
+from productos.search import get_backend
+
+COLORES = [
+    ('Negro', '#000000'), ('Blanco', '#FFFFFF'), ('Gris', '#808080'), ('Azul', '#1F3A93'),
+    ('Celeste', '#87CEEB'), ('Rojo', '#C0392B'), ('Bordó', '#800020'), ('Verde', '#27AE60'),
+    ('Oliva', '#808000'), ('Amarillo', '#F1C40F'), ('Naranja', '#E67E22'), ('Rosa', '#F4A7B9'),
+    ('Violeta', '#8E44AD'), ('Beige', '#F5F5DC'), ('Marrón', '#6E4B2A'), ('Crudo', '#EEE8D5'),
+]
+TALLES = ['XXS', 'XS', 'S', 'M', 'L', 'XL', 'XXL', 'XXXL']
+PRENDAS = [
+    'Remera', 'Camisa', 'Pantalón', 'Jean', 'Campera', 'Buzo', 'Vestido', 'Pollera',
+    'Short', 'Chaleco', 'Sweater', 'Cardigan', 'Musculosa', 'Bermuda', 'Saco', 'Blazer',
+]
+ADJETIVOS = [
+    'básica', 'clásica', 'urbana', 'deportiva', 'elegante', 'oversize', 'slim', 'recta',
+    'estampada', 'lisa', 'rayada', 'de lino', 'de algodón', 'de lana', 'de cuero', 'con capucha',
+]
+PALABRAS = [
+    'algodón', 'peinado', 'suave', 'liviano', 'abrigado', 'costuras', 'reforzadas', 'corte',
+    'moderno', 'cómodo', 'ideal', 'para', 'el', 'día', 'noche', 'verano', 'invierno',
+    'tela', 'elástica', 'lavable', 'secado', 'rápido', 'bolsillos', 'cierre', 'botones',
+]
+NOMBRES = ['Juan', 'María', 'Lucía', 'Martín', 'Sofía', 'Diego', 'Valentina', 'Tomás', 'Camila', 'Mateo']
+APELLIDOS = ['García', 'Fernández', 'González', 'Rodríguez', 'López', 'Martínez', 'Pérez', 'Gómez']
+CIUDADES = ['Buenos Aires', 'Córdoba', 'Rosario', 'Mendoza', 'La Plata', 'Mar del Plata', 'Salta']
+
+
+def _lotes(objetos, tamaño):
+    """Parte un iterable en listas de `tamaño` sin materializarlo entero"""
+    objetos = iter(objetos)
+    while lote := list(islice(objetos, tamaño)):
+        yield lote
+
+
+class Command(BaseCommand):
+    help = (
+        'Genera un catálogo sintético grande para benchmarks: categorías, '
+        'marcas, colores, talles, productos con sus colores y variantes de '
+        'stock, clientes con direcciones, usuarios y carritos. Con la misma '
+        '--seed genera siempre los mismos datos. Requiere una base sin '
+        'productos (python manage.py flush). Los valores por defecto generan '
+        'un millón de filas de stock.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--categorias', type=int, default=60)
+        parser.add_argument('--marcas', type=int, default=400)
+        parser.add_argument('--colores', type=int, default=32)
+        parser.add_argument('--talles', type=int, default=len(TALLES))
+        parser.add_argument('--productos', type=int, default=50000)
+        parser.add_argument('--colores-por-producto', type=int, default=4,
+                            help='Colores de cada producto (M2M y variantes de stock)')
+        parser.add_argument('--talles-por-producto', type=int, default=5,
+                            help='Talles consecutivos con stock de cada producto')
+        parser.add_argument('--clientes', type=int, default=10000)
+        parser.add_argument('--carritos', type=int, default=2000,
+                            help='Carritos de usuarios generados (uno por usuario)')
+        parser.add_argument('--items-por-carrito', type=int, default=6, help='Máximo de items por carrito')
+        parser.add_argument('--password', default='bench1234',
+                            help='Contraseña de los usuarios generados (bench0, bench1, ...)')
+        parser.add_argument('--lote', type=int, default=5000, help='Filas por INSERT')
+        parser.add_argument('--sin-indices', action='store_true',
+                            help='No reconstruye disponibilidad ni el índice de búsqueda')
+
+    def handle(self, *args, **options):
+        if Producto.objects.exists():
+            raise CommandError('La base ya tiene productos: vaciala con `python manage.py flush`')
+        if options['colores_por_producto'] > options['colores'] or options['talles_por_producto'] > options['talles']:
+            raise CommandError('Un producto no puede tener más colores o talles que los generados')
+
+        self.rng = random.Random(options['seed'])
+        self.lote = options['lote']
+        inicio = time.perf_counter()
+        with transaction.atomic():
+            self._catalogo(options)
+            self._clientes(options)
+            self._carritos(options)
+        self._paso('Datos generados', inicio)
+
+        if not options['sin_indices']:
+            inicio = time.perf_counter()
+            producto_ids = list(Producto.objects.order_by('id').values_list('id', flat=True))
+            for ids in _lotes(producto_ids, self.lote):
+                recalcular_disponibilidad(ids)
+            get_backend().reindexar_todo()
+            self._paso('Índices de disponibilidad y búsqueda', inicio)
+        invalidar_facetas()
+
+    def _paso(self, nombre, inicio):
+        self.stdout.write(f'{nombre}: {time.perf_counter() - inicio:.1f}s')
+
+    def _insertar(self, modelo, objetos):
+        creados = []
+        for lote in _lotes(objetos, self.lote):
+            creados.extend(modelo.objects.bulk_create(lote))
+        self.stdout.write(f'  {modelo._meta.verbose_name_plural}: {len(creados)}')
+        return creados
+
+    def _insertar_filas(self, modelo, campos, filas):
+        """
+        INSERT con executemany para las tablas de millones de filas: armar
+        instancias y compilar el INSERT del ORM cuesta ~5 veces más que la
+        escritura en sí. No hay señales ni valores por defecto: `campos` debe
+        incluir todas las columnas obligatorias.
+        """
+        opts = modelo._meta
+        columnas = ', '.join(connection.ops.quote_name(opts.get_field(campo).column) for campo in campos)
+        sql = (
+            f'INSERT INTO {connection.ops.quote_name(opts.db_table)} ({columnas}) '
+            f'VALUES ({", ".join(["%s"] * len(campos))})'
+        )
+        total = 0
+        with connection.cursor() as cursor:
+            for lote in _lotes(filas, self.lote):
+                cursor.executemany(sql, lote)
+                total += len(lote)
+        self.stdout.write(f'  {opts.verbose_name_plural}: {total}')
+
+    def _catalogo(self, options):
+        rng = self.rng
+        self.categorias = self._insertar(Categoria, (
+            Categoria(nombre=f'{rng.choice(PRENDAS)}s {i}', descripcion=f'Categoría {i}')
+            for i in range(options['categorias'])
+        ))
+        self.marcas = self._insertar(Marca, (
+            Marca(nombre=f'Marca {i:04d}') for i in range(options['marcas'])
+        ))
+        self.colores = self._insertar(Color, (
+            Color(
+                nombre=COLORES[i % len(COLORES)][0] + (f' {i // len(COLORES)}' if i >= len(COLORES) else ''),
+                hex_code=COLORES[i % len(COLORES)][1], order=i,
+            )
+            for i in range(options['colores'])
+        ))
+        self.talles = self._insertar(Talle, (
+            Talle(
+                nombre=TALLES[i] if i < len(TALLES) else str(34 + 2 * (i - len(TALLES))),
+                abbreviation=TALLES[i] if i < len(TALLES) else str(34 + 2 * (i - len(TALLES))),
+                order=i,
+            )
+            for i in range(options['talles'])
+        ))
+
+        # Se sortean colores y talles de cada producto antes de insertarlo,
+        # así las variantes se generan sin volver a leer los productos
+        por_color, por_talle = options['colores_por_producto'], options['talles_por_producto']
+        variantes = []
+
+        def productos():
+            for i in range(options['productos']):
+                colores = rng.sample(self.colores, por_color)
+                desde = rng.randint(0, len(self.talles) - por_talle)
+                talles = self.talles[desde:desde + por_talle]
+                variantes.append((colores, talles))
+                yield Producto(
+                    nombre=f'{rng.choice(PRENDAS)} {rng.choice(ADJETIVOS)} {i}',
+                    descripcion=' '.join(rng.choices(PALABRAS, k=rng.randint(8, 20))).capitalize(),
+                    precio=Decimal(rng.randint(500, 90000)),
+                    categoria=rng.choice(self.categorias),
+                    # Algunos productos sin marca, como en el catálogo real
+                    marca=rng.choice(self.marcas) if rng.random() > 0.05 else None,
+                    talle=talles[0],
+                )
+
+        self.productos = self._insertar(Producto, productos())
+        self._insertar_filas(Producto.colores.through, ['producto', 'color'], (
+            (producto.id, color.id)
+            for producto, (colores, _) in zip(self.productos, variantes)
+            for color in colores
+        ))
+
+        def stock():
+            for producto, (colores, talles) in zip(self.productos, variantes):
+                for color in colores:
+                    for talle in talles:
+                        # ~15% de las variantes sin stock
+                        cantidad = 0 if rng.random() < 0.15 else rng.randint(1, 50)
+                        yield producto.id, color.id, talle.id, cantidad, 0
+
+        self.variantes = variantes
+        self._insertar_filas(ProductoStock, ['producto', 'color', 'talle', 'stock', 'reservado'], stock())
+
+    def _clientes(self, options):
+        rng = self.rng
+        grupos = self._insertar(GrupoCliente, (
+            GrupoCliente(nombre=nombre, descuento=Decimal(descuento))
+            for nombre, descuento in [('Minorista', 0), ('Mayorista', 15), ('VIP', 10)]
+        ))
+        clientes = self._insertar(Cliente, (
+            Cliente(
+                tratamiento=rng.choice(Cliente.TRATAMIENTO_CHOICES)[0],
+                nombre=rng.choice(NOMBRES), apellidos=rng.choice(APELLIDOS),
+                email=f'cliente{i}@example.com', grupo=rng.choice(grupos),
+                ventas_totales=Decimal(rng.randint(0, 500000)), boletin=rng.random() < 0.3,
+            )
+            for i in range(options['clientes'])
+        ))
+        self._insertar(Direccion, (
+            Direccion(
+                cliente_id=cliente.id, nombre=cliente.nombre, apellidos=cliente.apellidos,
+                direccion=f'Calle {rng.randint(1, 200)} {rng.randint(100, 9999)}',
+                codigo_postal=str(rng.randint(1000, 9999)), ciudad=rng.choice(CIUDADES),
+                pais='AR', es_predeterminada=(n == 0),
+            )
+            for cliente in clientes
+            for n in range(rng.randint(1, 2))
+        ))
+
+    def _carritos(self, options):
+        rng = self.rng
+        # Un solo hash para todos: hashear la contraseña por usuario tardaría minutos
+        password = make_password(options['password'])
+        usuarios = self._insertar(User, (
+            User(username=f'bench{i}', email=f'bench{i}@example.com', password=password)
+            for i in range(options['carritos'])
+        ))
+        carritos = self._insertar(Carrito, (Carrito(usuario_id=usuario.id) for usuario in usuarios))
+
+        def items():
+            for carrito in carritos:
+                elegidos = set()
+                for _ in range(rng.randint(1, options['items_por_carrito'])):
+                    n = rng.randrange(len(self.productos))
+                    colores, talles = self.variantes[n]
+                    clave = (self.productos[n].id, rng.choice(colores).id, rng.choice(talles).id)
+                    if clave not in elegidos:
+                        elegidos.add(clave)
+                        # Sin reserva: como un carrito cuya reserva ya venció
+                        yield CarritoItem(
+                            carrito_id=carrito.id, producto_id=clave[0], color_id=clave[1],
+                            talle_id=clave[2], cantidad=rng.randint(1, 3),
+                        )
+
+        self._insertar(CarritoItem, items())
@@ -0,0 +1,101 @@
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from django.views.decorators.http import require_safe
+
+from .disk_cache import CacheDisco
+from .images import FORMATOS, TAMANO_DERIVADO, VARIANTES, redimensionar
+from .storage import PREFIJO_CONTENIDO, storage_contenido
+
+logger = logging.getLogger(__name__)
+
+# Directorios de media que se pueden pedir redimensionados
+DIRECTORIOS_PERMITIDOS = (f'{PREFIJO_CONTENIDO}/', 'productos/', 'marcas/')
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = CacheDisco(
+            getattr(settings, 'IMAGENES_CACHE_DIR', settings.BASE_DIR / 'media_cache'),
+            getattr(settings, 'IMAGENES_CACHE_MAX_BYTES', 512 * 1024 * 1024),
+        )
+    return _cache
+
+
+def tamanos_permitidos():
+    tamanos = getattr(settings, 'IMAGENES_TAMANOS_PERMITIDOS', None)
+    if tamanos is None:
+        tamanos = list(VARIANTES.values()) + [TAMANO_DERIVADO]
+    return {tuple(tamano) for tamano in tamanos}
+
+
+def _formato_para(request):
+    """WebP si el navegador lo acepta, si no JPEG"""
+    if 'image/webp' in request.headers.get('Accept', ''):
+        return 'webp'
+    return 'jpeg'
+
+
+def _generar(origen, ruta, tamano, formato):
+    with open(origen, 'rb') as original:
+        contenido = original.read()
+    formato_pil, _, _, opciones = FORMATOS[formato]
+    try:
+        return redimensionar(contenido, tamano, formato_pil, **opciones)
+    except OSError as e:
+        logger.warning('No se pudo redimensionar %s: %s', ruta, e)
+        raise Http404('La imagen no se puede procesar')
+
+
+@require_safe
+def imagen_redimensionada(request, ancho, alto, ruta):
+    """
+    /media/r/<ancho>x<alto>/<ruta>: la imagen de media ajustada al tamaño
+    pedido con el mismo canvas blanco que las variantes.
+
+    Se genera en el primer pedido y queda en una cache en disco con LRU;
+    los pedidos simultáneos de la misma variante esperan a que la genere
+    uno solo. Sólo se aceptan los tamaños de IMAGENES_TAMANOS_PERMITIDOS.
+    """
+    if (ancho, alto) not in tamanos_permitidos() or not ruta.startswith(DIRECTORIOS_PERMITIDOS):
+        raise Http404('Tamaño o ruta no permitidos')
+    try:
+        origen = storage_contenido.path(ruta)
+        modificado = storage_contenido.get_modified_time(ruta).timestamp()
+    except (SuspiciousFileOperation, FileNotFoundError):
+        raise Http404('No existe la imagen')
+
+    formato = _formato_para(request)
+    # La clave cambia si el original cambia (los nombres por contenido nunca lo hacen)
+    clave = hashlib.sha1(f'{ruta}|{modificado}|{ancho}x{alto}|{formato}'.encode()).hexdigest()
+    etag = f'"{clave}"'
+
+    content_type = FORMATOS[formato][1]
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        respuesta = HttpResponseNotModified()
+    else:
+        cache = get_cache()
+        archivo = cache.get(clave)
+        if archivo is None:
+            with cache.bloqueo(clave):
+                archivo = cache.get(clave)
+                if archivo is None:
+                    archivo = cache.put(clave, _generar(origen, ruta, (ancho, alto), formato))
+        try:
+            respuesta = FileResponse(open(archivo, 'rb'), content_type=content_type)
+        except FileNotFoundError:
+            # Desalojada entre el get y el open: se sirve sin pasar por la cache
+            respuesta = HttpResponse(_generar(origen, ruta, (ancho, alto), formato), content_type=content_type)
+
+    respuesta['ETag'] = etag
+    respuesta['Cache-Control'] = f"public, max-age={getattr(settings, 'IMAGENES_CACHE_MAX_AGE', 31536000)}"
+    patch_vary_headers(respuesta, ['Accept'])
+    return respuesta
@@ -0,0 +1,120 @@
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+# Registro de consultas del request en curso. Es una ContextVar y no un
+# atributo de la conexión porque las vistas async consultan la base desde
+# los hilos de sync_to_async, que heredan el contexto pero no la conexión
+_registro = ContextVar('registro_consultas', default=None)
+
+
+class PresupuestoExcedido(Exception):
+    """Un request hizo más consultas que las que permite su presupuesto"""
+
+
+class RegistroConsultas:
+    def __init__(self):
+        self.sql = []
+
+    def __len__(self):
+        return len(self.sql)
+
+
+def _contar(execute, sql, params, many, context):
+    registro = _registro.get()
+    if registro is not None:
+        registro.sql.append(sql)
+    return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def instalar_contador(sender, connection, **kwargs):
+    if _contar not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_contar)
+
+
+@contextmanager
+def registrar_consultas():
+    """Registra las consultas hechas dentro del bloque (en cualquier hilo que herede el contexto)"""
+    for connection in connections.all(initialized_only=True):
+        instalar_contador(None, connection)
+    registro = RegistroConsultas()
+    token = _registro.set(registro)
+    try:
+        yield registro
+    finally:
+        _registro.reset(token)
+
+
+def presupuesto_para(view_name):
+    """
+    Máximo de consultas para la URL `view_name` según PRESUPUESTO_CONSULTAS
+    (o su clave 'default'). None si no tiene presupuesto.
+    """
+    presupuestos = getattr(settings, 'PRESUPUESTO_CONSULTAS', {})
+    if view_name in presupuestos:
+        return presupuestos[view_name]
+    return presupuestos.get('default')
+
+
+class PresupuestoConsultasMiddleware:
+    """
+    Cuenta las consultas SQL de cada request y las compara con el
+    presupuesto de su URL (PRESUPUESTO_CONSULTAS). Si se pasa, lo registra
+    en el log o, con PRESUPUESTO_CONSULTAS_ACCION = 'error', lanza
+    PresupuestoExcedido (pensado para los tests). Va arriba de todo para
+    contar también las consultas de sesión y autenticación. Con DEBUG (o
+    PRESUPUESTO_CONSULTAS_HEADER) agrega el header X-Consultas.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with registrar_consultas() as registro:
+            response = self.get_response(request)
+        self.verificar(request, response, registro)
+        return response
+
+    async def __acall__(self, request):
+        with registrar_consultas() as registro:
+            response = await self.get_response(request)
+        self.verificar(request, response, registro)
+        return response
+
+    def verificar(self, request, response, registro):
+        consultas = len(registro)
+        response.consultas = consultas
+        if getattr(settings, 'PRESUPUESTO_CONSULTAS_HEADER', settings.DEBUG):
+            response.headers['X-Consultas'] = str(consultas)
+
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else None
+        presupuesto = presupuesto_para(view_name)
+        if presupuesto is None or consultas <= presupuesto:
+            return
+
+        mensaje = (
+            f'{request.method} {request.path} ({view_name}) hizo {consultas} consultas; '
+            f'presupuesto {presupuesto}'
+        )
+        if getattr(settings, 'PRESUPUESTO_CONSULTAS_ACCION', 'log') == 'error':
+            detalle = '\n'.join(f'  {sql}' for sql in registro.sql)
+            raise PresupuestoExcedido(f'{mensaje}\n{detalle}')
+        logger.warning(mensaje)
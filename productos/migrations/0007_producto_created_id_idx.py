@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-17 11:14
+
+import django_countries.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0006_alter_carritoitem_carrito_alter_carritoitem_color_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='direccion',
+            name='direccion',
+            field=models.CharField(max_length=200, verbose_name='Dirección'),
+        ),
+        migrations.AlterField(
+            model_name='direccion',
+            name='pais',
+            field=django_countries.fields.CountryField(max_length=2, verbose_name='País'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['-created_at', '-id'], name='producto_created_id_idx'),
+        ),
+    ]
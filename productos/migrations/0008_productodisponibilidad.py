@@ -0,0 +1,55 @@
+# Generated by Django 5.2.8 on 2026-10-17 11:15
+
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def poblar_disponibilidad(apps, schema_editor):
+    Producto = apps.get_model('productos', 'Producto')
+    ProductoStock = apps.get_model('productos', 'ProductoStock')
+    ProductoDisponibilidad = apps.get_model('productos', 'ProductoDisponibilidad')
+
+    colores = defaultdict(set)
+    talles = defaultdict(set)
+    variantes = ProductoStock.objects.filter(stock__gt=0).values_list('producto_id', 'color_id', 'talle_id')
+    for producto_id, color_id, talle_id in variantes.iterator():
+        colores[producto_id].add(color_id)
+        talles[producto_id].add(talle_id)
+
+    ProductoDisponibilidad.objects.bulk_create(
+        (
+            ProductoDisponibilidad(
+                producto_id=producto_id,
+                colores=sorted(colores[producto_id]),
+                talles=sorted(talles[producto_id]),
+            )
+            for producto_id in Producto.objects.values_list('id', flat=True).iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0007_producto_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductoDisponibilidad',
+            fields=[
+                ('producto', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='disponibilidad', serialize=False, to='productos.producto', verbose_name='Producto')),
+                ('colores', models.JSONField(default=list, verbose_name='Colores con stock')),
+                ('talles', models.JSONField(default=list, verbose_name='Talles con stock')),
+                ('actualizado', models.DateTimeField(auto_now=True, verbose_name='Última actualización')),
+            ],
+            options={
+                'verbose_name': 'Disponibilidad de producto',
+                'verbose_name_plural': 'Disponibilidad de productos',
+            },
+        ),
+        migrations.RunPython(poblar_disponibilidad, migrations.RunPython.noop),
+    ]
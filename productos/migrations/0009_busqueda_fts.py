@@ -0,0 +1,35 @@
+# Generated by Django 5.2.8 on 2026-10-17 11:24
+
+from django.db import migrations
+
+
+def crear_tabla_busqueda(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS productos_busqueda USING fts5("
+        "nombre, descripcion, marca, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    schema_editor.execute(
+        "INSERT INTO productos_busqueda (rowid, nombre, descripcion, marca) "
+        "SELECT p.id, p.nombre, p.descripcion, COALESCE(m.nombre, '') "
+        "FROM productos_producto p LEFT JOIN productos_marca m ON m.id = p.marca_id"
+    )
+
+
+def borrar_tabla_busqueda(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS productos_busqueda")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0008_productodisponibilidad'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_tabla_busqueda, borrar_tabla_busqueda),
+    ]
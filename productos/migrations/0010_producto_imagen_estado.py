@@ -0,0 +1,35 @@
+# Generated by Django 5.2.8 on 2026-10-17 11:25
+
+from django.db import migrations, models
+
+
+def encolar_imagenes_existentes(apps, schema_editor):
+    # Las imágenes que ya estaban cargadas pasan por el worker para generar su derivado
+    Producto = apps.get_model('productos', 'Producto')
+    Producto.objects.exclude(imagen='').exclude(imagen__isnull=True).update(imagen_estado='pendiente')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0009_busqueda_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='imagen_derivada',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='productos/derivados/', verbose_name='Imagen procesada'),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='imagen_estado',
+            field=models.CharField(blank=True, choices=[('', 'Sin imagen'), ('pendiente', 'Pendiente'), ('procesando', 'Procesando'), ('lista', 'Lista'), ('error', 'Error')], db_index=True, default='', editable=False, max_length=12, verbose_name='Estado de la imagen'),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='imagen_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='Hash de la imagen'),
+        ),
+        migrations.RunPython(encolar_imagenes_existentes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-17 11:27
+
+from django.db import migrations, models
+
+
+def reencolar_imagenes(apps, schema_editor):
+    # Los productos con el derivado PNG anterior vuelven a la cola para generar las variantes
+    Producto = apps.get_model('productos', 'Producto')
+    Producto.objects.filter(imagen_estado__in=['lista', 'error']).update(imagen_estado='pendiente')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0010_producto_imagen_estado'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='imagen_variantes',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='{formato: {variante: ruta}}, generado por el worker de imágenes', verbose_name='Variantes de la imagen'),
+        ),
+        migrations.RunPython(reencolar_imagenes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-17 11:29
+
+import productos.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0011_producto_imagen_variantes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='marca',
+            name='logo',
+            field=models.ImageField(blank=True, null=True, storage=productos.storage.get_storage_contenido, upload_to='marcas/', verbose_name='Logo'),
+        ),
+        migrations.AlterField(
+            model_name='producto',
+            name='imagen',
+            field=models.ImageField(blank=True, null=True, storage=productos.storage.get_storage_contenido, upload_to='productos/', verbose_name='Imagen principal'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-17 11:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0012_almacenamiento_por_contenido'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carritoitem',
+            name='reservado',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Unidades reservadas'),
+        ),
+        migrations.AddField(
+            model_name='productostock',
+            name='reservado',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Unidades en carritos activos; lo mantiene productos/reservas.py', verbose_name='Reservado en carritos'),
+        ),
+    ]
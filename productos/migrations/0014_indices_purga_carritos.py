@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-17 11:42
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0013_reservas_de_stock'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='carrito',
+            name='session_key',
+            field=models.CharField(blank=True, db_index=True, max_length=40, null=True, verbose_name='ID de Sesión'),
+        ),
+        migrations.AddIndex(
+            model_name='carrito',
+            index=models.Index(fields=['actualizado'], name='carrito_actualizado_idx'),
+        ),
+    ]
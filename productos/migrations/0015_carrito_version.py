@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 11:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0014_indices_purga_carritos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carrito',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Versión'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-17 12:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0015_carrito_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContadorVersion',
+            fields=[
+                ('clave', models.CharField(max_length=50, primary_key=True, serialize=False, verbose_name='Clave')),
+                ('valor', models.PositiveBigIntegerField(default=0, verbose_name='Valor')),
+            ],
+            options={
+                'verbose_name': 'Contador de versión',
+                'verbose_name_plural': 'Contadores de versión',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 12:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0016_contador_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='imagen_reclamada',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Imagen tomada por un worker'),
+        ),
+    ]
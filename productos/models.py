@@ -1,11 +1,13 @@
+from decimal import Decimal
 from django.db import models
+from django.db.models import Count, DecimalField, F, Sum, Value
+from django.db.models.functions import Coalesce
 from django.core.validators import MinValueValidator
-from PIL import Image
+from django.utils import timezone
 from django_countries.fields import CountryField
-from io import BytesIO
-from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.contrib.auth.models import User
-import sys
+from .storage import get_storage_contenido
+from .images import FORMATO_FALLBACK, VARIANTES, hash_archivo
 
 class Categoria(models.Model):
     nombre = models.CharField(max_length=100, verbose_name='Nombre')
@@ -61,6 +63,7 @@ class Marca(models.Model):
     nombre = models.CharField(max_length=100, unique=True, verbose_name='Nombre')
     logo = models.ImageField(
         upload_to='marcas/',
+        storage=get_storage_contenido,
         null=True,
         blank=True,
         verbose_name='Logo'
@@ -77,6 +80,15 @@ class Marca(models.Model):
         return self.nombre
 
 
+ESTADO_IMAGEN_CHOICES = [
+    ('', 'Sin imagen'),
+    ('pendiente', 'Pendiente'),
+    ('procesando', 'Procesando'),
+    ('lista', 'Lista'),
+    ('error', 'Error'),
+]
+
+
 class Producto(models.Model):
     nombre = models.CharField(max_length=200, verbose_name='Nombre')
     descripcion = models.TextField(verbose_name='Descripción')
@@ -116,10 +128,48 @@ class Producto(models.Model):
     )
     imagen = models.ImageField(
         upload_to='productos/', 
+        storage=get_storage_contenido,
         null=True, 
         blank=True,
         verbose_name='Imagen principal'
     )
+    imagen_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        editable=False,
+        verbose_name='Hash de la imagen'
+    )
+    imagen_estado = models.CharField(
+        max_length=12,
+        choices=ESTADO_IMAGEN_CHOICES,
+        blank=True,
+        default='',
+        editable=False,
+        db_index=True,
+        verbose_name='Estado de la imagen'
+    )
+    # Cuándo un worker tomó la imagen ('procesando'); vencido el plazo, otro
+    # worker la puede volver a tomar (ver productos/tasks.py)
+    imagen_reclamada = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name='Imagen tomada por un worker'
+    )
+    imagen_derivada = models.ImageField(
+        upload_to='productos/derivados/',
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name='Imagen procesada'
+    )
+    imagen_variantes = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Variantes de la imagen',
+        help_text='{formato: {variante: ruta}}, generado por el worker de imágenes'
+    )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Fecha de creación')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Última actualización')
 
@@ -127,65 +177,53 @@ class Producto(models.Model):
         verbose_name = 'Producto'
         verbose_name_plural = 'Productos'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='producto_created_id_idx'),
+        ]
 
     def __str__(self):
         return self.nombre
     
     def save(self, *args, **kwargs):
-        """Redimensionar imagen automáticamente antes de guardar"""
-        if self.imagen:
-            self.imagen = self.resize_image(self.imagen)
+        """Guarda la imagen tal cual y encola el derivado si el contenido cambió"""
+        if not self.imagen:
+            self.imagen_hash = ''
+            self.imagen_estado = ''
+            self.imagen_derivada = None
+            self.imagen_variantes = {}
+        elif not self.imagen._committed:
+            # Archivo recién subido: sólo se reprocesa si el contenido es distinto
+            nuevo_hash = hash_archivo(self.imagen)
+            if nuevo_hash != self.imagen_hash or self.imagen_estado != 'lista':
+                self.imagen_hash = nuevo_hash
+                self.imagen_estado = 'pendiente'
         super().save(*args, **kwargs)
     
-    def resize_image(self, image_field):
-        """Redimensiona la imagen a 450x563px manteniendo proporción con fondo blanco"""
-        try:
-            # Abrir la imagen
-            img = Image.open(image_field)
-            
-            # Convertir a RGB si es necesario (para PNG con transparencia)
-            if img.mode in ('RGBA', 'LA', 'P'):
-                # Crear fondo blanco
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                if img.mode == 'P':
-                    img = img.convert('RGBA')
-                background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                img = background
-            elif img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # Calcular las nuevas dimensiones manteniendo proporción
-            img.thumbnail((450, 563), Image.Resampling.LANCZOS)
-            
-            # Crear canvas de 450x563 con fondo blanco
-            canvas = Image.new('RGB', (450, 563), (255, 255, 255))
-            
-            # Centrar la imagen en el canvas
-            offset_x = (450 - img.width) // 2
-            offset_y = (563 - img.height) // 2
-            canvas.paste(img, (offset_x, offset_y))
-            
-            # Guardar en memoria
-            output = BytesIO()
-            canvas.save(output, format='PNG', quality=95, optimize=True)
-            output.seek(0)
-            
-            # Crear nuevo archivo
-            original_name = image_field.name.split('/')[-1]
-            base_name = original_name.rsplit('.', 1)[0]
-            new_name = f"{base_name}_450x563.png"
-            
-            return InMemoryUploadedFile(
-                output,
-                'ImageField',
-                new_name,
-                'image/png',
-                sys.getsizeof(output),
-                None
-            )
-        except Exception as e:
-            print(f"Error al redimensionar imagen: {e}")
-            return image_field
+    @property
+    def imagen_url(self):
+        """URL del derivado si ya está listo; si no, la del original"""
+        if self.imagen_estado == 'lista' and self.imagen_derivada:
+            return self.imagen_derivada.url
+        if self.imagen:
+            return self.imagen.url
+        return None
+    
+    def imagen_variante_url(self, nombre='card', formato=FORMATO_FALLBACK):
+        """URL de una variante concreta, o None si todavía no se generó"""
+        if self.imagen_estado != 'lista':
+            return None
+        ruta = self.imagen_variantes.get(formato, {}).get(nombre)
+        return self.imagen.storage.url(ruta) if ruta else None
+    
+    def imagen_srcset(self, formato=FORMATO_FALLBACK):
+        """Valor de `srcset` con todas las variantes generadas en un formato"""
+        if self.imagen_estado != 'lista':
+            return ''
+        rutas = self.imagen_variantes.get(formato, {})
+        candidatos = sorted(
+            (VARIANTES[nombre][0], ruta) for nombre, ruta in rutas.items() if nombre in VARIANTES
+        )
+        return ', '.join(f'{self.imagen.storage.url(ruta)} {ancho}w' for ancho, ruta in candidatos)
     
     def get_colores_disponibles(self):
         """Retorna los colores disponibles para este producto"""
@@ -196,6 +234,20 @@ class Producto(models.Model):
         return Talle.objects.filter(
             productostock__producto=self
         ).distinct()
+    
+    def get_colores_con_stock(self):
+        """Colores con stock, desde el índice de disponibilidad (ver disponibilidad.py)"""
+        if not hasattr(self, '_colores_con_stock'):
+            from .disponibilidad import adjuntar_disponibilidad
+            adjuntar_disponibilidad([self])
+        return self._colores_con_stock
+    
+    def get_talles_con_stock(self):
+        """Talles con stock, desde el índice de disponibilidad (ver disponibilidad.py)"""
+        if not hasattr(self, '_talles_con_stock'):
+            from .disponibilidad import adjuntar_disponibilidad
+            adjuntar_disponibilidad([self])
+        return self._talles_con_stock
 
 
 class ProductoStock(models.Model):
@@ -222,6 +274,12 @@ class ProductoStock(models.Model):
         validators=[MinValueValidator(0)],
         verbose_name='Stock disponible'
     )
+    reservado = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Reservado en carritos',
+        help_text='Unidades en carritos activos; lo mantiene productos/reservas.py'
+    )
 
     class Meta:
         verbose_name = 'Stock de producto'
@@ -232,6 +290,43 @@ class ProductoStock(models.Model):
     def __str__(self):
         return f"{self.producto.nombre} - {self.color.nombre} - {self.talle.abbreviation}: {self.stock} unidades"
 
+    def save(self, *args, **kwargs):
+        # `reservado` sólo lo cambian los UPDATE condicionales de reservas.py:
+        # guardar una instancia leída antes de una reserva (admin, panel,
+        # scripts) no debe pisarlo con el valor viejo
+        if not self._state.adding and not kwargs.get('force_insert'):
+            campos = kwargs.get('update_fields')
+            if campos is None:
+                campos = [campo.name for campo in self._meta.concrete_fields if not campo.primary_key]
+            kwargs['update_fields'] = [campo for campo in campos if campo != 'reservado']
+        super().save(*args, **kwargs)
+
+    @property
+    def libre(self):
+        """Stock que todavía no está reservado en ningún carrito"""
+        return max(self.stock - self.reservado, 0)
+
+
+class ProductoDisponibilidad(models.Model):
+    """Índice desnormalizado de los colores y talles con stock de cada producto"""
+    producto = models.OneToOneField(
+        Producto,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='disponibilidad',
+        verbose_name='Producto'
+    )
+    colores = models.JSONField(default=list, verbose_name='Colores con stock')
+    talles = models.JSONField(default=list, verbose_name='Talles con stock')
+    actualizado = models.DateTimeField(auto_now=True, verbose_name='Última actualización')
+
+    class Meta:
+        verbose_name = 'Disponibilidad de producto'
+        verbose_name_plural = 'Disponibilidad de productos'
+
+    def __str__(self):
+        return f"{self.producto_id}: {len(self.colores)} colores, {len(self.talles)} talles"
+
 
 class GrupoCliente(models.Model):
     nombre = models.CharField(max_length=100, verbose_name='Nombre del Grupo')
@@ -323,6 +418,29 @@ class Direccion(models.Model):
     def __str__(self):
         return f"{self.nombre} {self.apellidos} - {self.ciudad}, {self.pais}"
     
+def _importe(campo_cantidad, campo_precio):
+    """Expresión SQL de SUM(cantidad * precio), 0 si no hay filas"""
+    return Coalesce(
+        Sum(F(campo_cantidad) * F(campo_precio), output_field=DecimalField(max_digits=12, decimal_places=2)),
+        Value(Decimal('0.00')),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+class CarritoQuerySet(models.QuerySet):
+    def con_totales(self):
+        """Anota items, unidades e importe de cada carrito en la misma consulta"""
+        return self.annotate(
+            resumen_items=Count('items'),
+            resumen_cantidad=Coalesce(Sum('items__cantidad'), 0),
+            resumen_total=_importe('items__cantidad', 'items__producto__precio'),
+        )
+
+    def tocar(self):
+        """Marca los carritos como modificados: nueva versión y fecha de actualización"""
+        return self.update(version=F('version') + 1, actualizado=timezone.now())
+
+
 class Carrito(models.Model):
     usuario = models.ForeignKey(
         User,
@@ -335,26 +453,56 @@ class Carrito(models.Model):
         max_length=40,
         null=True,
         blank=True,
+        db_index=True,
         verbose_name='ID de Sesión'
     )
     creado = models.DateTimeField(auto_now_add=True, verbose_name='Fecha de Creación')
     actualizado = models.DateTimeField(auto_now=True, verbose_name='Última Actualización')
+    # Aumenta con cada cambio de items; es el ETag de /carrito/data/
+    version = models.PositiveIntegerField(default=0, editable=False, verbose_name='Versión')
+
+    objects = CarritoQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Carrito'
         verbose_name_plural = 'Carritos'
         ordering = ['-actualizado']
+        indexes = [
+            # Purga de carritos viejos (ver productos/limpieza.py)
+            models.Index(fields=['actualizado'], name='carrito_actualizado_idx'),
+        ]
 
     def __str__(self):
         return f"Carrito {self.id} - {self.usuario or self.session_key}"
 
+    def get_resumen(self):
+        """
+        Items, unidades y total del carrito, calculados por la base en una
+        sola consulta (o tomados de las anotaciones de `con_totales`).
+        """
+        if hasattr(self, 'resumen_total'):
+            resumen = {
+                'items': self.resumen_items,
+                'cantidad_total': self.resumen_cantidad,
+                'total': self.resumen_total,
+            }
+        else:
+            resumen = self.items.aggregate(
+                items=Count('id'),
+                cantidad_total=Coalesce(Sum('cantidad'), 0),
+                total=_importe('cantidad', 'producto__precio'),
+            )
+        # SQLite no respeta los decimales del output_field en expresiones
+        resumen['total'] = Decimal(resumen['total']).quantize(Decimal('0.01'))
+        return resumen
+
     def get_total(self):
         """Calcula el total del carrito"""
-        return sum(item.get_subtotal() for item in self.items.all())
+        return self.get_resumen()['total']
 
     def get_cantidad_total(self):
         """Obtiene la cantidad total de productos"""
-        return sum(item.cantidad for item in self.items.all())
+        return self.get_resumen()['cantidad_total']
 
 
 class CarritoItem(models.Model):
@@ -384,6 +532,11 @@ class CarritoItem(models.Model):
         validators=[MinValueValidator(1)],
         verbose_name='Cantidad'
     )
+    reservado = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Unidades reservadas'
+    )
     agregado = models.DateTimeField(auto_now_add=True, verbose_name='Agregado')
 
     class Meta:
@@ -399,13 +552,35 @@ class CarritoItem(models.Model):
         return self.producto.precio * self.cantidad
 
     def get_stock_disponible(self):
-        """Obtiene el stock disponible para esta combinación"""
+        """
+        Unidades que este item puede llegar a tener: el stock libre de la
+        combinación más lo que el item ya tiene reservado.
+        """
+        # Precargado en lote por stock.adjuntar_stock / stock.anotar_stock
+        if hasattr(self, 'stock_libre'):
+            return max(self.stock_libre or 0, 0) + self.reservado
         try:
             stock = ProductoStock.objects.get(
                 producto=self.producto,
                 color=self.color,
                 talle=self.talle
             )
-            return stock.stock
+            return stock.libre + self.reservado
         except ProductoStock.DoesNotExist:
-            return 0
\ No newline at end of file
+            return 0
+
+class ContadorVersion(models.Model):
+    """
+    Contadores de versión compartidos por todos los workers. Las caches
+    locales (la de facetas, por ejemplo) guardan sus entradas bajo la
+    versión actual; aumentarla invalida todas a la vez en todos los procesos.
+    """
+    clave = models.CharField(max_length=50, primary_key=True, verbose_name='Clave')
+    valor = models.PositiveBigIntegerField(default=0, verbose_name='Valor')
+
+    class Meta:
+        verbose_name = 'Contador de versión'
+        verbose_name_plural = 'Contadores de versión'
+
+    def __str__(self):
+        return f"{self.clave}: {self.valor}"
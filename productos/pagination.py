@@ -0,0 +1,192 @@
+import base64
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+
+
+class CursorInvalido(ValueError):
+    """El cursor recibido no se pudo decodificar"""
+
+
+def codificar_cursor(producto, direccion):
+    """Codifica la posición (created_at, id) de un producto como cursor opaco"""
+    payload = json.dumps({
+        'c': producto.created_at.isoformat(),
+        'i': producto.pk,
+        'd': direccion,
+    }, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """Devuelve (created_at, id, direccion) a partir de un cursor"""
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        direccion = data['d']
+        if direccion not in ('next', 'prev'):
+            raise ValueError(direccion)
+        return datetime.fromisoformat(data['c']), int(data['i']), direccion
+    except (ValueError, KeyError, TypeError) as e:
+        raise CursorInvalido(str(e))
+
+
+class KeysetPage:
+    """Página de resultados con cursores hacia adelante y hacia atrás"""
+
+    def __init__(self, object_list, next_cursor, prev_cursor, page_size):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.page_size = page_size
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+
+class KeysetPaginator:
+    """
+    Paginación por cursor sobre (-created_at, -id).
+
+    A diferencia de OFFSET, cada página filtra por la posición del último
+    registro visto, así que la página N cuesta lo mismo que la primera y
+    sólo se traen `page_size + 1` filas por request.
+    """
+
+    def __init__(self, queryset, page_size=None):
+        self.queryset = queryset
+        self.page_size = self.normalizar_page_size(page_size)
+
+    @staticmethod
+    def normalizar_page_size(page_size):
+        default = getattr(settings, 'CATALOGO_PAGE_SIZE', 24)
+        maximo = getattr(settings, 'CATALOGO_PAGE_SIZE_MAX', 96)
+        try:
+            page_size = int(page_size)
+        except (TypeError, ValueError):
+            return default
+        return max(1, min(page_size, maximo))
+
+    def get_page(self, cursor=None):
+        """Obtiene la página correspondiente al cursor (o la primera si no hay)"""
+        qs, direccion = self._consulta(cursor)
+        return self._pagina(list(qs[:self.page_size + 1]), cursor, direccion)
+
+    async def aget_page(self, cursor=None):
+        """Versión async de `get_page`"""
+        qs, direccion = self._consulta(cursor)
+        return self._pagina([p async for p in qs[:self.page_size + 1]], cursor, direccion)
+
+    def _consulta(self, cursor):
+        direccion = 'next'
+        qs = self.queryset
+        if cursor:
+            created_at, pk, direccion = decodificar_cursor(cursor)
+            if direccion == 'next':
+                qs = qs.filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+                )
+            else:
+                qs = qs.filter(
+                    Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+                )
+
+        if direccion == 'next':
+            qs = qs.order_by('-created_at', '-id')
+        else:
+            qs = qs.order_by('created_at', 'id')
+        return qs, direccion
+
+    def _pagina(self, filas, cursor, direccion):
+        hay_mas = len(filas) > self.page_size
+        filas = filas[:self.page_size]
+
+        if direccion == 'prev':
+            filas.reverse()
+            has_next = True
+            has_previous = hay_mas
+        else:
+            has_next = hay_mas
+            has_previous = cursor is not None
+
+        next_cursor = codificar_cursor(filas[-1], 'next') if filas and has_next else None
+        prev_cursor = codificar_cursor(filas[0], 'prev') if filas and has_previous else None
+        return KeysetPage(filas, next_cursor, prev_cursor, self.page_size)
+
+
+def codificar_posicion(posicion):
+    payload = json.dumps({'o': posicion}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decodificar_posicion(cursor):
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        posicion = int(json.loads(base64.urlsafe_b64decode(cursor + padding))['o'])
+        if posicion < 0:
+            raise ValueError(posicion)
+        return posicion
+    except (ValueError, KeyError, TypeError) as e:
+        raise CursorInvalido(str(e))
+
+
+class RankedPaginator:
+    """
+    Paginación de resultados de búsqueda ordenados por relevancia.
+
+    Recibe la lista (acotada) de ids rankeados que devolvió el motor de
+    búsqueda y el queryset ya filtrado; sólo se materializan los objetos de
+    la página pedida. Los cursores son posiciones dentro de esa lista.
+    """
+
+    def __init__(self, queryset, ids_rankeados, page_size=None):
+        self.queryset = queryset
+        self.ids_rankeados = ids_rankeados
+        self.page_size = KeysetPaginator.normalizar_page_size(page_size)
+
+    def get_page(self, cursor=None):
+        inicio = decodificar_posicion(cursor) if cursor else 0
+
+        # Quitar de la lista los ids que no pasan el resto de los filtros
+        validos = set(self._validos())
+        ids = [pk for pk in self.ids_rankeados if pk in validos]
+
+        ids_pagina = ids[inicio:inicio + self.page_size]
+        objetos = self.queryset.in_bulk(ids_pagina)
+        return self._pagina(ids, ids_pagina, objetos, inicio)
+
+    async def aget_page(self, cursor=None):
+        """Versión async de `get_page`"""
+        inicio = decodificar_posicion(cursor) if cursor else 0
+        validos = {pk async for pk in self._validos()}
+        ids = [pk for pk in self.ids_rankeados if pk in validos]
+
+        ids_pagina = ids[inicio:inicio + self.page_size]
+        objetos = await self.queryset.ain_bulk(ids_pagina)
+        return self._pagina(ids, ids_pagina, objetos, inicio)
+
+    def _validos(self):
+        return self.queryset.filter(id__in=self.ids_rankeados).values_list('id', flat=True)
+
+    def _pagina(self, ids, ids_pagina, objetos, inicio):
+        filas = [objetos[pk] for pk in ids_pagina if pk in objetos]
+        fin = inicio + self.page_size
+        next_cursor = codificar_posicion(fin) if fin < len(ids) else None
+        prev_cursor = codificar_posicion(max(inicio - self.page_size, 0)) if inicio > 0 else None
+        return KeysetPage(filas, next_cursor, prev_cursor, self.page_size)
@@ -0,0 +1,378 @@
+"""
+Perfilado de requests en producción, opt-in y por muestreo.
+
+PerfiladoMiddleware perfila una fracción de los requests
+(PERFILADO_FRACCION, 0 por defecto) y los que traen el header X-Perfilar con
+un token firmado (token_perfilado(), válido PERFILADO_TOKEN_MAX_AGE
+segundos). De cada request perfilado se obtiene:
+
+- el tiempo total separado en SQL, render de plantillas y el resto (vista),
+  medidos con un execute wrapper y con el backend DjangoTemplatesMedidos;
+- las pilas de llamadas muestreadas cada PERFILADO_INTERVALO segundos por un
+  hilo aparte, guardadas en formato "collapsed" (<pila> <muestras> por
+  línea) en PERFILADO_DIR/<id>.folded, listo para flamegraph.pl, speedscope
+  o inferno.
+
+El muestreo sólo lee la pila del hilo del request desde otro hilo
+(sys._current_frames), así que el request no paga nada por llamada a
+función, a diferencia de cProfile. Los requests que no se perfilan sólo se
+cronometran; si tardan más de PERFILADO_LENTO_MS también quedan registrados.
+El registro (PERFILADO_DIR/requests.jsonl) es un archivo y no la cache para
+que /panel/perfiles/ vea los requests de todos los workers.
+
+Bajo ASGI las vistas async corren en el hilo del event loop: las muestras
+de esos requests incluyen lo que ejecuten otras corrutinas en ese momento y
+no ven el código que corre en los hilos de sync_to_async. Los tiempos de
+SQL y plantillas no tienen esa limitación.
+"""
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from pathlib import Path
+from uuid import uuid4
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.files import locks
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates, Template
+
+logger = logging.getLogger(__name__)
+
+SALT = 'productos.perfilado'
+REGISTRO = 'requests.jsonl'
+# Nombres válidos de archivos de perfil (los genera _nuevo_id)
+ARCHIVO_VALIDO = re.compile(r'^[0-9a-f]{12}\.folded$')
+
+# Perfil del request en curso; ContextVar por lo mismo que el registro de
+# consultas de middleware.py: sync_to_async hereda el contexto
+_perfil = ContextVar('perfil_request', default=None)
+
+
+class Perfil:
+    """Tiempos acumulados (en segundos) de un request perfilado"""
+
+    def __init__(self):
+        self.sql = 0.0
+        self.consultas = 0
+        self.plantilla = 0.0
+        # SQL ejecutado durante el render (lazy querysets en las plantillas):
+        # se descuenta del tiempo de plantilla para no contarlo dos veces
+        self.sql_en_plantilla = 0.0
+        self.renders_abiertos = 0
+
+
+def _medir_sql(execute, sql, params, many, context):
+    perfil = _perfil.get()
+    if perfil is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duracion = time.perf_counter() - inicio
+        perfil.sql += duracion
+        perfil.consultas += 1
+        if perfil.renders_abiertos:
+            perfil.sql_en_plantilla += duracion
+
+
+@receiver(connection_created)
+def instalar_medidor(sender, connection, **kwargs):
+    if _medir_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_medir_sql)
+
+
+class PlantillaMedida(Template):
+    def render(self, context=None, request=None):
+        perfil = _perfil.get()
+        if perfil is None:
+            return super().render(context, request)
+        perfil.renders_abiertos += 1
+        inicio = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            perfil.renders_abiertos -= 1
+            # Sólo el render más externo: los {% include %} ya están adentro
+            if not perfil.renders_abiertos:
+                perfil.plantilla += time.perf_counter() - inicio
+
+
+class DjangoTemplatesMedidos(DjangoTemplates):
+    """
+    Backend DjangoTemplates que mide el render de los requests perfilados.
+    Fuera de un perfil sólo agrega una lectura de la ContextVar por render.
+    """
+
+    def from_string(self, template_code):
+        return PlantillaMedida(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return PlantillaMedida(super().get_template(template_name).template, self)
+
+
+def _marco(frame):
+    codigo = frame.f_code
+    return f'{frame.f_globals.get("__name__", "?")}:{codigo.co_qualname}'
+
+
+class Muestreador(threading.Thread):
+    """
+    Hilo que cada `intervalo` segundos toma la pila del hilo `hilo_id` y
+    cuenta cuántas veces aparece cada una. Las pilas se cortan en el marco
+    con código `raiz` (el middleware) para no repetir el servidor en todas.
+    """
+
+    def __init__(self, hilo_id, intervalo, raiz=None):
+        super().__init__(name=f'perfilado-{hilo_id}', daemon=True)
+        self.hilo_id = hilo_id
+        self.intervalo = intervalo
+        self.raiz = raiz
+        self.pilas = Counter()
+        self._fin = threading.Event()
+
+    def run(self):
+        while not self._fin.wait(self.intervalo):
+            frame = sys._current_frames().get(self.hilo_id)
+            if frame is None:
+                return
+            marcos = []
+            while frame is not None:
+                marcos.append(_marco(frame))
+                if frame.f_code is self.raiz:
+                    break
+                frame = frame.f_back
+            del frame
+            self.pilas[';'.join(reversed(marcos))] += 1
+
+    def detener(self):
+        self._fin.set()
+        self.join()
+
+
+def token_perfilado():
+    """Valor del header X-Perfilar que pide perfilar un request"""
+    return signing.TimestampSigner(salt=SALT).sign('perfilar')
+
+
+def motivo_perfilado(request):
+    """'header' o 'muestra' si el request se perfila, None si no"""
+    token = request.headers.get('X-Perfilar')
+    if token:
+        try:
+            signing.TimestampSigner(salt=SALT).unsign(
+                token, max_age=getattr(settings, 'PERFILADO_TOKEN_MAX_AGE', 3600)
+            )
+            return 'header'
+        except signing.BadSignature:
+            pass
+    fraccion = getattr(settings, 'PERFILADO_FRACCION', 0)
+    if fraccion and random.random() < fraccion:
+        return 'muestra'
+    return None
+
+
+def directorio_perfiles():
+    return Path(getattr(settings, 'PERFILADO_DIR', settings.BASE_DIR / 'perfiles'))
+
+
+def _nuevo_id():
+    return uuid4().hex[:12]
+
+
+def _anotar(registro):
+    """
+    Agrega `registro` a requests.jsonl. Una línea por write en modo append,
+    así varios workers escriben sin pisarse. Pasado PERFILADO_REGISTRO_MAX_BYTES
+    el archivo rota a requests.jsonl.1 y se borran los perfiles del anterior.
+    """
+    directorio = directorio_perfiles()
+    directorio.mkdir(parents=True, exist_ok=True)
+    ruta = directorio / REGISTRO
+    maximo = getattr(settings, 'PERFILADO_REGISTRO_MAX_BYTES', 1024 * 1024)
+    with open(ruta, 'a', encoding='utf-8') as archivo:
+        archivo.write(json.dumps(registro, ensure_ascii=False) + '\n')
+        tamaño = archivo.tell()
+    if tamaño > maximo:
+        _rotar(directorio, maximo)
+
+
+def _rotar(directorio, maximo):
+    """
+    Rota requests.jsonl a requests.jsonl.1 bajo un lock entre procesos. Varios
+    workers pueden pasar el límite a la vez: el tamaño se vuelve a mirar con
+    el lock tomado, y los que llegan tarde encuentran el archivo ya rotado y
+    no borran los perfiles que acaban de pasar a requests.jsonl.1.
+    """
+    ruta = directorio / REGISTRO
+    with open(directorio / f'{REGISTRO}.lock', 'wb') as cerrojo:
+        locks.lock(cerrojo, locks.LOCK_EX)
+        try:
+            try:
+                if ruta.stat().st_size <= maximo:
+                    return
+            except FileNotFoundError:
+                return
+            viejo = directorio / f'{REGISTRO}.1'
+            for anterior in _leer(viejo):
+                if anterior.get('archivo'):
+                    (directorio / anterior['archivo']).unlink(missing_ok=True)
+            os.replace(ruta, viejo)
+        finally:
+            locks.unlock(cerrojo)
+
+
+def _leer(ruta):
+    try:
+        lineas = Path(ruta).read_text(encoding='utf-8').splitlines()
+    except FileNotFoundError:
+        return []
+    registros = []
+    for linea in lineas:
+        try:
+            registros.append(json.loads(linea))
+        except ValueError:
+            continue  # línea cortada por una escritura concurrente o un corte
+    return registros
+
+
+def requests_registrados():
+    """Requests perfilados o lentos registrados, del más viejo al más nuevo"""
+    directorio = directorio_perfiles()
+    return _leer(directorio / f'{REGISTRO}.1') + _leer(directorio / REGISTRO)
+
+
+def _ms(segundos):
+    return round(segundos * 1000, 1)
+
+
+class PerfiladoMiddleware:
+    """
+    Perfila los requests elegidos por motivo_perfilado() (ver el docstring
+    del módulo) y registra los lentos. Va arriba de todo para que el tiempo
+    total incluya sesión, autenticación y el resto de los middlewares. A los
+    requests pedidos con X-Perfilar les agrega el header X-Perfil con el id
+    del perfil.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        motivo = motivo_perfilado(request)
+        inicio = time.perf_counter()
+        if motivo is None:
+            response = self.get_response(request)
+            self.registrar_lento(request, response, time.perf_counter() - inicio)
+            return response
+
+        perfil, token, muestreador = self.empezar(PerfiladoMiddleware.__call__.__code__)
+        try:
+            response = self.get_response(request)
+        finally:
+            total = time.perf_counter() - inicio
+            muestreador.detener()
+            _perfil.reset(token)
+        self.terminar(request, response, motivo, perfil, muestreador, total)
+        return response
+
+    async def __acall__(self, request):
+        motivo = motivo_perfilado(request)
+        inicio = time.perf_counter()
+        if motivo is None:
+            response = await self.get_response(request)
+            total = time.perf_counter() - inicio
+            if total * 1000 >= getattr(settings, 'PERFILADO_LENTO_MS', 500):
+                await sync_to_async(self.registrar_lento, thread_sensitive=False)(request, response, total)
+            return response
+
+        perfil, token, muestreador = self.empezar(None)
+        try:
+            response = await self.get_response(request)
+        finally:
+            total = time.perf_counter() - inicio
+            muestreador.detener()
+            _perfil.reset(token)
+        await sync_to_async(self.terminar, thread_sensitive=False)(
+            request, response, motivo, perfil, muestreador, total
+        )
+        return response
+
+    def empezar(self, raiz):
+        for connection in connections.all(initialized_only=True):
+            instalar_medidor(None, connection)
+        perfil = Perfil()
+        token = _perfil.set(perfil)
+        muestreador = Muestreador(
+            threading.get_ident(), getattr(settings, 'PERFILADO_INTERVALO', 0.005), raiz
+        )
+        muestreador.start()
+        return perfil, token, muestreador
+
+    def datos(self, request, response, total):
+        match = getattr(request, 'resolver_match', None)
+        return {
+            'id': _nuevo_id(),
+            'fecha': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'metodo': request.method,
+            'ruta': request.get_full_path()[:300],
+            'vista': match.view_name if match else None,
+            'estado': response.status_code,
+            'total_ms': _ms(total),
+        }
+
+    def registrar_lento(self, request, response, total):
+        if total * 1000 < getattr(settings, 'PERFILADO_LENTO_MS', 500):
+            return
+        try:
+            _anotar({**self.datos(request, response, total), 'perfilado': False})
+        except OSError:
+            logger.exception('No se pudo registrar el request lento')
+
+    def terminar(self, request, response, motivo, perfil, muestreador, total):
+        registro = self.datos(request, response, total)
+        plantilla = max(perfil.plantilla - perfil.sql_en_plantilla, 0.0)
+        registro.update({
+            'perfilado': True,
+            'motivo': motivo,
+            'sql_ms': _ms(perfil.sql),
+            'consultas': perfil.consultas,
+            'plantilla_ms': _ms(plantilla),
+            'vista_ms': _ms(max(total - perfil.sql - plantilla, 0.0)),
+            'muestras': sum(muestreador.pilas.values()),
+            'archivo': None,
+        })
+        try:
+            if muestreador.pilas:
+                registro['archivo'] = f'{registro["id"]}.folded'
+                directorio = directorio_perfiles()
+                directorio.mkdir(parents=True, exist_ok=True)
+                (directorio / registro['archivo']).write_text(
+                    ''.join(f'{pila} {n}\n' for pila, n in muestreador.pilas.most_common()),
+                    encoding='utf-8',
+                )
+            _anotar(registro)
+        except OSError:
+            logger.exception('No se pudo guardar el perfil del request')
+        if motivo == 'header':
+            response.headers['X-Perfil'] = registro['id']
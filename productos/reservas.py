@@ -0,0 +1,236 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .eventos import avisar_carrito, avisar_stock
+from .models import Carrito, CarritoItem, ProductoStock
+from .stock import resolver_stock
+
+logger = logging.getLogger(__name__)
+
+
+class StockInsuficiente(Exception):
+    """No alcanza el stock libre para reservar la cantidad pedida"""
+
+    def __init__(self, disponible):
+        # Unidades que el item podría tener como máximo
+        self.disponible = disponible
+        super().__init__(f'Solo hay {disponible} unidades disponibles')
+
+
+class ConflictoReserva(Exception):
+    """El item cambió en otro request mientras se reservaba"""
+
+
+class _SinStock(Exception):
+    """Deshace un lote de reservar_lote al que le faltó stock"""
+
+
+def _variante(item):
+    return ProductoStock.objects.filter(
+        producto_id=item.producto_id, color_id=item.color_id, talle_id=item.talle_id
+    )
+
+
+def reservar(item, nueva_cantidad):
+    """
+    Deja `item` con `nueva_cantidad` unidades, reservando (o liberando) la
+    diferencia contra ProductoStock.reservado.
+
+    La reserva es un UPDATE condicional `... WHERE stock >= reservado + n`:
+    la comparación y el incremento los hace la base en una sola sentencia,
+    así que dos compradores nunca pueden quedarse con la última unidad. El
+    item se actualiza con bloqueo optimista sobre `reservado` (y además con
+    SELECT FOR UPDATE donde la base lo soporta); todo va en una transacción.
+    """
+    with transaction.atomic():
+        if connection.features.has_select_for_update:
+            item.reservado = (
+                CarritoItem.objects.select_for_update()
+                .values_list('reservado', flat=True).get(pk=item.pk)
+            )
+        reservado_antes = item.reservado
+        delta = nueva_cantidad - reservado_antes
+
+        actualizado = CarritoItem.objects.filter(pk=item.pk, reservado=reservado_antes).update(
+            cantidad=nueva_cantidad, reservado=nueva_cantidad
+        )
+        if not actualizado:
+            raise ConflictoReserva()
+
+        if delta > 0:
+            tomado = _variante(item).filter(stock__gte=F('reservado') + delta).update(
+                reservado=F('reservado') + delta
+            )
+            if not tomado:
+                libre = _variante(item).values_list(F('stock') - F('reservado'), flat=True).first() or 0
+                raise StockInsuficiente(max(libre, 0) + reservado_antes)
+        elif delta < 0:
+            _variante(item).update(reservado=Greatest(F('reservado') + delta, 0))
+
+        Carrito.objects.filter(pk=item.carrito_id).tocar()
+        avisar_carrito(item.carrito_id)
+        if delta:
+            avisar_stock([item.producto_id])
+
+    item.cantidad = item.reservado = nueva_cantidad
+    return item
+
+
+def _sumar_reservas(deltas, condicion=None):
+    """
+    Suma a ProductoStock.reservado el delta de cada variante en un solo
+    UPDATE con CASE, sin bajar de 0. `condicion(delta)` agrega un filtro
+    por variante. Devuelve la cantidad de variantes actualizadas.
+    """
+    variantes = [Q(producto_id=p, color_id=c, talle_id=t) for p, c, t in deltas]
+    filtros = [v & condicion(d) if condicion else v for v, d in zip(variantes, deltas.values())]
+    return ProductoStock.objects.filter(Q(*filtros, _connector=Q.OR)).update(reservado=Greatest(
+        F('reservado') + Case(
+            *(When(variante, then=Value(delta)) for variante, delta in zip(variantes, deltas.values())),
+            default=Value(0), output_field=IntegerField(),
+        ),
+        0,
+    ))
+
+
+def reservar_lote(carrito_id, cambios):
+    """
+    `reservar` para varios items del mismo carrito: `cambios` es una lista
+    de (item, nueva_cantidad), y cantidad 0 borra el item. En lugar de cinco
+    consultas por item usa un UPDATE con CASE para los items (con el mismo
+    bloqueo optimista sobre `reservado`), otro para el stock de las
+    variantes que suben, condicional en cada una, y otro para las que
+    bajan. Si alguna variante no tiene stock libre se deshace todo el lote.
+    """
+    cambios = [(item, n) for item, n in cambios if n != item.cantidad or n != item.reservado]
+    if not cambios:
+        return
+    quedan = [(item, n) for item, n in cambios if n > 0]
+    borrar = [item for item, n in cambios if n == 0]
+    deltas = {
+        (item.producto_id, item.color_id, item.talle_id): n - item.reservado
+        for item, n in cambios if n != item.reservado
+    }
+    try:
+        with transaction.atomic():
+            if quedan:
+                items = [Q(pk=item.pk, reservado=item.reservado) for item, _ in quedan]
+                cantidades = Case(*(When(c, then=Value(n)) for c, (_, n) in zip(items, quedan)), output_field=IntegerField())
+                actualizados = CarritoItem.objects.filter(Q(*items, _connector=Q.OR)).update(
+                    cantidad=cantidades, reservado=cantidades,
+                )
+                if actualizados != len(quedan):
+                    raise ConflictoReserva()
+            if borrar:
+                filas = CarritoItem.objects.filter(Q(*(Q(pk=i.pk, reservado=i.reservado) for i in borrar), _connector=Q.OR))
+                # Las señales post_delete reconocen este borrado: el stock se libera abajo
+                filas.reservas_liberadas = True
+                if filas.delete()[1].get(CarritoItem._meta.label, 0) != len(borrar):
+                    raise ConflictoReserva()
+
+            suben = {clave: delta for clave, delta in deltas.items() if delta > 0}
+            if suben:
+                # Condicional en cada variante: sólo se toma si alcanza el stock libre
+                tomadas = _sumar_reservas(suben, condicion=lambda delta: Q(stock__gte=F('reservado') + delta))
+                if tomadas != len(suben):
+                    raise _SinStock()
+            bajan = {clave: delta for clave, delta in deltas.items() if delta < 0}
+            if bajan:
+                _sumar_reservas(bajan)
+
+            Carrito.objects.filter(pk=carrito_id).tocar()
+            avisar_carrito(carrito_id)
+            avisar_stock(clave[0] for clave in deltas)
+    except _SinStock:
+        # Con el lote ya deshecho: se informa la primera variante sin stock
+        reservado = {(i.producto_id, i.color_id, i.talle_id): i.reservado for i, _ in cambios}
+        for clave, libre in resolver_stock(c for c, delta in deltas.items() if delta > 0).items():
+            if libre < deltas[clave]:
+                raise StockInsuficiente(libre + reservado[clave])
+        raise ConflictoReserva()
+
+    for item, n in quedan:
+        item.cantidad = item.reservado = n
+
+
+def liberar(item):
+    """Devuelve al stock libre lo que el item tenía reservado"""
+    if item.reservado:
+        _variante(item).update(reservado=Greatest(F('reservado') - item.reservado, 0))
+        avisar_stock([item.producto_id])
+
+
+def quitar_items(items):
+    """
+    Borra los items del queryset `items` devolviendo sus reservas al stock
+    en un solo UPDATE, y actualiza la versión de cada carrito una vez. Sin
+    esto el borrado dispara, por cada item, un UPDATE de stock y otro de
+    versión desde las señales de signals.py.
+    Devuelve la cantidad de items borrados.
+    """
+    with transaction.atomic():
+        filas = list(items.values_list('carrito_id', 'producto_id', 'color_id', 'talle_id', 'reservado'))
+        if not filas:
+            return 0
+        por_variante = {}
+        for _, producto_id, color_id, talle_id, reservado in filas:
+            if reservado:
+                clave = (producto_id, color_id, talle_id)
+                por_variante[clave] = por_variante.get(clave, 0) + reservado
+        if por_variante:
+            condiciones = [
+                Q(producto_id=p, color_id=c, talle_id=t) for p, c, t in por_variante
+            ]
+            ProductoStock.objects.filter(Q(*condiciones, _connector=Q.OR)).update(reservado=Greatest(
+                F('reservado') - Case(
+                    *(When(condicion, then=Value(n)) for condicion, n in zip(condiciones, por_variante.values())),
+                    default=Value(0), output_field=IntegerField(),
+                ),
+                0,
+            ))
+
+        # Las señales post_delete reconocen este borrado y no repiten el trabajo
+        items = items.all()
+        items.reservas_liberadas = True
+        items.delete()
+
+        carrito_ids = {fila[0] for fila in filas}
+        Carrito.objects.filter(pk__in=carrito_ids).tocar()
+        for carrito_id in carrito_ids:
+            avisar_carrito(carrito_id)
+        avisar_stock(producto_id for producto_id, _, _ in por_variante)
+    return len(filas)
+
+
+def liberar_reservas_vencidas(minutos=None, lote=500):
+    """
+    Libera las reservas de los carritos sin actividad en los últimos
+    CARRITO_RESERVA_MINUTOS. Los items quedan en el carrito sin reserva y
+    se vuelven a reservar cuando el comprador los modifica.
+    Devuelve la cantidad de items liberados.
+    """
+    if minutos is None:
+        minutos = getattr(settings, 'CARRITO_RESERVA_MINUTOS', 60)
+    limite = timezone.now() - timedelta(minutes=minutos)
+    vencidos = CarritoItem.objects.filter(reservado__gt=0, carrito__actualizado__lt=limite)
+
+    liberados = 0
+    while True:
+        items = list(vencidos.only('id', 'producto_id', 'color_id', 'talle_id', 'reservado')[:lote])
+        if not items:
+            break
+        for item in items:
+            with transaction.atomic():
+                # Condicional: si el comprador volvió y lo modificó, no se toca
+                if CarritoItem.objects.filter(pk=item.pk, reservado=item.reservado).update(reservado=0):
+                    liberar(item)
+                    liberados += 1
+    if liberados:
+        logger.info('Reservas vencidas liberadas: %s items', liberados)
+    return liberados
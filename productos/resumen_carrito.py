@@ -0,0 +1,108 @@
+import time
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .models import Carrito
+
+CLAVE_SESION = 'carrito_resumen'
+
+
+def buscar_carrito(request, carritos=None):
+    """
+    Carrito del usuario o de la sesión actual, sin crearlo si no existe.
+    `carritos` es el queryset donde buscarlo, para anotar la misma consulta.
+    """
+    if carritos is None:
+        carritos = Carrito.objects.all()
+    if request.user.is_authenticated:
+        return carritos.filter(usuario=request.user).first()
+    session_key = request.session.session_key
+    if session_key:
+        return carritos.filter(session_key=session_key).first()
+    return None
+
+
+async def abuscar_carrito(request):
+    """Versión async de `buscar_carrito`"""
+    usuario = await request.auser()
+    if usuario.is_authenticated:
+        return await Carrito.objects.filter(usuario=usuario).afirst()
+    session_key = request.session.session_key
+    if session_key:
+        return await Carrito.objects.filter(session_key=session_key).afirst()
+    return None
+
+
+def _puede_guardar(request):
+    # No se crea una sesión sólo para guardar un resumen vacío (bots, primeras visitas)
+    return request.user.is_authenticated or request.session.session_key is not None
+
+
+def guardar_resumen(request, resumen):
+    """
+    Guarda en la sesión el resumen de un carrito: unidades, total y una
+    versión que aumenta con cada cambio. Las vistas del carrito lo llaman
+    después de cada modificación con el resultado de `Carrito.get_resumen()`.
+    """
+    anterior = request.session.get(CLAVE_SESION) or {}
+    datos = {
+        'cantidad': resumen['cantidad_total'],
+        'total': str(resumen['total']),
+        'version': anterior.get('version', 0) + 1,
+        'ts': int(time.time()),
+    }
+    if _puede_guardar(request):
+        request.session[CLAVE_SESION] = datos
+    return datos
+
+
+def actualizar_resumen(request, resumen):
+    """
+    Como `guardar_resumen`, pero sin escribir la sesión si el resumen
+    guardado ya coincide: para las vistas de lectura, que no deben guardar
+    la sesión en cada request.
+    """
+    anterior = request.session.get(CLAVE_SESION)
+    if anterior and anterior['cantidad'] == resumen['cantidad_total'] and Decimal(anterior['total']) == resumen['total']:
+        return anterior
+    return guardar_resumen(request, resumen)
+
+
+def obtener_resumen(request):
+    """
+    Resumen del carrito para el navbar. Sale de la sesión mientras tenga
+    menos de CARRITO_RESUMEN_TTL segundos; si no, se recalcula con una
+    consulta (cubre cambios hechos desde otro dispositivo o desde el admin).
+    """
+    datos = request.session.get(CLAVE_SESION)
+    ttl = getattr(settings, 'CARRITO_RESUMEN_TTL', 300)
+    if datos and time.time() - datos['ts'] < ttl:
+        return datos
+    if not _puede_guardar(request):
+        return {'cantidad': 0, 'total': '0', 'version': 0, 'ts': 0}
+
+    carrito = buscar_carrito(request)
+    if carrito is None:
+        resumen = {'cantidad_total': 0, 'total': Decimal('0')}
+    else:
+        resumen = carrito.get_resumen()
+    return guardar_resumen(request, resumen)
+
+
+async def aobtener_resumen(request):
+    """Versión async de `obtener_resumen`"""
+    datos = await request.session.aget(CLAVE_SESION)
+    ttl = getattr(settings, 'CARRITO_RESUMEN_TTL', 300)
+    if datos and time.time() - datos['ts'] < ttl:
+        return datos
+    if not (await request.auser()).is_authenticated and request.session.session_key is None:
+        return {'cantidad': 0, 'total': '0', 'version': 0, 'ts': 0}
+
+    carrito = await abuscar_carrito(request)
+    if carrito is None:
+        resumen = {'cantidad_total': 0, 'total': Decimal('0')}
+    else:
+        resumen = await sync_to_async(carrito.get_resumen)()
+    return guardar_resumen(request, resumen)
@@ -0,0 +1,202 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .models import Producto
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def limite_resultados():
+    """Máximo de resultados de una búsqueda (BUSQUEDA_MAX_RESULTADOS; None = sin límite)"""
+    return getattr(settings, 'BUSQUEDA_MAX_RESULTADOS', None)
+
+
+def tokenizar(q):
+    """Separa la consulta en términos, descartando operadores y puntuación"""
+    return TOKEN_RE.findall(q or '')[:10]
+
+
+class BaseSearchBackend:
+    """
+    Interfaz de los motores de búsqueda de productos.
+
+    Un backend mantiene su propio índice (`indexar`/`eliminar`) y sabe
+    devolver los ids mejor rankeados (`buscar`) o restringir un queryset a
+    esos mismos productos (`filtrar`), para combinarlo con las facetas.
+    Los dos respetan BUSQUEDA_MAX_RESULTADOS: lo que no se puede listar
+    tampoco se cuenta.
+    """
+
+    def indexar(self, producto_ids):
+        pass
+
+    def eliminar(self, producto_ids):
+        pass
+
+    def reindexar_todo(self):
+        pass
+
+    def buscar(self, q, limite=None):
+        raise NotImplementedError
+
+    def filtrar(self, queryset, q, todos=False):
+        """Con `todos` no se acota a BUSQUEDA_MAX_RESULTADOS (búsquedas del admin)"""
+        raise NotImplementedError
+
+
+class BasicSearchBackend(BaseSearchBackend):
+    """Búsqueda con icontains, sin índice. Sirve para bases sin motor de texto"""
+
+    def _condicion(self, q):
+        condicion = Q()
+        for termino in tokenizar(q):
+            condicion &= (
+                Q(nombre__icontains=termino)
+                | Q(descripcion__icontains=termino)
+                | Q(marca__nombre__icontains=termino)
+            )
+        return condicion
+
+    def buscar(self, q, limite=None):
+        if not tokenizar(q):
+            return []
+        limite = limite or limite_resultados()
+        ids = Producto.objects.filter(self._condicion(q)).order_by('-created_at', '-id').values_list('id', flat=True)
+        return list(ids[:limite] if limite else ids)
+
+    def filtrar(self, queryset, q, todos=False):
+        if not tokenizar(q):
+            return queryset.none()
+        if limite_resultados() and not todos:
+            # Los mismos ids que `buscar`, para que las facetas cuenten lo que
+            # se puede listar (no todos los motores aceptan LIMIT en un IN)
+            return queryset.filter(id__in=self.buscar(q))
+        return queryset.filter(self._condicion(q))
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    """
+    Búsqueda sobre una tabla virtual FTS5.
+
+    El tokenizer unicode61 con remove_diacritics pliega acentos tanto al
+    indexar como al consultar ("pantalon" encuentra "Pantalón"), cada término
+    se busca por prefijo y el orden es BM25 con más peso para el nombre.
+    """
+
+    tabla = 'productos_busqueda'
+    # Pesos BM25 por columna: nombre, descripcion, marca
+    pesos = (10.0, 1.0, 5.0)
+    batch_size = 500
+
+    def expresion(self, q):
+        """Convierte el texto del usuario en una expresión MATCH segura"""
+        return ' '.join(f'"{termino}"*' for termino in tokenizar(q))
+
+    def _lotes(self, producto_ids):
+        producto_ids = list(producto_ids)
+        for inicio in range(0, len(producto_ids), self.batch_size):
+            lote = producto_ids[inicio:inicio + self.batch_size]
+            yield lote, ', '.join(['%s'] * len(lote))
+
+    def indexar(self, producto_ids):
+        with connection.cursor() as cursor:
+            for lote, placeholders in self._lotes(producto_ids):
+                cursor.execute(
+                    f'DELETE FROM {self.tabla} WHERE rowid IN ({placeholders})',
+                    lote,
+                )
+                cursor.execute(
+                    f'INSERT INTO {self.tabla} (rowid, nombre, descripcion, marca) '
+                    f'SELECT p.id, p.nombre, p.descripcion, COALESCE(m.nombre, \'\') '
+                    f'FROM productos_producto p LEFT JOIN productos_marca m ON m.id = p.marca_id '
+                    f'WHERE p.id IN ({placeholders})',
+                    lote,
+                )
+
+    def eliminar(self, producto_ids):
+        with connection.cursor() as cursor:
+            for lote, placeholders in self._lotes(producto_ids):
+                cursor.execute(
+                    f'DELETE FROM {self.tabla} WHERE rowid IN ({placeholders})',
+                    lote,
+                )
+
+    def reindexar_todo(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.tabla}')
+            cursor.execute(
+                f'INSERT INTO {self.tabla} (rowid, nombre, descripcion, marca) '
+                f'SELECT p.id, p.nombre, p.descripcion, COALESCE(m.nombre, \'\') '
+                f'FROM productos_producto p LEFT JOIN productos_marca m ON m.id = p.marca_id'
+            )
+            cursor.execute(f"INSERT INTO {self.tabla} ({self.tabla}) VALUES ('optimize')")
+
+    def _rankeados(self, expresion, limite):
+        """
+        SQL (y parámetros) de los ids que matchean, ordenados por BM25.
+
+        Calcular bm25() es lo caro, y ordenar exige calcularlo para cada fila
+        que matchea. Para que la latencia no crezca con el catálogo, el
+        ranking se hace sobre los `BUSQUEDA_VENTANA_CANDIDATOS` matches más
+        recientes: la subconsulta ubica el rowid que corta esa ventana
+        (recorrer el doclist por rowid no calcula puntajes) y se rankea sólo
+        dentro del rango, que FTS5 resuelve sin mirar el resto.
+        """
+        ventana = getattr(settings, 'BUSQUEDA_VENTANA_CANDIDATOS', 2000)
+        pesos = ', '.join(str(p) for p in self.pesos)
+        sql = (
+            f'SELECT rowid FROM {self.tabla} WHERE {self.tabla} MATCH %s AND rowid >= COALESCE(('
+            f'SELECT rowid FROM {self.tabla} WHERE {self.tabla} MATCH %s '
+            f'ORDER BY rowid DESC LIMIT 1 OFFSET %s), 0) '
+            f'ORDER BY bm25({self.tabla}, {pesos}), rowid DESC'
+        )
+        params = [expresion, expresion, ventana - 1]
+        if limite:
+            sql += ' LIMIT %s'
+            params.append(limite)
+        return sql, params
+
+    def buscar(self, q, limite=None):
+        """Ids ordenados por BM25 (ver `_rankeados`)"""
+        expresion = self.expresion(q)
+        if not expresion:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(*self._rankeados(expresion, limite or limite_resultados()))
+            return [fila[0] for fila in cursor.fetchall()]
+
+    def filtrar(self, queryset, q, todos=False):
+        """
+        Los mismos candidatos que `buscar`: las facetas cuentan exactamente
+        los productos que el listado puede mostrar
+        """
+        expresion = self.expresion(q)
+        if not expresion:
+            return queryset.none()
+        if todos:
+            return queryset.filter(id__in=RawSQL(
+                f'SELECT rowid FROM {self.tabla} WHERE {self.tabla} MATCH %s', [expresion],
+            ))
+        return queryset.filter(id__in=RawSQL(*self._rankeados(expresion, limite_resultados())))
+
+
+_backend = None
+
+
+def get_backend():
+    """Backend configurado en BUSQUEDA_BACKEND, o uno acorde al motor de base de datos"""
+    global _backend
+    if _backend is None:
+        ruta = getattr(settings, 'BUSQUEDA_BACKEND', None)
+        if ruta:
+            _backend = import_string(ruta)()
+        elif connection.vendor == 'sqlite':
+            _backend = SQLiteFTSBackend()
+        else:
+            _backend = BasicSearchBackend()
+    return _backend
@@ -0,0 +1,184 @@
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import Producto, ProductoStock, Marca, Categoria, Carrito, CarritoItem
+from .disponibilidad import recalcular_disponibilidad
+from .facets import invalidar_facetas
+from .search import get_backend
+from .autocomplete import indice as indice_autocompletado
+from .storage import liberar_al_confirmar
+from .reservas import liberar as liberar_reserva
+from .eventos import avisar_carrito, avisar_stock
+
+
+@receiver(post_save, sender=ProductoStock)
+@receiver(post_delete, sender=ProductoStock)
+def actualizar_disponibilidad(sender, instance, raw=False, **kwargs):
+    """Mantiene el índice de disponibilidad sincronizado con el stock"""
+    if raw:
+        return
+    producto_id = instance.producto_id
+    transaction.on_commit(lambda: recalcular_disponibilidad([producto_id]))
+
+
+@receiver(post_save, sender=Producto)
+def crear_disponibilidad(sender, instance, raw=False, created=False, **kwargs):
+    """Un producto nuevo arranca con su fila (vacía) en el índice de disponibilidad"""
+    if raw or not created:
+        return
+    producto_id = instance.pk
+    transaction.on_commit(lambda: recalcular_disponibilidad([producto_id]))
+
+
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+@receiver(post_delete, sender=ProductoStock)
+@receiver(m2m_changed, sender=Producto.colores.through)
+def invalidar_cache_facetas(sender, **kwargs):
+    """Los conteos de facetas dependen de productos, colores y variantes de stock"""
+    transaction.on_commit(invalidar_facetas)
+
+
+@receiver(post_init, sender=ProductoStock)
+def recordar_variante(sender, instance, **kwargs):
+    instance._variante_guardada = (instance.__dict__.get('producto_id'), instance.__dict__.get('talle_id'))
+
+
+@receiver(post_save, sender=ProductoStock)
+def invalidar_facetas_variante(sender, instance, created=False, raw=False, **kwargs):
+    """
+    La faceta de talle cuenta variantes existentes, no unidades: cambiar la
+    cantidad no altera ningún conteo y no invalida la cache
+    """
+    variante = (instance.producto_id, instance.talle_id)
+    if raw or created or variante != instance._variante_guardada:
+        transaction.on_commit(invalidar_facetas)
+    instance._variante_guardada = variante
+
+
+@receiver(post_save, sender=Producto)
+def indexar_producto(sender, instance, raw=False, **kwargs):
+    """Actualiza el índice de búsqueda del producto guardado"""
+    if raw:
+        return
+    producto_id = instance.pk
+    transaction.on_commit(lambda: get_backend().indexar([producto_id]))
+
+
+@receiver(post_delete, sender=Producto)
+def desindexar_producto(sender, instance, **kwargs):
+    producto_id = instance.pk
+    transaction.on_commit(lambda: get_backend().eliminar([producto_id]))
+
+
+@receiver(post_save, sender=Marca)
+def reindexar_productos_de_marca(sender, instance, raw=False, created=False, **kwargs):
+    """El nombre de la marca forma parte del texto indexado de sus productos"""
+    if raw or created:
+        return
+    marca = instance
+    transaction.on_commit(
+        lambda: get_backend().indexar(marca.productos.values_list('id', flat=True))
+    )
+    # Las facetas de una búsqueda dependen del texto indexado
+    transaction.on_commit(invalidar_facetas)
+
+
+@receiver(pre_delete, sender=Marca)
+def recordar_productos_de_marca(sender, instance, **kwargs):
+    # Al borrar la marca sus productos quedan con marca NULL, así que hay que
+    # guardar los ids antes para reindexarlos después
+    instance._productos_ids = list(instance.productos.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Marca)
+def reindexar_productos_sin_marca(sender, instance, **kwargs):
+    producto_ids = getattr(instance, '_productos_ids', [])
+    if producto_ids:
+        transaction.on_commit(lambda: get_backend().indexar(producto_ids))
+        # Sus productos pasan a no tener marca
+        transaction.on_commit(invalidar_facetas)
+
+
+TIPOS_AUTOCOMPLETADO = {Producto: 'producto', Marca: 'marca', Categoria: 'categoria'}
+
+
+@receiver(post_save, sender=Producto)
+@receiver(post_save, sender=Marca)
+@receiver(post_save, sender=Categoria)
+def autocompletado_agregar(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    tipo, pk, nombre = TIPOS_AUTOCOMPLETADO[sender], instance.pk, instance.nombre
+    transaction.on_commit(lambda: indice_autocompletado.agregar(tipo, pk, nombre))
+
+
+@receiver(post_delete, sender=Producto)
+@receiver(post_delete, sender=Marca)
+@receiver(post_delete, sender=Categoria)
+def autocompletado_quitar(sender, instance, **kwargs):
+    tipo, pk = TIPOS_AUTOCOMPLETADO[sender], instance.pk
+    transaction.on_commit(lambda: indice_autocompletado.quitar(tipo, pk))
+
+
+CAMPOS_ARCHIVO = {Producto: 'imagen', Marca: 'logo'}
+
+
+@receiver(post_init, sender=Producto)
+@receiver(post_init, sender=Marca)
+def recordar_archivo(sender, instance, **kwargs):
+    # Se lee del __dict__ para no disparar una consulta si el campo está diferido
+    valor = instance.__dict__.get(CAMPOS_ARCHIVO[sender])
+    instance._archivo_guardado = getattr(valor, 'name', valor) or None
+
+
+@receiver(post_save, sender=Producto)
+@receiver(post_save, sender=Marca)
+def liberar_archivo_reemplazado(sender, instance, raw=False, **kwargs):
+    """Al cambiar la imagen, el archivo anterior se borra si ya nadie lo usa"""
+    if raw:
+        return
+    actual = getattr(instance, CAMPOS_ARCHIVO[sender]).name or None
+    anterior = getattr(instance, '_archivo_guardado', None)
+    if anterior and anterior != actual:
+        liberar_al_confirmar([anterior])
+    instance._archivo_guardado = actual
+
+
+@receiver(post_delete, sender=Producto)
+@receiver(post_delete, sender=Marca)
+def liberar_archivo_borrado(sender, instance, **kwargs):
+    liberar_al_confirmar([getattr(instance, CAMPOS_ARCHIVO[sender]).name])
+
+
+@receiver(post_delete, sender=CarritoItem)
+def liberar_reserva_item(sender, instance, origin=None, **kwargs):
+    """Al sacar un item (o borrar el carrito) su reserva vuelve al stock libre"""
+    if getattr(origin, 'reservas_liberadas', False):
+        # Borrado por reservas.quitar_items, que ya liberó todo el lote
+        return
+    liberar_reserva(instance)
+
+
+@receiver(post_save, sender=CarritoItem)
+@receiver(post_delete, sender=CarritoItem)
+def versionar_carrito(sender, instance, raw=False, origin=None, **kwargs):
+    """Cualquier cambio de items invalida el ETag de /carrito/data/"""
+    if raw or getattr(origin, 'model', type(origin)) is Carrito:
+        # Se está borrando el carrito entero: no hay versión que actualizar
+        return
+    if getattr(origin, 'reservas_liberadas', False):
+        # quitar_items actualiza la versión una vez por lote
+        return
+    Carrito.objects.filter(pk=instance.carrito_id).tocar()
+    avisar_carrito(instance.carrito_id)
+
+
+@receiver(post_save, sender=ProductoStock)
+@receiver(post_delete, sender=ProductoStock)
+def publicar_stock(sender, instance, raw=False, **kwargs):
+    """Los cambios de stock desde el panel o el admin llegan a las páginas abiertas"""
+    if raw:
+        return
+    avisar_stock([instance.producto_id])
@@ -0,0 +1,64 @@
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.decorators.http import require_safe
+
+from .eventos import get_broker
+from .resumen_carrito import buscar_carrito
+
+# Comentario SSE cada tantos segundos para que proxies y balanceadores no
+# corten la conexión por inactividad
+INTERVALO_PING = 15
+MAX_PRODUCTOS = 50
+
+
+def _canales(request):
+    canales = set()
+    carrito = buscar_carrito(request)
+    if carrito is not None:
+        canales.add(f'carrito:{carrito.pk}')
+    for producto_id in request.GET.get('productos', '').split(',')[:MAX_PRODUCTOS]:
+        if producto_id.isdigit():
+            canales.add(f'stock:{producto_id}')
+    return canales
+
+
+@require_safe
+async def eventos(request):
+    """
+    Server-Sent Events con los cambios del carrito del visitante y del stock
+    de los productos pedidos en ?productos=1,2,3.
+
+    Pensado para ASGI: cada conexión es una corrutina esperando en una cola,
+    así que un worker sostiene miles de conexiones ociosas. Bajo WSGI cada
+    conexión ocuparía un hilo, así que se contesta 204 (EventSource no
+    reintenta) y el cliente sigue funcionando sin tiempo real.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    canales = await sync_to_async(_canales)(request)
+    if not canales:
+        return HttpResponse(status=204)
+
+    async def flujo():
+        # La suscripción se crea dentro del generador: si el cliente se va
+        # antes de empezar a leer, no queda nada registrado en el broker
+        suscripcion = get_broker().suscribir(canales)
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                mensaje = await suscripcion.recibir(INTERVALO_PING)
+                if mensaje is None:
+                    yield ': ping\n\n'
+                else:
+                    tipo, datos = mensaje
+                    yield f'event: {tipo}\ndata: {datos}\n\n'
+        finally:
+            # Al desconectarse el cliente Django cancela el generador
+            suscripcion.cerrar()
+
+    respuesta = StreamingHttpResponse(flujo(), content_type='text/event-stream')
+    respuesta['Cache-Control'] = 'no-cache'
+    # nginx: no bufferear la respuesta
+    respuesta['X-Accel-Buffering'] = 'no'
+    return respuesta
@@ -0,0 +1,48 @@
+from django.db.models import F, OuterRef, Subquery
+
+from .models import ProductoStock
+
+
+def resolver_stock(combinaciones):
+    """
+    Stock libre (stock - reservado) de un conjunto de combinaciones
+    (producto_id, color_id, talle_id) en una sola consulta. Las
+    combinaciones sin fila de stock valen 0.
+
+    Se filtra por producto y se descartan en Python las variantes que no se
+    pidieron: es una sola consulta con un IN chico en lugar de un OR por
+    combinación.
+    """
+    combinaciones = set(combinaciones)
+    stock = dict.fromkeys(combinaciones, 0)
+    if not combinaciones:
+        return stock
+    filas = ProductoStock.objects.filter(
+        producto_id__in={producto_id for producto_id, _, _ in combinaciones}
+    ).values_list('producto_id', 'color_id', 'talle_id', 'stock', 'reservado')
+    for producto_id, color_id, talle_id, cantidad, reservado in filas:
+        clave = (producto_id, color_id, talle_id)
+        if clave in stock:
+            stock[clave] = max(cantidad - reservado, 0)
+    return stock
+
+
+def adjuntar_stock(items):
+    """Asigna `stock_libre` a cada CarritoItem con una sola consulta"""
+    stock = resolver_stock((i.producto_id, i.color_id, i.talle_id) for i in items)
+    for item in items:
+        item.stock_libre = stock[(item.producto_id, item.color_id, item.talle_id)]
+    return items
+
+
+def anotar_stock(queryset):
+    """Anota `stock_libre` en un queryset de CarritoItem (subconsulta, sin N+1)"""
+    return queryset.annotate(
+        stock_libre=Subquery(
+            ProductoStock.objects.filter(
+                producto=OuterRef('producto'),
+                color=OuterRef('color'),
+                talle=OuterRef('talle'),
+            ).values(libre=F('stock') - F('reservado'))[:1]
+        )
+    )
@@ -0,0 +1,123 @@
+import logging
+import os
+import posixpath
+import time
+import uuid
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+
+from .images import hash_archivo
+
+logger = logging.getLogger(__name__)
+
+# Campos cuyos archivos se guardan por contenido y se cuentan entre sí:
+# el mismo archivo puede ser la imagen de varios productos y el logo de una marca
+CAMPOS_CONTENIDO = (
+    ('Producto', 'imagen'),
+    ('Marca', 'logo'),
+)
+# Todos esos campos guardan en el mismo directorio, sin importar su upload_to
+PREFIJO_CONTENIDO = 'blobs'
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Storage que nombra cada archivo por el SHA-256 de su contenido.
+
+    `productos/foto.JPG` se guarda como `blobs/ab/ab12…ef.jpg`: subir dos
+    veces la misma foto (para el mismo producto, para otro, o como logo de
+    una marca) deja un único archivo en disco. El directorio de `upload_to`
+    no forma parte del nombre, así que todos los CAMPOS_CONTENIDO comparten
+    los archivos. Los archivos no se borran al
+    reemplazarlos; de eso se ocupan `liberar_archivos` y `gc_media`.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # El nombre definitivo se decide en _save a partir del contenido
+        return name
+
+    def nombre_por_contenido(self, name, content):
+        extension = posixpath.splitext(name)[1].lower()
+        contenido_hash = hash_archivo(content)
+        return posixpath.join(PREFIJO_CONTENIDO, contenido_hash[:2], contenido_hash + extension)
+
+    def _save(self, name, content):
+        name = self.nombre_por_contenido(name, content)
+        if self.exists(name):
+            # Se actualiza la fecha para que liberar_archivos no lo borre
+            # mientras se guarda la fila que lo acaba de reutilizar
+            os.utime(self.path(name))
+            return name
+        # Se escribe con un nombre temporal y se renombra: si dos procesos
+        # suben el mismo contenido a la vez, el resultado es el mismo archivo
+        temporal = super()._save(f'{name}.{uuid.uuid4().hex[:8]}.tmp', content)
+        os.replace(self.path(temporal), self.path(name))
+        return name
+
+
+def get_storage_contenido():
+    return storage_contenido
+
+
+storage_contenido = ContentAddressedStorage()
+
+
+def contar_referencias(nombres):
+    """Cantidad de filas que apuntan a cada archivo, sumando todos los CAMPOS_CONTENIDO"""
+    from django.apps import apps
+    from django.db.models import Count
+
+    nombres = [n for n in set(nombres) if n]
+    referencias = dict.fromkeys(nombres, 0)
+    if not nombres:
+        return referencias
+    for modelo, campo in CAMPOS_CONTENIDO:
+        filas = (
+            apps.get_model('productos', modelo).objects
+            .filter(**{f'{campo}__in': nombres})
+            .values(campo)
+            .annotate(n=Count('pk'))
+            .values_list(campo, 'n')
+        )
+        for nombre, n in filas:
+            referencias[nombre] += n
+    return referencias
+
+
+def liberar_archivos(nombres, gracia=None):
+    """
+    Borra los archivos que ya no usa ninguna fila.
+
+    Los archivos tocados hace menos de MEDIA_GC_GRACIA segundos se dejan para
+    `gc_media`: pueden estar por ser referenciados por una subida en curso.
+    Devuelve los bytes liberados.
+    """
+    if gracia is None:
+        gracia = getattr(settings, 'MEDIA_GC_GRACIA', 600)
+    liberados = 0
+    limite = time.time() - gracia
+    for nombre, referencias in contar_referencias(nombres).items():
+        if referencias:
+            continue
+        try:
+            ruta = storage_contenido.path(nombre)
+            estado = os.stat(ruta)
+        except FileNotFoundError:
+            continue
+        if estado.st_mtime > limite:
+            continue
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            continue
+        liberados += estado.st_size
+        logger.info('Archivo sin referencias eliminado: %s', nombre)
+    return liberados
+
+
+def liberar_al_confirmar(nombres):
+    nombres = [n for n in nombres if n]
+    if nombres:
+        transaction.on_commit(lambda: liberar_archivos(nombres))
@@ -0,0 +1,180 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .images import (
+    FORMATOS, FORMATO_FALLBACK, VARIANTES, formatos_activos, generar_variantes, hash_archivo, huella_formato,
+)
+from .models import Producto
+
+logger = logging.getLogger(__name__)
+
+
+def reclamar(producto_ids, estados=('pendiente',)):
+    """
+    Marca como 'procesando' los productos dados que estén en `estados`, con
+    la hora del reclamo. El UPDATE condicional evita que dos workers tomen el
+    mismo. Devuelve los ids tomados.
+    """
+    reclamados = []
+    for producto_id in producto_ids:
+        tomado = Producto.objects.filter(id=producto_id, imagen_estado__in=estados).update(
+            imagen_estado='procesando', imagen_reclamada=timezone.now(),
+        )
+        if tomado:
+            reclamados.append(producto_id)
+    return reclamados
+
+
+def reclamar_pendientes(limite):
+    """Toma hasta `limite` productos con la imagen pendiente"""
+    candidatos = Producto.objects.filter(imagen_estado='pendiente').order_by('updated_at').values_list('id', flat=True)[:limite]
+    return reclamar(candidatos)
+
+
+def liberar_colgados(plazo=None):
+    """
+    Devuelve a la cola los trabajos reclamados hace más de `plazo` segundos
+    (IMAGENES_RECLAMO_SEGUNDOS): los dejó a medias un worker caído. Los
+    reclamos más nuevos pueden ser de un worker que sigue trabajando.
+    """
+    if plazo is None:
+        plazo = getattr(settings, 'IMAGENES_RECLAMO_SEGUNDOS', 600)
+    limite = timezone.now() - timedelta(seconds=plazo)
+    return Producto.objects.filter(imagen_estado='procesando').exclude(imagen_reclamada__gte=limite).update(
+        imagen_estado='pendiente', imagen_reclamada=None,
+    )
+
+
+def _reclamo(producto):
+    """Filtro de 'sigue siendo mío': el reclamo no venció ni lo tomó otro worker"""
+    return Producto.objects.filter(
+        id=producto.id, imagen_estado='procesando', imagen_reclamada=producto.imagen_reclamada,
+    )
+
+
+def nombre_derivado(imagen_hash, tamano, formato):
+    """
+    Nombre determinístico del derivado: mismo contenido y misma codificación,
+    mismo archivo. Con otra calidad o versión de Pillow el nombre cambia
+    """
+    ancho, alto = tamano
+    return f'productos/derivados/{imagen_hash[:32]}_{ancho}x{alto}_{huella_formato(formato)}.{FORMATOS[formato][2]}'
+
+
+def _rutas(producto):
+    rutas = {ruta for por_nombre in producto.imagen_variantes.values() for ruta in por_nombre.values()}
+    if producto.imagen_derivada:
+        rutas.add(producto.imagen_derivada.name)
+    return rutas
+
+
+def guardar_variantes(producto, imagen_hash, variantes):
+    """
+    Escribe las variantes (las que no existían) y deja el producto en estado
+    'lista'. `variantes` es lo que devuelve images.generar_variantes.
+    """
+    rutas = {}
+    for nombre, por_formato in variantes.items():
+        for formato, contenido in por_formato.items():
+            ruta = nombre_derivado(imagen_hash, VARIANTES[nombre], formato)
+            if not default_storage.exists(ruta):
+                ruta = default_storage.save(ruta, ContentFile(contenido))
+            rutas.setdefault(formato, {})[nombre] = ruta
+
+    # <img src> usa 'card' en el formato universal, o la variante más grande si el original era chico
+    fallback = rutas[FORMATO_FALLBACK]
+    principal = fallback.get('card') or fallback[max(fallback, key=lambda nombre: VARIANTES[nombre][0])]
+
+    anteriores = _rutas(producto)
+    # Si la imagen cambió mientras se procesaba el producto volvió a quedar
+    # 'pendiente', y si el reclamo venció lo pudo haber tomado otro worker:
+    # en los dos casos no se pisa el estado con estas variantes
+    actualizado = _reclamo(producto).update(
+        imagen_variantes=rutas, imagen_derivada=principal,
+        imagen_hash=imagen_hash, imagen_estado='lista', imagen_reclamada=None,
+        # Cambian las URLs de la imagen: invalida el ETag de los carritos que lo tienen
+        updated_at=timezone.now(),
+    )
+
+    if actualizado:
+        nuevas = {ruta for por_nombre in rutas.values() for ruta in por_nombre.values()}
+        for ruta in anteriores - nuevas:
+            # Los nombres llevan el hash del contenido: si otro producto tiene
+            # la misma imagen, comparte los archivos y no se borran
+            prefijo = ruta.rsplit('/', 1)[-1].split('_', 1)[0]
+            if not Producto.objects.filter(imagen_hash__startswith=prefijo).exclude(id=producto.id).exists():
+                default_storage.delete(ruta)
+    return actualizado
+
+
+def _leer_original(producto):
+    with producto.imagen.open('rb') as archivo:
+        contenido = archivo.read()
+        archivo.seek(0)
+        return contenido, producto.imagen_hash or hash_archivo(archivo)
+
+
+def procesar_lote(producto_ids, executor=None):
+    """
+    Genera las variantes de los productos dados, que tienen que haber sido
+    reclamados (`reclamar`).
+
+    El trabajo de Pillow se reparte en el executor (un ProcessPoolExecutor
+    en el worker); la lectura y escritura en storage y la base de datos
+    quedan en el proceso principal.
+    Devuelve (procesados, errores).
+    """
+    productos = Producto.objects.in_bulk(producto_ids)
+    formatos = formatos_activos()
+    trabajos = {}
+    errores = 0
+    for producto in productos.values():
+        try:
+            contenido, imagen_hash = _leer_original(producto)
+        except (OSError, ValueError) as e:
+            logger.error('No se pudo leer la imagen del producto %s: %s', producto.id, e)
+            _reclamo(producto).update(imagen_estado='error', imagen_reclamada=None)
+            errores += 1
+            continue
+        if executor is not None:
+            contenido = executor.submit(generar_variantes, contenido, formatos)
+        trabajos[producto.id] = (imagen_hash, contenido)
+
+    procesados = 0
+    for producto_id, (imagen_hash, trabajo) in trabajos.items():
+        try:
+            variantes = trabajo.result() if executor is not None else generar_variantes(trabajo, formatos)
+        except Exception as e:
+            logger.error('Error al redimensionar la imagen del producto %s: %s', producto_id, e)
+            _reclamo(productos[producto_id]).update(imagen_estado='error', imagen_reclamada=None)
+            errores += 1
+            continue
+        if guardar_variantes(productos[producto_id], imagen_hash, variantes):
+            procesados += 1
+    return procesados, errores
+
+
+def procesar_pendientes(workers=None, batch_size=20):
+    """Procesa toda la cola de imágenes pendientes. Devuelve (procesados, errores)"""
+    procesados = errores = 0
+    executor = None
+    try:
+        while True:
+            ids = reclamar_pendientes(batch_size)
+            if not ids:
+                break
+            if executor is None and workers != 0:
+                executor = ProcessPoolExecutor(max_workers=workers)
+            ok, fallidos = procesar_lote(ids, executor)
+            procesados += ok
+            errores += fallidos
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return procesados, errores
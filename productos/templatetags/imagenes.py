@@ -0,0 +1,49 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from productos.images import FORMATOS, FORMATO_FALLBACK, VARIANTES
+
+register = template.Library()
+
+
+@register.simple_tag
+def imagen_responsive(producto, variante='card', sizes=None, **atributos):
+    """
+    <picture> con un <source> por formato moderno y un <img> JPEG de fallback.
+
+    `variante` elige el tamaño del src por defecto y del ancho/alto
+    declarados; el navegador elige de `srcset` según `sizes`. Mientras las
+    variantes no están generadas, devuelve un <img> con la imagen original.
+
+    Uso: {% imagen_responsive producto 'card' sizes='(max-width: 600px) 50vw, 360px' class='img-producto' %}
+    """
+    if not producto.imagen:
+        return ''
+
+    ancho, alto = VARIANTES[variante]
+    atributos.setdefault('alt', producto.nombre)
+    atributos.setdefault('loading', 'lazy')
+    extra = format_html_join(' ', '{}="{}"', atributos.items())
+
+    if producto.imagen_estado != 'lista' or not producto.imagen_variantes:
+        return format_html('<img src="{}" {}>', producto.imagen_url, extra)
+
+    sizes = sizes or f'{ancho}px'
+    sources = format_html_join(
+        '', '<source type="{}" srcset="{}" sizes="{}">',
+        (
+            (FORMATOS[formato][1], producto.imagen_srcset(formato), sizes)
+            for formato in FORMATOS
+            if formato != FORMATO_FALLBACK and producto.imagen_variantes.get(formato)
+        ),
+    )
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" {}></picture>',
+        sources,
+        producto.imagen_variante_url(variante) or producto.imagen_url,
+        producto.imagen_srcset(FORMATO_FALLBACK),
+        sizes,
+        ancho,
+        alto,
+        extra,
+    )
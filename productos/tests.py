@@ -1,3 +1,1677 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.db import OperationalError, connection, transaction
+from django.db.models import F, Sum
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.template import Context as TemplateContext, Template
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, get_resolver, reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import eventos, fusion_carrito, media_views, perfilado
+from .autocomplete import PrefixIndex, indice as indice_autocompletado
+from .disk_cache import CacheDisco
+from .disponibilidad import aadjuntar_disponibilidad, adjuntar_disponibilidad, recalcular_disponibilidad
+from .eventos import BrokerLocal
+from .facets import acontar_facetas, contar_facetas, get_version
+from .fusion_carrito import fusionar_carritos
+from .images import FORMATOS, VARIANTES, formatos_activos, generar_variantes
+from .limpieza import purgar
+from .models import (
+    Carrito, CarritoItem, Categoria, Cliente, Color, ContadorVersion, Direccion, GrupoCliente, Marca,
+    Producto, ProductoDisponibilidad, ProductoStock, Talle,
+)
+from .pagination import CursorInvalido, KeysetPaginator, codificar_posicion, decodificar_cursor
+from .perfilado import requests_registrados, token_perfilado
+from .reservas import ConflictoReserva, StockInsuficiente, reservar, reservar_lote
+from .search import get_backend
+from .storage import contar_referencias, liberar_archivos, storage_contenido
+from .tasks import guardar_variantes, liberar_colgados, procesar_pendientes, reclamar, reclamar_pendientes
+
+
+class CarritoConsultasTest(TestCase):
+    """La cantidad de consultas del carrito no depende de la cantidad de items"""
+
+    TAMANOS = (1, 10, 100)
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre='Remeras')
+        cls.color = Color.objects.create(nombre='Negro', hex_code='#000000')
+        cls.talle = Talle.objects.create(nombre='Mediano', abbreviation='M')
+        cls.productos = Producto.objects.bulk_create(
+            Producto(nombre=f'Remera {i}', descripcion='Algodón', precio=Decimal('1000.00') + i, categoria=categoria)
+            for i in range(max(cls.TAMANOS))
+        )
+        ProductoStock.objects.bulk_create(
+            ProductoStock(producto=producto, color=cls.color, talle=cls.talle, stock=5)
+            for producto in cls.productos
+        )
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+
+    def _llenar_carrito(self, cantidad_items):
+        carrito = Carrito.objects.create(usuario=self.admin)
+        CarritoItem.objects.bulk_create(
+            CarritoItem(carrito=carrito, producto=producto, color=self.color, talle=self.talle, cantidad=2)
+            for producto in self.productos[:cantidad_items]
+        )
+        return carrito
+
+    def _contar_consultas(self, url):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(url)
+        self.assertEqual(respuesta.status_code, 200)
+        return len(consultas), respuesta
+
+    def test_cart_data_consultas_constantes(self):
+        self.client.force_login(self.admin)
+        conteos = {}
+        for cantidad_items in self.TAMANOS:
+            carrito = self._llenar_carrito(cantidad_items)
+            conteos[cantidad_items], respuesta = self._contar_consultas(reverse('cart_data'))
+            datos = respuesta.json()
+            self.assertEqual(len(datos['items']), cantidad_items)
+            self.assertEqual(datos['cantidad_total'], 2 * cantidad_items)
+            self.assertTrue(all(item['stock_disponible'] == 5 for item in datos['items']))
+            carrito.delete()
+        self.assertEqual(len(set(conteos.values())), 1, conteos)
+
+    def test_admin_items_consultas_constantes(self):
+        self.client.force_login(self.admin)
+        conteos = {}
+        for cantidad_items in self.TAMANOS:
+            carrito = self._llenar_carrito(cantidad_items)
+            conteos[cantidad_items], _ = self._contar_consultas(reverse('admin:productos_carritoitem_changelist'))
+            carrito.delete()
+        self.assertEqual(len(set(conteos.values())), 1, conteos)
+
+
+class ReservaStockConcurrenteTest(TransactionTestCase):
+    """Muchos compradores a la vez sobre la misma variante: nunca se reserva de más"""
+
+    STOCK = 10
+    COMPRADORES = 60
+
+    def setUp(self):
+        categoria = Categoria.objects.create(nombre='Ofertas')
+        self.color = Color.objects.create(nombre='Blanco', hex_code='#FFFFFF')
+        self.talle = Talle.objects.create(nombre='Grande', abbreviation='L')
+        self.producto = Producto.objects.create(nombre='Buzo', descripcion='Frisa', precio=Decimal('5000.00'), categoria=categoria)
+        self.stock = ProductoStock.objects.create(producto=self.producto, color=self.color, talle=self.talle, stock=self.STOCK)
+
+    def _en_paralelo(self, objetivo, argumentos):
+        barrera = threading.Barrier(len(argumentos))
+
+        def correr(*args):
+            barrera.wait()
+            try:
+                objetivo(*args)
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=correr, args=args) for args in argumentos]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+    def _verificar_consistencia(self):
+        self.stock.refresh_from_db()
+        items = CarritoItem.objects.aggregate(cantidad=Sum('cantidad'), reservado=Sum('reservado'))
+        self.assertLessEqual(self.stock.reservado, self.STOCK)
+        self.assertEqual(items['cantidad'] or 0, self.stock.reservado)
+        self.assertEqual(items['reservado'] or 0, self.stock.reservado)
+        self.assertFalse(CarritoItem.objects.filter(cantidad=0).exists())
+
+    def test_reservas_concurrentes(self):
+        items = []
+        for i in range(self.COMPRADORES):
+            carrito = Carrito.objects.create(session_key=f'sesion-{i}')
+            items.append(CarritoItem(carrito=carrito, producto=self.producto, color=self.color, talle=self.talle, cantidad=0))
+        CarritoItem.objects.bulk_create(items)
+        resultados = []
+
+        def reservar_uno(item):
+            # SQLite en memoria no espera los locks: se reintenta como lo haría
+            # el busy timeout de una base en disco
+            while True:
+                try:
+                    reservar(item, 1)
+                    resultados.append('ok')
+                    return
+                except StockInsuficiente:
+                    resultados.append('sin stock')
+                    return
+                except OperationalError:
+                    time.sleep(0.001)
+
+        self._en_paralelo(reservar_uno, [(item,) for item in items])
+
+        self.assertEqual(resultados.count('ok'), self.STOCK)
+        self.assertEqual(resultados.count('sin stock'), self.COMPRADORES - self.STOCK)
+        CarritoItem.objects.filter(cantidad=0).delete()
+        self._verificar_consistencia()
+        self.assertEqual(self.stock.reservado, self.STOCK)
+
+        # Borrar un carrito devuelve sus unidades al stock libre
+        Carrito.objects.filter(items__isnull=False).first().delete()
+        self._verificar_consistencia()
+        self.assertEqual(self.stock.reservado, self.STOCK - 1)
+
+    def test_agregar_al_carrito_concurrente(self):
+        payload = json.dumps({
+            'producto_id': self.producto.id, 'color_id': self.color.id,
+            'talle_id': self.talle.id, 'cantidad': 1,
+        })
+        resultados = []
+
+        def comprar():
+            client = Client()
+            for _ in range(3):
+                respuesta = client.post(reverse('agregar_al_carrito'), payload, content_type='application/json')
+                resultados.append(respuesta.status_code)
+
+        self._en_paralelo(comprar, [()] * self.COMPRADORES)
+
+        # Bajo contención SQLite puede rechazar requests con "table is locked";
+        # lo que importa es que nunca haya más unidades en carritos que stock
+        self.assertGreater(resultados.count(200), 0)
+        self._verificar_consistencia()
+
+    def test_guardar_instancia_vieja_no_pisa_reservado(self):
+        vieja = ProductoStock.objects.get(pk=self.stock.pk)
+        carrito = Carrito.objects.create(session_key='sesion')
+        item = CarritoItem.objects.create(carrito=carrito, producto=self.producto, color=self.color, talle=self.talle, cantidad=0)
+        reservar(item, 3)
+
+        # Como el admin guardando un formulario abierto antes de la reserva
+        vieja.stock = 20
+        vieja.save()
+        vieja.save(update_fields=['stock', 'reservado'])
+        self.stock.refresh_from_db()
+        self.assertEqual((self.stock.stock, self.stock.reservado), (20, 3))
+        self._verificar_consistencia()
+
+
+@override_settings(PRESUPUESTO_CONSULTAS_ACCION='error')
+class PresupuestoConsultasTest(TestCase):
+    """
+    Cada ruta de ecommerce/urls.py (y cada página del admin) se pide contra
+    un catálogo grande con PRESUPUESTO_CONSULTAS_ACCION = 'error': una
+    consulta por fila (N+1) rompe el presupuesto de su URL y falla el test.
+    """
+
+    PRODUCTOS = 300
+    CATEGORIAS = 40
+    MARCAS = 40
+    CLIENTES = 60
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.grupos = GrupoCliente.objects.bulk_create(GrupoCliente(nombre=f'Grupo {i}') for i in range(5))
+        cls.categorias = Categoria.objects.bulk_create(Categoria(nombre=f'Categoría {i}') for i in range(cls.CATEGORIAS))
+        cls.marcas = Marca.objects.bulk_create(Marca(nombre=f'Marca {i}') for i in range(cls.MARCAS))
+        cls.colores = Color.objects.bulk_create(
+            Color(nombre=f'Color {i}', hex_code=f'#{i:02x}{i:02x}{i:02x}', order=i) for i in range(12)
+        )
+        cls.talles = Talle.objects.bulk_create(
+            Talle(nombre=f'Talle {i}', abbreviation=f'T{i}', order=i) for i in range(6)
+        )
+        cls.productos = Producto.objects.bulk_create(
+            Producto(
+                nombre=f'Remera {i}', descripcion='Algodón peinado', precio=Decimal('1000.00') + i,
+                categoria=cls.categorias[i % cls.CATEGORIAS], marca=cls.marcas[i % cls.MARCAS],
+                talle=cls.talles[i % len(cls.talles)],
+            )
+            for i in range(cls.PRODUCTOS)
+        )
+        Producto.colores.through.objects.bulk_create(
+            Producto.colores.through(producto_id=producto.id, color_id=color.id)
+            for i, producto in enumerate(cls.productos)
+            for color in cls.colores[i % 4:i % 4 + 4]
+        )
+        ProductoStock.objects.bulk_create(
+            ProductoStock(producto=producto, color=color, talle=talle, stock=(i % 7) * 3)
+            for i, producto in enumerate(cls.productos)
+            for color in cls.colores[i % 4:i % 4 + 2]
+            for talle in cls.talles[:3]
+        )
+        recalcular_disponibilidad([p.id for p in cls.productos])
+        get_backend().indexar([p.id for p in cls.productos])
+
+        cls.clientes = Cliente.objects.bulk_create(
+            Cliente(nombre=f'Cliente {i}', apellidos='Pérez', email=f'cliente{i}@example.com',
+                    grupo=cls.grupos[i % len(cls.grupos)])
+            for i in range(cls.CLIENTES)
+        )
+        cls.direcciones = Direccion.objects.bulk_create(
+            Direccion(cliente=cliente, nombre=cliente.nombre, apellidos='Pérez', direccion='Calle 123',
+                      codigo_postal='1000', ciudad='Buenos Aires', pais='AR')
+            for cliente in cls.clientes
+            for _ in range(2)
+        )
+
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+        Cliente.objects.create(nombre='Admin', apellidos='Admin', email='admin@example.com')
+        carritos = Carrito.objects.bulk_create(
+            Carrito(usuario=cls.admin if i == 0 else None, session_key=None if i == 0 else f'sesion-{i}')
+            for i in range(30)
+        )
+        CarritoItem.objects.bulk_create(
+            CarritoItem(carrito=carrito, producto=producto, color=cls.colores[j % 4], talle=cls.talles[0], cantidad=1)
+            for i, carrito in enumerate(carritos)
+            for j, producto in enumerate(cls.productos[i:i + 20])
+        )
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        self.item = CarritoItem.objects.filter(carrito__usuario=self.admin).first()
+
+    def _argumentos(self):
+        """Argumentos y método de cada ruta con nombre; las demás son GET sin argumentos"""
+        objetos = {
+            'producto': self.productos[0], 'categoria': self.categorias[0], 'color': self.colores[0],
+            'marca': self.marcas[0], 'talle': self.talles[0], 'cliente': self.clientes[0],
+            'direccion': self.direcciones[0],
+        }
+        argumentos = {
+            'producto_detail': ({'producto_id': self.productos[0].id}, 'get', None),
+            'imagen_redimensionada': ({'ancho': 360, 'alto': 450, 'ruta': 'productos/no-existe.jpg'}, 'get', None),
+            'agregar_al_carrito': ({}, 'post', {
+                'producto_id': self.productos[0].id, 'color_id': self.colores[0].id,
+                'talle_id': self.talles[0].id, 'cantidad': 1,
+            }),
+            'actualizar_cantidad': ({}, 'post', {'item_id': self.item.id, 'cantidad': 2}),
+            'eliminar_item_del_carrito': ({}, 'post', {'item_id': self.item.id}),
+            'vaciar_carrito': ({}, 'post', {}),
+            'carrito_batch': ({}, 'post', {'operaciones': [
+                {'op': 'actualizar', 'item_id': self.item.id, 'cantidad': 1},
+            ]}),
+            'perfil_descargar': ({'archivo': 'no-existe.folded'}, 'get', None),
+        }
+        for nombre, objeto in objetos.items():
+            for accion in ('editar', 'eliminar'):
+                argumentos[f'{accion}_{nombre}'] = ({'pk': objeto.pk}, 'get', None)
+        return argumentos
+
+    # Las páginas de confirmación del panel renderizan plantillas que no
+    # existen en templates/custom_admin/: fallan antes de llegar a consultar
+    SIN_PLANTILLA = {
+        'eliminar_producto', 'eliminar_categoria', 'eliminar_color', 'eliminar_marca',
+        'eliminar_talle', 'eliminar_cliente', 'eliminar_direccion',
+    }
+
+    def _pedir(self, url, metodo='get', datos=None):
+        if metodo == 'post':
+            respuesta = self.client.post(url, json.dumps(datos), content_type='application/json')
+        else:
+            respuesta = self.client.get(url)
+        self.assertLess(respuesta.status_code, 500, url)
+        return respuesta
+
+    def test_rutas(self):
+        argumentos = self._argumentos()
+        rutas = [
+            patron for patron in get_resolver().url_patterns
+            if isinstance(patron, URLPattern) and patron.name and patron.name not in self.SIN_PLANTILLA
+        ]
+        # Las de sesión al final: cierran la sesión del admin
+        rutas.sort(key=lambda patron: patron.name in ('logout', 'logout_cliente'))
+        for patron in rutas:
+            kwargs, metodo, datos = argumentos.get(patron.name, ({}, 'get', None))
+            with self.subTest(ruta=patron.name):
+                self.client.force_login(self.admin)
+                self._pedir(reverse(patron.name, kwargs=kwargs), metodo, datos)
+
+    def test_listados_con_busqueda_y_filtros(self):
+        for params in ('?q=remera', f'?categoria={self.categorias[1].id}&color={self.colores[2].id}',
+                       f'?marca={self.marcas[3].id}&talle={self.talles[1].id}'):
+            with self.subTest(params=params):
+                self._pedir(reverse('productos') + params)
+
+    def _variante(self, i, color=0, cantidad=1):
+        """Datos para agregar el producto i en un color con stock y el primer talle"""
+        return {
+            'producto_id': self.productos[i].id, 'color_id': self.colores[i % 4 + color].id,
+            'talle_id': self.talles[0].id, 'cantidad': cantidad,
+        }
+
+    def test_carrito_anonimo(self):
+        # El primer agregado crea la sesión y el carrito. Los productos
+        # múltiplos de 7 no tienen stock
+        self.client.logout()
+        for i in (1, 2, 2):
+            with self.subTest(producto=i):
+                respuesta = self._pedir(reverse('agregar_al_carrito'), 'post', self._variante(i))
+                self.assertEqual(respuesta.status_code, 200)
+        items = list(CarritoItem.objects.filter(carrito__session_key=self.client.session.session_key))
+        respuesta = self._pedir(reverse('carrito_batch'), 'post', {'operaciones': [
+            {'op': 'actualizar', 'item_id': items[0].id, 'cantidad': 2},
+            {'op': 'eliminar', 'item_id': items[1].id},
+            *({'op': 'agregar', **self._variante(i)} for i in range(3, 15) if i % 7),
+        ]})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(len(respuesta.json()['items']), 11)
+
+    def test_primer_lote_anonimo(self):
+        self.client.logout()
+        respuesta = self._pedir(reverse('carrito_batch'), 'post', {'operaciones': [
+            {'op': 'agregar', **self._variante(i)} for i in range(1, 15) if i % 7
+        ]})
+        self.assertEqual(respuesta.status_code, 200)
+
+    def test_login_con_carrito_invitado(self):
+        # Una variante ya está en el carrito del admin y la otra es nueva: se fusionan
+        self.client.logout()
+        for datos in (self._variante(1), self._variante(30)):
+            self._pedir(reverse('agregar_al_carrito'), 'post', datos)
+        respuesta = self.client.post(reverse('login_cliente'), {'username': 'admin', 'password': 'clave'})
+        self.assertEqual(respuesta.status_code, 302)
+        self.assertEqual(Carrito.objects.get(usuario=self.admin).items.count(), 21)
+
+        # Sin carrito propio, el usuario adopta el del invitado
+        self.client.logout()
+        Carrito.objects.filter(usuario=self.admin).delete()
+        self._pedir(reverse('agregar_al_carrito'), 'post', self._variante(1))
+        respuesta = self.client.post(reverse('login_cliente'), {'username': 'admin', 'password': 'clave'})
+        self.assertEqual(respuesta.status_code, 302)
+        self.assertEqual(Carrito.objects.get(usuario=self.admin).items.count(), 1)
+
+    def test_admin(self):
+        for modelo, modelo_admin in admin.site._registry.items():
+            opts = modelo._meta
+            objeto = modelo._default_manager.first()
+            urls = [
+                reverse(f'admin:{opts.app_label}_{opts.model_name}_changelist'),
+                reverse(f'admin:{opts.app_label}_{opts.model_name}_add'),
+            ]
+            if objeto is not None:
+                urls.append(reverse(f'admin:{opts.app_label}_{opts.model_name}_change', args=[objeto.pk]))
+            for url in urls:
+                with self.subTest(url=url):
+                    self._pedir(url)
+
+
+class PerfiladoTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'x')
+        categoria = Categoria.objects.create(nombre='Remeras')
+        Producto.objects.bulk_create(
+            Producto(nombre=f'Remera {i}', precio=Decimal(1000), categoria=categoria) for i in range(5)
+        )
+
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.directorio = Path(directorio.name)
+        ajustes = override_settings(PERFILADO_DIR=self.directorio, PERFILADO_INTERVALO=0.0005)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+    def test_header_firmado(self):
+        respuesta = self.client.get(reverse('productos'), HTTP_X_PERFILAR=token_perfilado())
+        registro, = requests_registrados()
+        self.assertEqual(respuesta['X-Perfil'], registro['id'])
+        self.assertEqual(registro['vista'], 'productos')
+        self.assertGreater(registro['consultas'], 0)
+        self.assertGreater(registro['plantilla_ms'], 0)
+        self.assertAlmostEqual(
+            registro['sql_ms'] + registro['plantilla_ms'] + registro['vista_ms'], registro['total_ms'], delta=0.5
+        )
+        if registro['archivo']:
+            for linea in (self.directorio / registro['archivo']).read_text().splitlines():
+                pila, muestras = linea.rsplit(' ', 1)
+                self.assertTrue(pila.startswith('productos.perfilado:PerfiladoMiddleware.__call__'))
+                self.assertGreater(int(muestras), 0)
+
+    def test_sin_token_valido_no_perfila(self):
+        for headers in ({}, {'HTTP_X_PERFILAR': 'perfilar:falso'}):
+            respuesta = self.client.get(reverse('productos'), **headers)
+            self.assertNotIn('X-Perfil', respuesta)
+        self.assertEqual(requests_registrados(), [])
+
+    @override_settings(PERFILADO_FRACCION=1.0)
+    def test_muestreo_y_panel(self):
+        self.client.get(reverse('productos'))
+        registro, = requests_registrados()
+        self.assertEqual(registro['motivo'], 'muestra')
+
+        self.client.force_login(self.admin)
+        with override_settings(PERFILADO_FRACCION=0.0):
+            respuesta = self.client.get(reverse('perfiles'))
+            self.assertContains(respuesta, registro['ruta'])
+            if registro['archivo']:
+                descarga = self.client.get(reverse('perfil_descargar', args=[registro['archivo']]))
+                self.assertEqual(descarga.status_code, 200)
+                descarga.close()
+            self.assertEqual(self.client.get(reverse('perfil_descargar', args=['..%2Fdb.sqlite3'])).status_code, 404)
+
+    @override_settings(PERFILADO_LENTO_MS=0)
+    def test_registra_lentos_sin_perfilar(self):
+        self.client.get(reverse('productos'))
+        registro, = requests_registrados()
+        self.assertFalse(registro['perfilado'])
+        self.assertNotIn('sql_ms', registro)
+
+    def test_rotacion_concurrente(self):
+        def escribir(nombre, archivo):
+            (self.directorio / archivo).write_text('pila 1\n')
+            with open(self.directorio / nombre, 'a') as registro:
+                registro.write(json.dumps({'archivo': archivo, 'total_ms': 1}) + '\n')
+
+        escribir('requests.jsonl.1', 'aaaaaaaaaaaa.folded')
+        escribir('requests.jsonl', 'bbbbbbbbbbbb.folded')
+        # Dos workers que pasaron el límite a la vez: el segundo no vuelve a rotar
+        perfilado._rotar(self.directorio, maximo=10)
+        perfilado._rotar(self.directorio, maximo=10)
+        self.assertFalse((self.directorio / 'aaaaaaaaaaaa.folded').exists())
+        self.assertTrue((self.directorio / 'bbbbbbbbbbbb.folded').exists())
+        self.assertEqual([r['archivo'] for r in requests_registrados()], ['bbbbbbbbbbbb.folded'])
+
+    def test_panel_sin_staff(self):
+        self.client.force_login(User.objects.create_user('cliente', password='x'))
+        for url in (reverse('perfiles'), reverse('perfil_descargar', args=['aaaaaaaaaaaa.folded'])):
+            self.assertRedirects(self.client.get(url), reverse('inicio'), fetch_redirect_response=False)
+
+
+class PaginacionCatalogoTest(TestCase):
+    """Paginación por cursor del catálogo (KeysetPaginator)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre='Remeras')
+        Producto.objects.bulk_create(
+            Producto(nombre=f'Remera {i}', precio=Decimal('1000.00'), categoria=categoria) for i in range(25)
+        )
+        # Empates de created_at: el id desempata
+        Producto.objects.filter(nombre__in=['Remera 10', 'Remera 11', 'Remera 12']).update(
+            created_at=Producto.objects.get(nombre='Remera 10').created_at
+        )
+        cls.orden = list(Producto.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def _recorrer(self, page_size):
+        paginator = KeysetPaginator(Producto.objects.all(), page_size)
+        paginas = [paginator.get_page()]
+        while paginas[-1].has_next:
+            paginas.append(paginator.get_page(paginas[-1].next_cursor))
+        return paginator, paginas
+
+    def test_recorre_todo_sin_repetir(self):
+        for page_size in (1, 7, 25, 30):
+            with self.subTest(page_size=page_size):
+                _, paginas = self._recorrer(page_size)
+                self.assertEqual([p.id for pagina in paginas for p in pagina], self.orden)
+                self.assertFalse(paginas[0].has_previous)
+                self.assertTrue(all(len(pagina) == page_size for pagina in paginas[:-1]))
+
+    def test_cursor_anterior_vuelve_a_la_misma_pagina(self):
+        paginator, paginas = self._recorrer(7)
+        for anterior, pagina in zip(paginas, paginas[1:]):
+            volver = paginator.get_page(pagina.prev_cursor)
+            self.assertEqual([p.id for p in volver], [p.id for p in anterior])
+            self.assertEqual(volver.has_previous, anterior.has_previous)
+            self.assertTrue(volver.has_next)
+
+    def test_page_size_acotado(self):
+        self.assertEqual(KeysetPaginator.normalizar_page_size('abc'), settings.CATALOGO_PAGE_SIZE)
+        self.assertEqual(KeysetPaginator.normalizar_page_size('0'), 1)
+        self.assertEqual(KeysetPaginator.normalizar_page_size('100000'), settings.CATALOGO_PAGE_SIZE_MAX)
+
+    def test_cursor_invalido(self):
+        for cursor in ('basura', codificar_posicion(3)):
+            with self.subTest(cursor=cursor), self.assertRaises(CursorInvalido):
+                decodificar_cursor(cursor)
+        # La vista ignora el cursor inválido y muestra la primera página
+        respuesta = self.client.get(reverse('productos'), {'cursor': 'basura', 'page_size': 5})
+        self.assertEqual([p.id for p in respuesta.context['page']], self.orden[:5])
+
+    def test_links_de_la_vista(self):
+        respuesta = self.client.get(reverse('productos'), {'page_size': 10})
+        page = respuesta.context['page']
+        self.assertContains(respuesta, f'cursor={page.next_cursor}')
+        siguiente = self.client.get(reverse('productos'), {'page_size': 10, 'cursor': page.next_cursor})
+        self.assertEqual([p.id for p in siguiente.context['page']], self.orden[10:20])
+
+
+class DisponibilidadTest(TestCase):
+    """Índice de colores y talles con stock (ProductoDisponibilidad)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categoria = Categoria.objects.create(nombre='Remeras')
+        cls.negro = Color.objects.create(nombre='Negro', hex_code='#000000', order=1)
+        cls.blanco = Color.objects.create(nombre='Blanco', hex_code='#FFFFFF', order=2)
+        cls.s = Talle.objects.create(nombre='Chico', abbreviation='S', order=1)
+        cls.m = Talle.objects.create(nombre='Mediano', abbreviation='M', order=2)
+
+    def _producto(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            producto = Producto.objects.create(nombre='Remera', precio=Decimal('1000.00'), categoria=self.categoria)
+            producto.colores.set([self.negro, self.blanco])
+        return producto
+
+    def test_se_mantiene_con_el_stock(self):
+        producto = self._producto()
+        self.assertEqual(ProductoDisponibilidad.objects.get(producto=producto).colores, [])
+        with self.captureOnCommitCallbacks(execute=True):
+            stock = ProductoStock.objects.create(producto=producto, color=self.negro, talle=self.m, stock=3)
+            ProductoStock.objects.create(producto=producto, color=self.blanco, talle=self.s, stock=0)
+        fila = ProductoDisponibilidad.objects.get(producto=producto)
+        self.assertEqual((fila.colores, fila.talles), ([self.negro.id], [self.m.id]))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.delete()
+        fila.refresh_from_db()
+        self.assertEqual((fila.colores, fila.talles), ([], []))
+
+    def test_con_stock_y_disponibles(self):
+        producto = self._producto()
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductoStock.objects.create(producto=producto, color=self.negro, talle=self.m, stock=3)
+            ProductoStock.objects.create(producto=producto, color=self.blanco, talle=self.s, stock=0)
+        producto = Producto.objects.select_related('disponibilidad').get(pk=producto.pk)
+        with self.assertNumQueries(2):  # Color y Talle; la fila vino con select_related
+            self.assertEqual(producto.get_colores_con_stock(), [self.negro])
+            self.assertEqual(producto.get_talles_con_stock(), [self.m])
+        # Los métodos de siempre siguen devolviendo todos los colores y talles cargados
+        self.assertEqual(set(producto.get_colores_disponibles()), {self.negro, self.blanco})
+        self.assertEqual(set(producto.get_talles_disponibles()), {self.s, self.m})
+
+    def test_lectura_sin_fila_no_escribe(self):
+        producto = self._producto()
+        ProductoStock.objects.bulk_create([ProductoStock(producto=producto, color=self.blanco, talle=self.s, stock=2)])
+        ProductoDisponibilidad.objects.filter(producto=producto).delete()
+        with CaptureQueriesContext(connection) as consultas:
+            adjuntar_disponibilidad([producto])
+        self.assertEqual(producto.get_colores_con_stock(), [self.blanco])
+        self.assertTrue(all(c['sql'].startswith('SELECT') for c in consultas), consultas.captured_queries)
+        self.assertFalse(ProductoDisponibilidad.objects.filter(producto=producto).exists())
+
+        call_command('recalcular_disponibilidad', stdout=StringIO())
+        self.assertEqual(ProductoDisponibilidad.objects.get(producto=producto).colores, [self.blanco.id])
+
+    def test_catalogo_sin_consultas_por_producto(self):
+        for _ in range(2):
+            self._producto()
+        with CaptureQueriesContext(connection) as pocos:
+            self.client.get(reverse('productos'))
+        for _ in range(10):
+            self._producto()
+        with CaptureQueriesContext(connection) as muchos:
+            self.client.get(reverse('productos'))
+        self.assertEqual(len(pocos), len(muchos))
+
+
+class FacetasTest(TestCase):
+    """Conteos por faceta en una sola consulta, cacheados por versión compartida"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.remeras = Categoria.objects.create(nombre='Remeras')
+        cls.buzos = Categoria.objects.create(nombre='Buzos')
+        cls.marca = Marca.objects.create(nombre='Marca')
+        cls.negro = Color.objects.create(nombre='Negro', hex_code='#000000')
+        cls.blanco = Color.objects.create(nombre='Blanco', hex_code='#FFFFFF')
+        cls.m = Talle.objects.create(nombre='Mediano', abbreviation='M')
+        cls.productos = []
+        for i, (categoria, color) in enumerate([
+            (cls.remeras, cls.negro), (cls.remeras, cls.blanco), (cls.buzos, cls.negro),
+        ]):
+            producto = Producto.objects.create(nombre=f'Prenda {i}', precio=Decimal('1000.00'),
+                                               categoria=categoria, marca=cls.marca if i else None)
+            producto.colores.add(color)
+            ProductoStock.objects.create(producto=producto, color=color, talle=cls.m, stock=1)
+            cls.productos.append(producto)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_conteos_excluyen_la_propia_faceta(self):
+        with self.assertNumQueries(2):  # versión + UNION ALL de las cuatro facetas
+            conteos = contar_facetas({'categoria': str(self.remeras.id)})
+        # La faceta de categoría ignora el filtro de categoría; las demás lo aplican
+        self.assertEqual(conteos['categoria'], {self.remeras.id: 2, self.buzos.id: 1})
+        self.assertEqual(conteos['color'], {self.negro.id: 1, self.blanco.id: 1})
+        self.assertEqual(conteos['talle'], {self.m.id: 2})
+        self.assertEqual(conteos['marca'], {self.marca.id: 1})
+        with self.assertNumQueries(1):  # sólo la versión
+            self.assertEqual(contar_facetas({'categoria': str(self.remeras.id)}), conteos)
+
+    def test_invalidacion_compartida(self):
+        contar_facetas({})
+        # Otro worker invalida: el contador de la base cambia aunque esta
+        # cache local no se entere
+        ContadorVersion.objects.update_or_create(clave='facetas:version', defaults={'valor': 99})
+        with self.assertNumQueries(2):
+            contar_facetas({})
+
+    def test_que_invalida(self):
+        def version_tras(cambio):
+            antes = get_version()
+            with self.captureOnCommitCallbacks(execute=True):
+                cambio()
+            return get_version() != antes
+
+        stock = ProductoStock.objects.get(producto=self.productos[0])
+
+        def cambiar_cantidad():
+            stock.stock = 0
+            stock.save()
+
+        def cambiar_talle():
+            stock.talle = Talle.objects.create(nombre='Grande', abbreviation='L')
+            stock.save()
+
+        self.assertFalse(version_tras(cambiar_cantidad))
+        self.assertFalse(version_tras(lambda: reservar(
+            CarritoItem.objects.create(carrito=Carrito.objects.create(session_key='s'), producto=self.productos[1],
+                                       color=self.blanco, talle=self.m, cantidad=0), 1)))
+        self.assertTrue(version_tras(cambiar_talle))
+        self.assertTrue(version_tras(lambda: ProductoStock.objects.create(
+            producto=self.productos[0], color=self.blanco, talle=self.m)))
+        self.assertTrue(version_tras(lambda: self.productos[2].colores.add(self.blanco)))
+        self.assertTrue(version_tras(stock.delete))
+
+        def renombrar_marca():
+            self.marca.nombre = 'Andina'
+            self.marca.save()
+
+        self.assertTrue(version_tras(renombrar_marca))
+        self.assertTrue(version_tras(self.marca.delete))
+
+    def test_renombrar_marca_actualiza_busqueda(self):
+        get_backend().indexar([p.id for p in self.productos])
+        self.assertEqual(contar_facetas({'q': 'andina'})['categoria'], {})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.marca.nombre = 'Andina'
+            self.marca.save()
+        self.assertEqual(contar_facetas({'q': 'andina'})['categoria'], {self.remeras.id: 1, self.buzos.id: 1})
+
+
+class BusquedaTest(TestCase):
+    """Búsqueda FTS5: índice, ranking y coherencia con las facetas"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categoria = Categoria.objects.create(nombre='Pantalones')
+        cls.marca = Marca.objects.create(nombre='Andina')
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.en_nombre = Producto.objects.create(nombre='Pantalón cargo', descripcion='Gabardina',
+                                                    precio=Decimal('1000.00'), categoria=cls.categoria)
+            cls.en_descripcion = Producto.objects.create(nombre='Bermuda', descripcion='Corte pantalón recto',
+                                                         precio=Decimal('1000.00'), categoria=cls.categoria)
+            cls.de_marca = Producto.objects.create(nombre='Campera', precio=Decimal('1000.00'),
+                                                   categoria=cls.categoria, marca=cls.marca)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_acentos_prefijos_y_pesos(self):
+        backend = get_backend()
+        self.assertEqual(backend.buscar('pantalon'), [self.en_nombre.id, self.en_descripcion.id])
+        self.assertEqual(backend.buscar('PANTAL'), [self.en_nombre.id, self.en_descripcion.id])
+        self.assertEqual(backend.buscar('andina'), [self.de_marca.id])
+        self.assertEqual(backend.buscar('"; DROP'), [])
+        self.assertEqual(backend.buscar('!!!'), [])
+
+    def test_indice_se_mantiene(self):
+        backend = get_backend()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.marca.nombre = 'Patagonia'
+            self.marca.save()
+        self.assertEqual(backend.buscar('patagonia'), [self.de_marca.id])
+        self.assertEqual(backend.buscar('andina'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.en_nombre.delete()
+        self.assertEqual(backend.buscar('pantalon'), [self.en_descripcion.id])
+
+    @override_settings(BUSQUEDA_VENTANA_CANDIDATOS=2, BUSQUEDA_MAX_RESULTADOS=1)
+    def test_facetas_cuentan_lo_que_se_lista(self):
+        ids = get_backend().buscar('pantalon')
+        self.assertEqual(len(ids), 1)
+        conteos = contar_facetas({'q': 'pantalon'})
+        self.assertEqual(conteos['categoria'], {self.categoria.id: len(ids)})
+        respuesta = self.client.get(reverse('productos'), {'q': 'pantalon'})
+        self.assertEqual([p.id for p in respuesta.context['page']], ids)
+
+    @override_settings(BUSQUEDA_MAX_RESULTADOS=1)
+    def test_admin_busca_todo(self):
+        encontrados = get_backend().filtrar(Producto.objects.all(), 'pantalon', todos=True)
+        self.assertEqual(set(encontrados), {self.en_nombre, self.en_descripcion})
+
+
+class AutocompletadoTest(TestCase):
+    """Índice de prefijos del autocompletado"""
+
+    def test_busqueda_por_prefijo(self):
+        indice = PrefixIndex()
+        indice.agregar('producto', 1, 'Pantalón cargo verde')
+        indice.agregar('producto', 2, 'Campera verde')
+        indice.agregar('categoria', 3, 'Pantalones')
+        indice.agregar('marca', 4, 'Verdulería')
+        self.assertEqual([r['id'] for r in indice.buscar('pant')], [3, 1])  # categorías primero
+        self.assertEqual([r['id'] for r in indice.buscar('VERD')], [4, 2, 1])
+        self.assertEqual([r['id'] for r in indice.buscar('cargo verd')], [1])
+        indice.quitar('producto', 1)
+        self.assertEqual([r['id'] for r in indice.buscar('pant')], [3])
+        self.assertEqual(indice.buscar('   '), [])
+
+    def test_senales_y_endpoint(self):
+        categoria = Categoria.objects.create(nombre='Abrigos')
+        indice_autocompletado.construir()
+        with self.captureOnCommitCallbacks(execute=True):
+            producto = Producto.objects.create(nombre='Zapatilla urbana', precio=Decimal('1000.00'), categoria=categoria)
+        with self.assertNumQueries(0):
+            datos = self.client.get(reverse('autocomplete'), {'q': 'zapat'}).json()
+        self.assertEqual(datos['resultados'][0]['url'], reverse('producto_detail', args=[producto.id]))
+        with self.captureOnCommitCallbacks(execute=True):
+            producto.delete()
+        self.assertEqual(self.client.get(reverse('autocomplete'), {'q': 'zapat'}).json()['resultados'], [])
+
+    @override_settings(AUTOCOMPLETE_TTL=0)
+    def test_reconstruccion_en_segundo_plano(self):
+        indice = PrefixIndex()
+        indice.agregar('producto', 1, 'Remera vieja')
+        indice.construido = time.monotonic() - 1
+        empezo, seguir = threading.Event(), threading.Event()
+        lecturas = []
+
+        def leer():
+            lecturas.append(1)
+            empezo.set()
+            seguir.wait(5)
+            return [('remera', 'producto', 2)], {('producto', 2): ('Remera nueva', 'remera nueva', ['remera'])}
+
+        indice._leer = leer
+        indice.refrescar()
+        self.assertTrue(empezo.wait(5))
+        # Mientras reconstruye, los requests usan el índice viejo y no lanzan otra reconstrucción
+        for _ in range(5):
+            indice.refrescar()
+            self.assertEqual([r['id'] for r in indice.buscar('rem')], [1])
+        indice.agregar('producto', 3, 'Remera agregada durante la reconstrucción')
+        seguir.set()
+        while indice._reconstruyendo.locked():
+            time.sleep(0.001)
+        self.assertEqual(len(lecturas), 1)
+        # Lo agregado durante la reconstrucción no se pierde
+        self.assertEqual(sorted(r['id'] for r in indice.buscar('rem')), [2, 3])
+
+
+def _imagen(tamano=(800, 1000), formato='JPEG', color=(200, 30, 30)):
+    salida = BytesIO()
+    Image.new('RGB', tamano, color).save(salida, format=formato)
+    return salida.getvalue()
+
+
+class MediaTemporalMixin:
+    """MEDIA_ROOT en un directorio temporal que se borra al terminar el test"""
+
+    def setUp(self):
+        super().setUp()
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.media = Path(directorio.name)
+        ajustes = override_settings(MEDIA_ROOT=self.media, IMAGENES_CACHE_DIR=self.media / 'cache')
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+    def _producto(self, contenido=None, nombre='Remera'):
+        categoria = Categoria.objects.get_or_create(nombre='Remeras')[0]
+        return Producto.objects.create(
+            nombre=nombre, precio=Decimal('1000.00'), categoria=categoria,
+            imagen=SimpleUploadedFile('foto.jpg', contenido or _imagen(), 'image/jpeg'),
+        )
+
+
+class ColaImagenesTest(MediaTemporalMixin, TestCase):
+    """Cola de imágenes: reclamo entre workers, vencimiento y resultado"""
+
+    def test_subida_encola_sin_procesar(self):
+        producto = self._producto()
+        self.assertEqual(producto.imagen_estado, 'pendiente')
+        self.assertEqual(producto.imagen_url, producto.imagen.url)
+        Producto.objects.filter(pk=producto.pk).update(imagen_estado='lista')
+        producto.refresh_from_db()
+        # El mismo contenido no se vuelve a procesar
+        producto.imagen = SimpleUploadedFile('otra.jpg', _imagen(), 'image/jpeg')
+        producto.save()
+        self.assertEqual(producto.imagen_estado, 'lista')
+
+    def test_reclamo_exclusivo(self):
+        ids = {self._producto(nombre=f'Remera {i}').id for i in range(3)}
+        self.assertEqual(set(reclamar_pendientes(10)), ids)
+        self.assertEqual(reclamar_pendientes(10), [])
+        self.assertEqual(set(Producto.objects.values_list('imagen_estado', flat=True)), {'procesando'})
+
+    @override_settings(IMAGENES_RECLAMO_SEGUNDOS=60)
+    def test_solo_se_liberan_reclamos_vencidos(self):
+        activo, caido = self._producto(nombre='Activo'), self._producto(nombre='Caído')
+        reclamar([activo.id, caido.id])
+        Producto.objects.filter(pk=caido.pk).update(imagen_reclamada=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(liberar_colgados(), 1)
+        self.assertEqual(
+            dict(Producto.objects.values_list('nombre', 'imagen_estado')),
+            {'Activo': 'procesando', 'Caído': 'pendiente'},
+        )
+
+    def test_procesar_y_reclamo_perdido(self):
+        producto = self._producto()
+        antes = producto.updated_at
+        self.assertEqual(procesar_pendientes(workers=0), (1, 0))
+        producto.refresh_from_db()
+        self.assertEqual(producto.imagen_estado, 'lista')
+        # Las URLs de la imagen cambiaron: los ETag de carrito lo notan
+        self.assertGreater(producto.updated_at, antes)
+        self.assertIsNone(producto.imagen_reclamada)
+        self.assertIn('card', producto.imagen_variantes['jpeg'])
+        self.assertTrue((self.media / producto.imagen_derivada.name).is_file())
+
+        # Un worker lento cuyo reclamo venció y otro tomó: no pisa el resultado
+        Producto.objects.filter(pk=producto.pk).update(imagen_estado='pendiente')
+        reclamar([producto.id])
+        lento = Producto.objects.get(pk=producto.pk)
+        Producto.objects.filter(pk=producto.pk).update(imagen_reclamada=timezone.now() - timedelta(hours=1))
+        liberar_colgados()
+        reclamar([producto.id])
+        variantes = generar_variantes(_imagen())
+        self.assertFalse(guardar_variantes(lento, lento.imagen_hash, variantes))
+        self.assertEqual(Producto.objects.get(pk=producto.pk).imagen_estado, 'procesando')
+
+    def test_imagen_rota(self):
+        producto = self._producto(b'no es una imagen')
+        self.assertEqual(procesar_pendientes(workers=0), (0, 1))
+        producto.refresh_from_db()
+        self.assertEqual(producto.imagen_estado, 'error')
+
+
+class VariantesImagenTest(MediaTemporalMixin, TestCase):
+    """Variantes responsivas y el <picture> con srcset"""
+
+    def test_tamanos_y_formatos(self):
+        variantes = generar_variantes(_imagen((800, 1000)), ['webp', 'jpeg'])
+        # No se amplía: 'zoom' (1440x1800) es más grande que el original
+        self.assertEqual(set(variantes), {'thumb', 'card', 'detail'})
+        for nombre, por_formato in variantes.items():
+            self.assertEqual(set(por_formato), {'webp', 'jpeg'})
+            with Image.open(BytesIO(por_formato['webp'])) as img:
+                self.assertEqual((img.format, img.size), ('WEBP', VARIANTES[nombre]))
+        # Un original más chico que todas conserva al menos la más chica
+        self.assertEqual(set(generar_variantes(_imagen((50, 50)))), {'thumb'})
+
+    @override_settings(IMAGENES_FORMATOS=['avif', 'webp'])
+    def test_formatos_activos_incluyen_fallback(self):
+        activos = formatos_activos()
+        self.assertIn('jpeg', activos)
+        self.assertEqual('avif' in activos, 'AVIF' in Image.SAVE)
+
+    def test_picture(self):
+        producto = self._producto()
+        plantilla = Template("{% load imagenes %}{% imagen_responsive producto 'card' sizes='50vw' class='foto' %}")
+        # Sin variantes todavía: <img> con el original
+        html = plantilla.render(TemplateContext({'producto': producto}))
+        self.assertInHTML(f'<img src="{producto.imagen.url}" alt="Remera" loading="lazy" class="foto">', html)
+
+        procesar_pendientes(workers=0)
+        producto.refresh_from_db()
+        html = plantilla.render(TemplateContext({'producto': producto}))
+        self.assertIn('<source type="image/webp"', html)
+        self.assertIn(f'src="{producto.imagen_variante_url("card")}"', html)
+        self.assertIn(f'{producto.imagen_variante_url("thumb")} 120w', html)
+        self.assertIn('width="360" height="450"', html)
+        self.assertEqual(producto.imagen_url, producto.imagen_derivada.url)
+
+
+class StorageContenidoTest(MediaTemporalMixin, TestCase):
+    """Archivos nombrados por contenido, compartidos y liberados al quedar sin uso"""
+
+    def _envejecer(self, nombre, segundos=3600):
+        ruta = self.media / nombre
+        antes = time.time() - segundos
+        os.utime(ruta, (antes, antes))
+
+    def test_mismo_contenido_un_solo_archivo(self):
+        contenido = _imagen()
+        uno, otro = self._producto(contenido, 'Uno'), self._producto(contenido, 'Otro')
+        self.assertEqual(uno.imagen.name, otro.imagen.name)
+        self.assertRegex(uno.imagen.name, r'^blobs/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+        # El logo de una marca con la misma imagen usa el mismo archivo
+        marca = Marca.objects.create(nombre='Marca', logo=SimpleUploadedFile('logo.JPG', contenido))
+        self.assertEqual(marca.logo.name, uno.imagen.name)
+        self.assertEqual(contar_referencias([uno.imagen.name]), {uno.imagen.name: 3})
+        self.assertEqual(len(list(self.media.rglob('*.jpg'))), 1)
+
+    def test_liberar_respeta_referencias_y_gracia(self):
+        contenido = _imagen()
+        uno, otro = self._producto(contenido, 'Uno'), self._producto(contenido, 'Otro')
+        nombre = uno.imagen.name
+        self._envejecer(nombre)
+        uno.delete()
+        # Lo sigue usando otro producto
+        self.assertEqual(liberar_archivos([nombre]), 0)
+        self.assertTrue((self.media / nombre).exists())
+
+        Producto.objects.filter(pk=otro.pk).update(imagen='')
+        # Tocado hace poco: puede estar por reutilizarlo una subida en curso
+        os.utime(self.media / nombre)
+        self.assertEqual(liberar_archivos([nombre]), 0)
+        self.assertTrue((self.media / nombre).exists())
+
+        self._envejecer(nombre)
+        self.assertEqual(liberar_archivos([nombre]), len(contenido))
+        self.assertFalse((self.media / nombre).exists())
+
+    @override_settings(MEDIA_GC_GRACIA=0)
+    def test_reemplazo_libera_el_anterior_al_confirmar(self):
+        producto = self._producto()
+        anterior = producto.imagen.name
+        self._envejecer(anterior)
+        with self.captureOnCommitCallbacks(execute=True):
+            producto.imagen = SimpleUploadedFile('nueva.jpg', _imagen(color=(0, 0, 255)))
+            producto.save()
+        self.assertFalse((self.media / anterior).exists())
+        self.assertTrue((self.media / producto.imagen.name).exists())
+
+    def test_gc_media(self):
+        producto = self._producto()
+        huerfano = storage_contenido.save('productos/suelto.jpg', ContentFile(b'x' * 10))
+        self._envejecer(huerfano)
+        salida = StringIO()
+        call_command('gc_media', dry_run=True, stdout=salida)
+        self.assertIn('Se borrarían: 1 archivos huérfanos', salida.getvalue())
+        self.assertTrue((self.media / huerfano).exists())
+        call_command('gc_media', stdout=StringIO())
+        self.assertFalse((self.media / huerfano).exists())
+        self.assertTrue((self.media / producto.imagen.name).exists())
+
+    def test_gc_media_consolidar(self):
+        # Nombres de antes: el original y el por contenido dentro de marcas/
+        contenido = _imagen()
+        for nombre in ('productos/foto.jpg', 'marcas/ab/viejo.jpg'):
+            (self.media / nombre).parent.mkdir(parents=True, exist_ok=True)
+            (self.media / nombre).write_bytes(contenido)
+        producto = self._producto(nombre='Viejo')
+        Producto.objects.filter(pk=producto.pk).update(imagen='productos/foto.jpg')
+        marca = Marca.objects.create(nombre='Marca')
+        Marca.objects.filter(pk=marca.pk).update(logo='marcas/ab/viejo.jpg')
+        call_command('gc_media', consolidar=True, min_edad=0, stdout=StringIO())
+        producto.refresh_from_db()
+        marca.refresh_from_db()
+        self.assertRegex(producto.imagen.name, r'^blobs/')
+        self.assertEqual(marca.logo.name, producto.imagen.name)
+        self.assertFalse((self.media / 'productos/foto.jpg').exists())
+        self.assertFalse((self.media / 'marcas/ab/viejo.jpg').exists())
+
+
+class ReprocesarImagenesTest(MediaTemporalMixin, TestCase):
+    """reprocess_images: reclamo compartido con los workers y errores por archivo"""
+
+    def _correr(self, **opciones):
+        salida, errores = StringIO(), StringIO()
+        call_command('reprocess_images', workers=0, reiniciar=True, stdout=salida, stderr=errores, **opciones)
+        return salida.getvalue(), errores.getvalue()
+
+    def test_respeta_los_reclamos_de_los_workers(self):
+        libre, tomado = self._producto(nombre='Libre'), self._producto(nombre='Tomado', contenido=_imagen(color=(0, 0, 255)))
+        reclamar([tomado.id])
+        reclamada = Producto.objects.get(pk=tomado.pk).imagen_reclamada
+        salida, _ = self._correr(solo='productos')
+        self.assertIn('Procesadas: 1, con error: 0', salida)
+        libre.refresh_from_db()
+        tomado.refresh_from_db()
+        self.assertEqual(libre.imagen_estado, 'lista')
+        self.assertEqual((tomado.imagen_estado, tomado.imagen_reclamada), ('procesando', reclamada))
+
+    def test_cambio_de_calidad_recodifica(self):
+        producto = self._producto()
+        self._correr(solo='productos')
+        producto.refresh_from_db()
+        antes = producto.imagen_derivada.name
+        tamano_antes = (self.media / antes).stat().st_size
+
+        jpeg = FORMATOS['jpeg']
+        with mock.patch.dict(FORMATOS, {'jpeg': (*jpeg[:3], {**jpeg[3], 'quality': 30})}):
+            salida, _ = self._correr(solo='productos')
+        producto.refresh_from_db()
+        self.assertNotEqual(producto.imagen_derivada.name, antes)
+        self.assertLess((self.media / producto.imagen_derivada.name).stat().st_size, tamano_antes)
+        self.assertNotIn('(ahorro 0.0 B)', salida)
+        # El derivado con la calidad anterior ya no lo usa nadie
+        self.assertFalse((self.media / antes).exists())
+
+    def test_logo_roto_no_corta_la_corrida(self):
+        roto = Marca.objects.create(nombre='Rota', logo=SimpleUploadedFile('rota.png', b'no es una imagen'))
+        buena = Marca.objects.create(nombre='Buena', logo=SimpleUploadedFile('buena.png', _imagen(formato='PNG')))
+        salida, errores = self._correr(solo='marcas')
+        self.assertIn(f'Marca {roto.id}: error al recomprimir', errores)
+        self.assertIn('Procesadas: 1, con error: 1', salida)
+        self.assertTrue(Marca.objects.filter(pk=buena.pk).exists())
+
+    def test_logo_reemplazado_espera_la_gracia(self):
+        contenido = _imagen(formato='PNG')
+        marca = Marca.objects.create(nombre='Marca', logo=SimpleUploadedFile('logo.png', contenido))
+        anterior = marca.logo.name
+        self._correr(solo='marcas')
+        marca.refresh_from_db()
+        self.assertNotEqual(marca.logo.name, anterior)
+        # Un request en curso todavía puede estar sirviendo el logo anterior
+        self.assertTrue((self.media / anterior).exists())
+
+
+class ImagenRedimensionadaTest(MediaTemporalMixin, TestCase):
+    """/media/r/<ancho>x<alto>/<ruta> y su cache LRU en disco"""
+
+    def setUp(self):
+        super().setUp()
+        media_views._cache = None
+        self.addCleanup(setattr, media_views, '_cache', None)
+        self.ruta = self._producto().imagen.name
+
+    def _url(self, ancho=360, alto=450, ruta=None):
+        return reverse('imagen_redimensionada', args=[ancho, alto, ruta or self.ruta])
+
+    def test_genera_una_vez_y_sirve_de_cache(self):
+        respuesta = self.client.get(self._url(), HTTP_ACCEPT='image/webp,*/*')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta['Content-Type'], 'image/webp')
+        self.assertIn('Accept', respuesta['Vary'])
+        with Image.open(BytesIO(b''.join(respuesta.streaming_content))) as img:
+            self.assertEqual((img.format, img.size), ('WEBP', (360, 450)))
+        entradas = list((self.media / 'cache').rglob('*'))
+
+        with mock.patch.object(media_views, 'redimensionar') as redimensionar:
+            respuesta = self.client.get(self._url(), HTTP_ACCEPT='image/webp')
+            b''.join(respuesta.streaming_content)
+        redimensionar.assert_not_called()
+        self.assertEqual(list((self.media / 'cache').rglob('*')), entradas)
+
+        # Sin WebP en Accept: otra entrada, en JPEG
+        respuesta = self.client.get(self._url())
+        self.assertEqual(respuesta['Content-Type'], 'image/jpeg')
+
+    def test_etag(self):
+        etag = self.client.get(self._url())['ETag']
+        respuesta = self.client.get(self._url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 304)
+        self.assertEqual(respuesta['ETag'], etag)
+        self.assertNotEqual(self.client.get(self._url(), HTTP_ACCEPT='image/webp')['ETag'], etag)
+
+    def test_pedidos_rechazados(self):
+        self.assertEqual(self.client.get(self._url(ancho=361)).status_code, 404)
+        self.assertEqual(self.client.get(self._url(ruta='productos/no-existe.jpg')).status_code, 404)
+        self.assertEqual(self.client.get(self._url(ruta='otros/foto.jpg')).status_code, 404)
+        self.assertEqual(self.client.get(self._url(ruta='productos/../../settings.py')).status_code, 404)
+        self.assertEqual(self.client.post(self._url()).status_code, 405)
+
+    def test_desaloja_lo_menos_usado(self):
+        cache_disco = CacheDisco(self.media / 'lru', max_bytes=250)
+        for i, clave in enumerate(('aa1', 'bb2', 'cc3')):
+            cache_disco.put(clave, b'x' * 80)
+            antes = time.time() - 100 + i
+            os.utime(cache_disco.ruta(clave), (antes, antes))
+        # Usar 'aa1' la vuelve la más reciente: se desaloja 'bb2'
+        self.assertIsNotNone(cache_disco.get('aa1'))
+        cache_disco.put('dd4', b'x' * 80)
+        presentes = {clave for clave in ('aa1', 'bb2', 'cc3', 'dd4') if cache_disco.get(clave)}
+        self.assertEqual(presentes, {'aa1', 'dd4'})
+
+
+class TotalesCarritoTest(TestCase):
+    """Totales del carrito calculados por la base, con decimales exactos"""
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre='Remeras')
+        color = Color.objects.create(nombre='Negro', hex_code='#000000')
+        talle = Talle.objects.create(nombre='Mediano', abbreviation='M')
+        usuario = User.objects.create_user('cliente', password='clave')
+        cls.carrito = Carrito.objects.create(usuario=usuario)
+        cls.vacio = Carrito.objects.create(session_key='x' * 32)
+        for precio, cantidad in (('19.99', 3), ('5.01', 1), ('0.10', 7)):
+            producto = Producto.objects.create(nombre=f'Remera {precio}', precio=Decimal(precio), categoria=categoria)
+            CarritoItem.objects.create(carrito=cls.carrito, producto=producto, color=color, talle=talle, cantidad=cantidad)
+
+    def test_resumen_en_una_consulta(self):
+        with self.assertNumQueries(1):
+            resumen = self.carrito.get_resumen()
+        self.assertEqual(resumen, {'items': 3, 'cantidad_total': 11, 'total': Decimal('65.68')})
+        self.assertEqual(str(resumen['total']), '65.68')
+        self.assertEqual(self.vacio.get_resumen(), {'items': 0, 'cantidad_total': 0, 'total': Decimal('0.00')})
+
+    def test_con_totales(self):
+        with self.assertNumQueries(1):
+            carritos = {c.pk: c for c in Carrito.objects.con_totales()}
+        with self.assertNumQueries(0):
+            self.assertEqual(carritos[self.carrito.pk].get_total(), Decimal('65.68'))
+            self.assertEqual(carritos[self.carrito.pk].get_cantidad_total(), 11)
+            self.assertEqual(carritos[self.vacio.pk].get_total(), Decimal('0.00'))
+        self.assertEqual(
+            carritos[self.carrito.pk].get_total(),
+            sum((item.get_subtotal() for item in self.carrito.items.select_related('producto')), Decimal('0')),
+        )
+
+
+class ResumenSesionTest(TestCase):
+    """/carrito/data/ es una lectura: no guarda la sesión si el resumen no cambió"""
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre='Remeras')
+        cls.color = Color.objects.create(nombre='Negro', hex_code='#000000')
+        cls.talle = Talle.objects.create(nombre='Mediano', abbreviation='M')
+        cls.producto = Producto.objects.create(nombre='Remera', precio=Decimal('19.99'), categoria=categoria)
+        ProductoStock.objects.create(producto=cls.producto, color=cls.color, talle=cls.talle, stock=10)
+
+    def _agregar(self):
+        return self.client.post(reverse('agregar_al_carrito'), json.dumps({
+            'producto_id': self.producto.id, 'color_id': self.color.id, 'talle_id': self.talle.id, 'cantidad': 2,
+        }), content_type='application/json')
+
+    def _escrituras_de_sesion(self):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(reverse('cart_data'))
+        self.assertEqual(respuesta.status_code, 200)
+        return [c['sql'] for c in consultas if c['sql'].startswith(('UPDATE "django_session"', 'INSERT INTO "django_session"'))]
+
+    def test_lectura_no_escribe_la_sesion(self):
+        self.assertEqual(self._agregar().json()['cantidad_total'], 2)
+        version = self.client.session['carrito_resumen']['version']
+        self.assertEqual(self._escrituras_de_sesion(), [])
+        self.assertEqual(self._escrituras_de_sesion(), [])
+        self.assertEqual(self.client.session['carrito_resumen']['version'], version)
+
+    def test_cambio_externo_actualiza_el_resumen(self):
+        self._agregar()
+        CarritoItem.objects.update(cantidad=5)
+        self.assertEqual(len(self._escrituras_de_sesion()), 1)
+        resumen = self.client.session['carrito_resumen']
+        self.assertEqual((resumen['cantidad'], resumen['total']), (5, '99.95'))
+
+
+@override_settings(PRESUPUESTO_CONSULTAS_ACCION='error')
+class LoteCarritoTest(TestCase):
+    """/carrito/batch/ reserva todo el lote con una cantidad fija de consultas"""
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre='Remeras')
+        cls.color = Color.objects.create(nombre='Negro', hex_code='#000000')
+        cls.talle = Talle.objects.create(nombre='Mediano', abbreviation='M')
+        cls.productos = Producto.objects.bulk_create(
+            Producto(nombre=f'Remera {i}', precio=Decimal('100.00'), categoria=categoria) for i in range(20)
+        )
+        ProductoStock.objects.bulk_create(
+            ProductoStock(producto=producto, color=cls.color, talle=cls.talle, stock=5) for producto in cls.productos
+        )
+        cls.usuario = User.objects.create_user('cliente', password='clave')
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def _agregar(self, producto, cantidad=1):
+        return {'op': 'agregar', 'producto_id': producto.id, 'color_id': self.color.id, 'talle_id': self.talle.id, 'cantidad': cantidad}
+
+    def _lote(self, operaciones):
+        return self.client.post(reverse('carrito_batch'), json.dumps({'operaciones': operaciones}), content_type='application/json')
+
+    def _reservado(self):
+        return dict(ProductoStock.objects.filter(reservado__gt=0).values_list('producto_id', 'reservado'))
+
+    def test_consultas_constantes(self):
+        # El primer lote además crea el carrito
+        self.assertEqual(self._lote([self._agregar(self.productos[0])]).status_code, 200)
+        self.assertEqual(self._lote([{'op': 'vaciar'}]).status_code, 200)
+        conteos = {}
+        for cantidad in (1, 5, 20):
+            with CaptureQueriesContext(connection) as consultas:
+                respuesta = self._lote([self._agregar(p, 2) for p in self.productos[:cantidad]])
+            self.assertEqual(respuesta.status_code, 200, respuesta.content)
+            self.assertEqual(respuesta.json()['cantidad_total'], 2 * cantidad)
+            conteos[cantidad] = len(consultas)
+            self.assertEqual(self._lote([{'op': 'vaciar'}]).status_code, 200)
+        self.assertEqual(len(set(conteos.values())), 1, conteos)
+
+    def test_reservas_del_lote(self):
+        uno, dos, tres = self.productos[:3]
+        self._lote([self._agregar(uno, 2), self._agregar(dos, 3), self._agregar(tres)])
+        self.assertEqual(self._reservado(), {uno.id: 2, dos.id: 3, tres.id: 1})
+        items = {i.producto_id: i.id for i in CarritoItem.objects.all()}
+        respuesta = self._lote([
+            {'op': 'actualizar', 'item_id': items[uno.id], 'cantidad': 5},
+            {'op': 'actualizar', 'item_id': items[dos.id], 'cantidad': 1},
+            {'op': 'eliminar', 'item_id': items[tres.id]},
+        ])
+        self.assertEqual(respuesta.json()['cantidad_total'], 6)
+        self.assertEqual(self._reservado(), {uno.id: 5, dos.id: 1})
+        self.assertEqual(
+            dict(CarritoItem.objects.values_list('producto_id', 'reservado')), {uno.id: 5, dos.id: 1},
+        )
+
+    def test_sin_stock_no_se_aplica_nada(self):
+        uno, dos = self.productos[:2]
+        respuesta = self._lote([self._agregar(uno), self._agregar(dos, 6)])
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertEqual(respuesta.json()['errores'][0]['disponible'], 5)
+        self.assertEqual(self._reservado(), {})
+        self.assertFalse(CarritoItem.objects.exists())
+
+    def test_reservar_lote_sin_stock_o_con_conflicto(self):
+        uno, dos = self.productos[:2]
+        carrito = Carrito.objects.create(usuario=self.usuario)
+        items = CarritoItem.objects.bulk_create(
+            CarritoItem(carrito=carrito, producto=p, color=self.color, talle=self.talle, cantidad=0) for p in (uno, dos)
+        )
+        # Otro comprador se llevó el stock de `dos` después de la validación
+        ProductoStock.objects.filter(producto=dos).update(reservado=4)
+        with self.assertRaises(StockInsuficiente) as error:
+            reservar_lote(carrito.id, [(items[0], 3), (items[1], 2)])
+        self.assertEqual(error.exception.disponible, 1)
+        self.assertEqual(self._reservado(), {dos.id: 4})
+        self.assertEqual(set(CarritoItem.objects.values_list('reservado', flat=True)), {0})
+
+        # El item cambió en otro request: no se pisa
+        CarritoItem.objects.filter(pk=items[0].pk).update(cantidad=1, reservado=1)
+        with self.assertRaises(ConflictoReserva):
+            reservar_lote(carrito.id, [(items[0], 3)])
+        self.assertEqual(CarritoItem.objects.get(pk=items[0].pk).reservado, 1)
+
+
+class PurgaCarritosTest(TestCase):
+    """purgar_carritos: qué se borra y qué no"""
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre='Remeras')
+        cls.color = Color.objects.create(nombre='Negro', hex_code='#000000')
+        cls.talle = Talle.objects.create(nombre='Mediano', abbreviation='M')
+        cls.producto = Producto.objects.create(nombre='Remera', precio=Decimal('100.00'), categoria=categoria)
+        cls.stock = ProductoStock.objects.create(producto=cls.producto, color=cls.color, talle=cls.talle, stock=10)
+        cls.usuario = User.objects.create_user('cliente', password='clave')
+
+    def _sesion(self, vencida=False):
+        sesion = SessionStore()
+        sesion.create()
+        if vencida:
+            Session.objects.filter(session_key=sesion.session_key).update(expire_date=timezone.now() - timedelta(days=1))
+        return sesion.session_key
+
+    def _carrito(self, nombre, dias=0, unidades=0, **datos):
+        carrito = Carrito.objects.create(**datos)
+        if unidades:
+            item = CarritoItem.objects.create(carrito=carrito, producto=self.producto, color=self.color, talle=self.talle, cantidad=0)
+            reservar(item, unidades)
+        Carrito.objects.filter(pk=carrito.pk).update(actualizado=timezone.now() - timedelta(days=dias))
+        self.nombres[carrito.pk] = nombre
+        return carrito
+
+    def setUp(self):
+        self.nombres = {}
+        self._carrito('usuario viejo con items', dias=90, unidades=1, usuario=self.usuario)
+        self._carrito('usuario vacío viejo', dias=2, usuario=User.objects.create_user('otro'))
+        self._carrito('usuario vacío reciente', usuario=User.objects.create_user('nuevo'))
+        self._carrito('invitado activo', dias=1, unidades=2, session_key=self._sesion())
+        self._carrito('invitado sin sesión', unidades=3, session_key='no-existe')
+        self._carrito('invitado abandonado', dias=8, unidades=1, session_key=self._sesion())
+        self._carrito('invitado con sesión vencida', unidades=1, session_key=self._sesion(vencida=True))
+
+    def _quedan(self):
+        return {self.nombres[pk] for pk in Carrito.objects.values_list('pk', flat=True)}
+
+    def test_purgar(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            resultado = purgar(lote=1)
+        self.assertEqual(resultado, {'sesiones': 1, 'carritos_vacios': 1, 'carritos_invitados': 3})
+        self.assertEqual(self._quedan(), {'usuario viejo con items', 'usuario vacío reciente', 'invitado activo'})
+        # Los items borrados devolvieron su reserva al stock
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.reservado, 3)
+
+    def test_simular(self):
+        salida = StringIO()
+        call_command('purgar_carritos', dry_run=True, stdout=salida)
+        self.assertIn('A borrar (carritos invitados): 2', salida.getvalue())
+        self.assertEqual(len(self._quedan()), 7)
+
+
+class FusionCarritoTest(TestCase):
+    """Al iniciar sesión el carrito del invitado pasa al del usuario"""
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre='Remeras')
+        cls.color = Color.objects.create(nombre='Negro', hex_code='#000000')
+        cls.talle = Talle.objects.create(nombre='Mediano', abbreviation='M')
+        cls.productos = Producto.objects.bulk_create(
+            Producto(nombre=f'Remera {i}', precio=Decimal('100.00'), categoria=categoria) for i in range(6)
+        )
+        ProductoStock.objects.bulk_create(
+            ProductoStock(producto=p, color=cls.color, talle=cls.talle, stock=5) for p in cls.productos
+        )
+        cls.usuario = User.objects.create_user('cliente', password='clave', first_name='Ana')
+
+    def _agregar(self, producto, cantidad):
+        respuesta = self.client.post(reverse('agregar_al_carrito'), json.dumps({
+            'producto_id': producto.id, 'color_id': self.color.id, 'talle_id': self.talle.id, 'cantidad': cantidad,
+        }), content_type='application/json')
+        self.assertEqual(respuesta.status_code, 200, respuesta.content)
+
+    def _login(self):
+        respuesta = self.client.post(reverse('login_cliente'), {'username': 'cliente', 'password': 'clave'})
+        self.assertEqual(respuesta.status_code, 302)
+
+    def _items(self, carrito):
+        return dict(carrito.items.values_list('producto_id', 'cantidad'))
+
+    def _verificar_reservas(self):
+        reservado = dict(ProductoStock.objects.values_list('producto_id', 'reservado'))
+        en_carritos = dict(CarritoItem.objects.values_list('producto_id').annotate(n=Sum('reservado')))
+        self.assertEqual({p: n for p, n in reservado.items() if n}, en_carritos)
+
+    def test_adopta_el_carrito_del_invitado(self):
+        uno, dos = self.productos[:2]
+        self._agregar(uno, 2)
+        self._agregar(dos, 1)
+        invitado = Carrito.objects.get()
+        self._login()
+        carrito = Carrito.objects.get()
+        self.assertEqual(carrito.pk, invitado.pk)
+        self.assertEqual((carrito.usuario, carrito.session_key), (self.usuario, None))
+        self.assertEqual(self._items(carrito), {uno.id: 2, dos.id: 1})
+        self.assertNotIn('carrito_resumen', self.client.session)
+        self._verificar_reservas()
+
+    def test_suma_y_recorta_al_stock(self):
+        uno, dos, tres = self.productos[:3]
+        propio = Carrito.objects.create(usuario=self.usuario)
+        for producto, cantidad in ((uno, 3), (dos, 1)):
+            item = CarritoItem.objects.create(carrito=propio, producto=producto, color=self.color, talle=self.talle, cantidad=0)
+            reservar(item, cantidad)
+        self._agregar(uno, 2)
+        self._agregar(dos, 4)
+        self._agregar(tres, 1)
+        self._login()
+        self.assertEqual(Carrito.objects.get().pk, propio.pk)
+        # 3 + 2 de `uno` entran; 1 + 4 de `dos` también (stock 5); `tres` se suma
+        self.assertEqual(self._items(propio), {uno.id: 5, dos.id: 5, tres.id: 1})
+        self._verificar_reservas()
+
+    def test_otro_comprador_toma_stock_durante_la_fusion(self):
+        uno, dos = self.productos[:2]
+        # Items del usuario cuya reserva ya venció: la fusión los vuelve a reservar
+        propio = Carrito.objects.create(usuario=self.usuario)
+        for producto, cantidad in ((uno, 2), (dos, 1)):
+            CarritoItem.objects.create(carrito=propio, producto=producto, color=self.color, talle=self.talle, cantidad=cantidad)
+        self._agregar(uno, 3)
+        self._agregar(dos, 1)
+        leer = fusion_carrito._stock_libre
+
+        def leer_y_vender(producto_ids):
+            libres = leer(producto_ids)
+            # Entre la lectura y la reserva otro request toma el último libre de `uno`
+            ProductoStock.objects.filter(producto=uno).update(reservado=F('reservado') + 1)
+            return libres
+
+        with mock.patch.object(fusion_carrito, '_stock_libre', leer_y_vender):
+            self._login()
+        # De `uno` quedaban 2 libres y el otro comprador se llevó 1: queda en 4, no en 5
+        self.assertEqual(self._items(propio), {uno.id: 4, dos.id: 2})
+        stock = ProductoStock.objects.get(producto=uno)
+        self.assertEqual((stock.stock, stock.reservado), (5, 5))
+        self.assertEqual(ProductoStock.objects.get(producto=dos).reservado, 2)
+
+    def test_consultas_constantes(self):
+        conteos = {}
+        for cantidad in (1, 5):
+            propio = Carrito.objects.create(usuario=self.usuario)
+            invitado = Carrito.objects.create(session_key=f'invitado-{cantidad}')
+            CarritoItem.objects.bulk_create(
+                CarritoItem(carrito=carrito, producto=p, color=self.color, talle=self.talle, cantidad=1)
+                for carrito in (propio, invitado) for p in self.productos[:cantidad]
+            )
+            with CaptureQueriesContext(connection) as consultas:
+                fusionar_carritos(invitado, self.usuario)
+            conteos[cantidad] = len(consultas)
+            self.assertEqual(set(self._items(propio).values()), {2})
+            propio.delete()
+        self.assertEqual(conteos[1], conteos[5], conteos)
+
+
+class ETagCarritoTest(TestCase):
+    """/carrito/data/ contesta 304 sólo si no cambió ni el carrito ni sus productos"""
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre='Remeras')
+        cls.color = Color.objects.create(nombre='Negro', hex_code='#000000')
+        cls.talle = Talle.objects.create(nombre='Mediano', abbreviation='M')
+        cls.producto = Producto.objects.create(nombre='Remera', precio=Decimal('100.00'), categoria=categoria)
+        ProductoStock.objects.create(producto=cls.producto, color=cls.color, talle=cls.talle, stock=5)
+        cls.usuario = User.objects.create_user('cliente', password='clave')
+        cls.carrito = Carrito.objects.create(usuario=cls.usuario)
+        cls.item = CarritoItem.objects.create(carrito=cls.carrito, producto=cls.producto, color=cls.color, talle=cls.talle, cantidad=1)
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def _pedir(self, etag=None):
+        if etag:
+            return self.client.get(reverse('cart_data'), HTTP_IF_NONE_MATCH=etag)
+        return self.client.get(reverse('cart_data'))
+
+    def test_304_mientras_no_cambie(self):
+        respuesta = self._pedir()
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn('no-cache', respuesta['Cache-Control'])
+        etag = respuesta['ETag']
+        with self.assertNumQueries(3):  # sesión, usuario y carrito con la versión de sus productos
+            respuesta = self._pedir(etag)
+        self.assertEqual(respuesta.status_code, 304)
+        self.assertEqual(respuesta['ETag'], etag)
+
+    def test_cambio_del_carrito(self):
+        etag = self._pedir()['ETag']
+        reservar(self.item, 2)
+        respuesta = self._pedir(etag)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.json()['cantidad_total'], 2)
+
+    def test_cambio_del_producto(self):
+        etag = self._pedir()['ETag']
+        self.producto.precio = Decimal('120.00')
+        self.producto.nombre = 'Remera nueva'
+        self.producto.save()
+        respuesta = self._pedir(etag)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotEqual(respuesta['ETag'], etag)
+        self.assertEqual(respuesta.json()['items'][0]['precio'], '120.00')
+        self.assertEqual(respuesta.json()['items'][0]['nombre'], 'Remera nueva')
+        self.assertEqual(self._pedir(respuesta['ETag']).status_code, 304)
+
+    def test_sin_carrito(self):
+        Carrito.objects.all().delete()
+        respuesta = self._pedir()
+        self.assertEqual(respuesta.json()['items'], [])
+        self.assertFalse(respuesta.has_header('ETag'))
+
+
+class EventosTest(TestCase):
+    """Pub/sub de cambios de carrito y stock, y el endpoint SSE"""
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre='Remeras')
+        cls.color = Color.objects.create(nombre='Negro', hex_code='#000000')
+        cls.talle = Talle.objects.create(nombre='Mediano', abbreviation='M')
+        cls.producto = Producto.objects.create(nombre='Remera', precio=Decimal('100.00'), categoria=categoria)
+        ProductoStock.objects.create(producto=cls.producto, color=cls.color, talle=cls.talle, stock=5)
+        cls.carrito = Carrito.objects.create(session_key='x' * 32)
+        cls.item = CarritoItem.objects.create(carrito=cls.carrito, producto=cls.producto, color=cls.color, talle=cls.talle, cantidad=0)
+
+    def setUp(self):
+        broker = BrokerLocal()
+        parche = mock.patch.object(eventos, '_broker', broker)
+        parche.start()
+        self.addCleanup(parche.stop)
+        self.broker = broker
+
+    async def test_broker_entrega_desde_otro_hilo(self):
+        suscripcion = self.broker.suscribir({'carrito:1', 'stock:2'})
+        self.assertTrue(self.broker.escuchando('stock:2'))
+        hilo = threading.Thread(target=self.broker.publicar, args=('stock:2', {'producto_id': 2}))
+        hilo.start()
+        hilo.join()
+        self.assertEqual(await suscripcion.recibir(1), ('stock', '{"producto_id": 2}'))
+        self.assertIsNone(await suscripcion.recibir(0.01))
+        suscripcion.cerrar()
+        self.assertFalse(self.broker.escuchando('stock:2'))
+        self.assertEqual(self.broker.publicar('stock:2', {}), 0)
+
+    async def test_reserva_avisa_al_confirmar(self):
+        suscripcion = self.broker.suscribir({f'carrito:{self.carrito.pk}', f'stock:{self.producto.pk}'})
+
+        def reservar_y_confirmar():
+            with self.captureOnCommitCallbacks(execute=True):
+                reservar(self.item, 2)
+
+        await sync_to_async(reservar_y_confirmar)()
+        recibidos = {await suscripcion.recibir(1), await suscripcion.recibir(1)}
+        self.assertIn(('carrito', json.dumps({'carrito_id': self.carrito.pk})), recibidos)
+        stock = next(json.loads(datos) for tipo, datos in recibidos if tipo == 'stock')
+        self.assertEqual(stock['variantes'], [{'color_id': self.color.id, 'talle_id': self.talle.id, 'stock': 5, 'libre': 3}])
+        suscripcion.cerrar()
+
+    def test_stock_sin_oyentes_no_consulta(self):
+        with self.assertNumQueries(0):
+            eventos._publicar_stock([self.producto.pk])
+
+    def test_wsgi_contesta_204(self):
+        self.assertEqual(self.client.get(reverse('eventos'), {'productos': self.producto.pk}).status_code, 204)
+
+    async def test_flujo_asgi(self):
+        self.assertEqual((await self.async_client.get(reverse('eventos'))).status_code, 204)
+        respuesta = await self.async_client.get(reverse('eventos'), {'productos': f'{self.producto.pk},x'})
+        self.assertEqual(respuesta['Content-Type'], 'text/event-stream')
+        flujo = aiter(respuesta.streaming_content)
+        self.assertEqual(await anext(flujo), b'retry: 5000\n\n')
+        self.broker.publicar(f'stock:{self.producto.pk}', {'producto_id': self.producto.pk})
+        self.assertEqual(await anext(flujo), f'event: stock\ndata: {{"producto_id": {self.producto.pk}}}\n\n'.encode())
+        # El cliente se desconecta mientras se espera el próximo evento: el
+        # servidor cancela la tarea y la suscripción se cierra
+        espera = asyncio.ensure_future(anext(flujo))
+        await asyncio.sleep(0.01)
+        espera.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await espera
+        self.assertFalse(self.broker.escuchando(f'stock:{self.producto.pk}'))
+
+
+class VistasAsyncTest(TestCase):
+    """Las vistas async de la tienda: sin consultas desde el event loop y con el mismo resultado que las sync"""
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre='Remeras')
+        cls.color = Color.objects.create(nombre='Negro', hex_code='#000000')
+        cls.talle = Talle.objects.create(nombre='Mediano', abbreviation='M')
+        cls.productos = []
+        for i in range(5):
+            producto = Producto.objects.create(nombre=f'Remera {i}', precio=Decimal('100.00'), categoria=categoria)
+            producto.colores.add(cls.color)
+            ProductoStock.objects.create(producto=producto, color=cls.color, talle=cls.talle, stock=i)
+            cls.productos.append(producto)
+        recalcular_disponibilidad([p.id for p in cls.productos])
+        cls.usuario = User.objects.create_user('cliente', password='clave')
+        carrito = Carrito.objects.create(usuario=cls.usuario)
+        CarritoItem.objects.create(carrito=carrito, producto=cls.productos[1], color=cls.color, talle=cls.talle, cantidad=1)
+
+    async def test_paginas_bajo_asgi(self):
+        # Una consulta perezosa en la plantilla fallaría con SynchronousOnlyOperation
+        await sync_to_async(self.async_client.force_login)(self.usuario)
+        for url in (reverse('inicio'), reverse('productos'), reverse('productos') + '?q=remera&color=%d' % self.color.id,
+                    reverse('producto_detail', args=[self.productos[3].id])):
+            respuesta = await self.async_client.get(url)
+            self.assertEqual(respuesta.status_code, 200, url)
+            self.assertContains(respuesta, 'Remera')
+            self.assertContains(respuesta, '<span class="cart-badge" id="cartBadge">1</span>', html=True)
+        self.assertEqual((await self.async_client.get(reverse('producto_detail', args=[0]))).status_code, 404)
+
+    async def test_mismos_resultados_que_sync(self):
+        queryset = Producto.objects.order_by()
+        sync_pagina = await sync_to_async(KeysetPaginator(queryset, 2).get_page)()
+        async_pagina = await KeysetPaginator(queryset, 2).aget_page()
+        self.assertEqual([p.id for p in async_pagina], [p.id for p in sync_pagina])
+        self.assertEqual(async_pagina.next_cursor, sync_pagina.next_cursor)
+
+        filtros = {'color': str(self.color.id)}
+        self.assertEqual(await acontar_facetas(filtros), await sync_to_async(contar_facetas)(filtros))
+
+        productos = [p async for p in Producto.objects.order_by('id')]
+        await aadjuntar_disponibilidad(productos)
+        self.assertEqual([len(p.get_talles_con_stock()) for p in productos], [0, 1, 1, 1, 1])
+
+
+class SeedCatalogTest(TestCase):
+    """seed_catalog genera siempre los mismos datos con la misma --seed"""
+
+    OPCIONES = {
+        'categorias': 4, 'marcas': 5, 'colores': 6, 'productos': 30, 'colores_por_producto': 2,
+        'talles_por_producto': 3, 'clientes': 10, 'carritos': 5, 'lote': 7, 'sin_indices': True,
+    }
+
+    def _generar(self, seed):
+        """Corre el comando y devuelve sus datos sin ids; la transacción se deshace al final"""
+        with transaction.atomic():
+            call_command('seed_catalog', seed=seed, stdout=StringIO(), **self.OPCIONES)
+            datos = {
+                'productos': list(Producto.objects.order_by('nombre').values_list(
+                    'nombre', 'descripcion', 'precio', 'categoria__nombre', 'marca__nombre', 'talle__nombre',
+                )),
+                'colores': sorted(Producto.colores.through.objects.values_list('producto__nombre', 'color__nombre')),
+                'stock': sorted(ProductoStock.objects.values_list(
+                    'producto__nombre', 'color__nombre', 'talle__nombre', 'stock',
+                )),
+                'clientes': list(Cliente.objects.order_by('email').values_list(
+                    'email', 'nombre', 'apellidos', 'grupo__nombre', 'ventas_totales', 'boletin',
+                )),
+                'direcciones': sorted(Direccion.objects.values_list('cliente__email', 'direccion', 'ciudad')),
+                'items': sorted(CarritoItem.objects.values_list(
+                    'carrito__usuario__username', 'producto__nombre', 'color__nombre', 'talle__nombre', 'cantidad',
+                )),
+            }
+            transaction.set_rollback(True)
+        return datos
+
+    def test_misma_seed_mismos_datos(self):
+        datos = self._generar(seed=7)
+        self.assertEqual(len(datos['productos']), 30)
+        self.assertEqual(len(datos['stock']), 30 * 2 * 3)
+        self.assertTrue(datos['items'])
+        self.assertEqual(self._generar(seed=7), datos)
+        self.assertNotEqual(self._generar(seed=8)['productos'], datos['productos'])
+
+    def test_requiere_base_vacia(self):
+        Producto.objects.create(nombre='Remera', precio=Decimal('100.00'), categoria=Categoria.objects.create(nombre='Remeras'))
+        with self.assertRaises(CommandError):
+            call_command('seed_catalog', stdout=StringIO(), **self.OPCIONES)
@@ -1,67 +1,119 @@
-from django.shortcuts import render, get_object_or_404
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, aget_object_or_404
+from django.http import JsonResponse
+from django.urls import reverse
 from .models import Producto, Categoria, Color, Talle, Marca
+from django.conf import settings
+from .pagination import KeysetPaginator, RankedPaginator, CursorInvalido
+from .disponibilidad import aadjuntar_disponibilidad
+from .facets import filtros_activos, aplicar_filtros, acontar_facetas, anotar_conteos
+from .search import get_backend
+from .autocomplete import get_indice
+from .context_processors import acart_processor
 
-def home(request):
-    featured_productos = Producto.objects.select_related('categoria', 'marca').prefetch_related('colores').all()[:6]
-    return render(request, 'index.html', {
-        'featured_productos': featured_productos
+
+# Las vistas de la tienda son async: bajo ASGI no ocupan un hilo mientras
+# esperan a la base. Todo lo que usa la plantilla se resuelve antes de
+# renderizar, porque render() es síncrono y no puede consultar la base desde
+# el event loop.
+
+async def _render(request, template, contexto):
+    """render() para vistas async: resuelve antes el usuario y el resumen del carrito"""
+    request.user = await request.auser()
+    contexto.update(await acart_processor(request))
+    return render(request, template, contexto)
+
+
+async def home(request):
+    productos_destacados = [
+        producto async for producto in
+        Producto.objects.select_related('categoria', 'marca').prefetch_related('colores')[:6]
+    ]
+    return await _render(request, 'index.html', {
+        'productos_destacados': productos_destacados
     })
 
-def producto_list(request):
-    categoria_id = request.GET.get('categoria')
-    color_id = request.GET.get('color')
-    talle_id = request.GET.get('talle')
-    marca_id = request.GET.get('marca')
+async def producto_list(request):
+    filtros = filtros_activos(request.GET)
     
-    categorias = Categoria.objects.all()
-    colores = Color.objects.all()
-    talles = Talle.objects.all()
-    marcas = Marca.objects.all()
+    # Conteos por faceta (una consulta agregada, cacheada por combinación de filtros)
+    conteos = await acontar_facetas(filtros)
+    categorias = anotar_conteos([c async for c in Categoria.objects.all()], conteos['categoria'])
+    colores = anotar_conteos([c async for c in Color.objects.all()], conteos['color'])
+    talles = anotar_conteos([t async for t in Talle.objects.all()], conteos['talle'])
+    marcas = anotar_conteos([m async for m in Marca.objects.all()], conteos['marca'])
     
-    productos = Producto.objects.select_related('categoria', 'marca').prefetch_related('colores', 'stock_items').all()
+    productos = Producto.objects.select_related('categoria', 'marca', 'disponibilidad').all()
     
-    # Filtrar por categoría
-    if categoria_id:
-        productos = productos.filter(categoria_id=categoria_id)
+    # Filtrar por búsqueda, categoría, color, talle y marca
+    productos = aplicar_filtros(productos, filtros)
     
-    # Filtrar por color
-    if color_id:
-        productos = productos.filter(colores__id=color_id).distinct()
+    if filtros.get('q'):
+        # Resultados de búsqueda ordenados por relevancia
+        ids = await sync_to_async(get_backend().buscar)(filtros['q'], settings.BUSQUEDA_MAX_RESULTADOS)
+        paginator = RankedPaginator(productos, ids, request.GET.get('page_size'))
+    else:
+        # Paginar por cursor sobre (-created_at, id)
+        paginator = KeysetPaginator(productos, request.GET.get('page_size'))
+    try:
+        page = await paginator.aget_page(request.GET.get('cursor'))
+    except CursorInvalido:
+        page = await paginator.aget_page()
     
-    # Filtrar por talle
-    if talle_id:
-        productos = productos.filter(stock_items__talle_id=talle_id).distinct()
+    # Colores y talles con stock de toda la página, sin consultas por producto
+    await aadjuntar_disponibilidad(page.object_list)
     
-    # Filtrar por marca
-    if marca_id:
-        productos = productos.filter(marca_id=marca_id)
+    # Query string de los filtros activos, para armar los links de paginación
+    filtros_query = request.GET.copy()
+    filtros_query.pop('cursor', None)
     
-    return render(request, 'producto.html', {
-        'productos': productos,
+    return await _render(request, 'producto.html', {
+        'productos': page,
+        'page': page,
+        'filtros_query': filtros_query.urlencode(),
         'categorias': categorias,
         'colores': colores,
         'talles': talles,
         'marcas': marcas,
-        'selected_categoria': categoria_id,
-        'selected_color': color_id,
-        'selected_talle': talle_id,
-        'selected_marca': marca_id,
+        'selected_categoria': filtros.get('categoria'),
+        'selected_color': filtros.get('color'),
+        'selected_talle': filtros.get('talle'),
+        'selected_marca': filtros.get('marca'),
+        'q': filtros.get('q', ''),
     })
 
-def producto_detail(request, producto_id):
-    producto = get_object_or_404(
-        Producto.objects.select_related('categoria', 'marca').prefetch_related('colores', 'stock_items'),
+async def producto_detail(request, producto_id):
+    producto = await aget_object_or_404(
+        Producto.objects.select_related('categoria', 'marca', 'disponibilidad'),
         id=producto_id
     )
-    stock_items = producto.stock_items.select_related('color', 'talle').filter(stock__gt=0)
+    stock_items = [
+        item async for item in
+        producto.stock_items.select_related('color', 'talle').filter(stock__gt=0)
+    ]
     
-    # Obtener colores y talles disponibles
-    colores_disponibles = Color.objects.filter(productostock__producto=producto).distinct()
-    talles_disponibles = Talle.objects.filter(productostock__producto=producto).distinct()
+    # Obtener colores y talles disponibles desde el índice de disponibilidad
+    await aadjuntar_disponibilidad([producto])
+    colores_disponibles = producto.get_colores_con_stock()
+    talles_disponibles = producto.get_talles_con_stock()
     
-    return render(request, 'producto_detail.html', {
+    return await _render(request, 'producto_detail.html', {
         'producto': producto,
         'stock_items': stock_items,
         'colores_disponibles': colores_disponibles,
         'talles_disponibles': talles_disponibles,
-    })
\ No newline at end of file
+    })
+
+def autocomplete(request):
+    """Sugerencias de productos, marcas y categorías mientras se escribe"""
+    q = request.GET.get('q', '')[:100]
+    resultados = get_indice().buscar(q, limite=10)
+    
+    listado = reverse('productos')
+    for resultado in resultados:
+        if resultado['tipo'] == 'producto':
+            resultado['url'] = reverse('producto_detail', args=[resultado['id']])
+        else:
+            resultado['url'] = f"{listado}?{resultado['tipo']}={resultado['id']}"
+    
+    return JsonResponse({'resultados': resultados})
@@ -21,6 +21,7 @@ const CartManager = {
 		cartBadge.textContent = data.cantidad_total;
 
 		if (data.items.length === 0) {
+			cartItems.innerHTML = "";
 			emptyCart.style.display = "block";
 			cartSummary.style.display = "none";
 			return;
@@ -34,9 +35,13 @@ const CartManager = {
 			.map(
 				(item) => `
 				<div class="cart-item" data-item-id="${item.id}">
-					<img src="${item.imagen || "https://via.placeholder.com/80"}" 
-						alt="${item.nombre}" 
-						class="cart-item-image">
+					<picture>
+						${item.imagen_srcset_webp ? `<source type="image/webp" srcset="${item.imagen_srcset_webp}" sizes="80px">` : ""}
+						<img src="${item.imagen || "https://via.placeholder.com/80"}" 
+							${item.imagen_srcset ? `srcset="${item.imagen_srcset}" sizes="80px"` : ""}
+							alt="${item.nombre}" 
+							class="cart-item-image">
+					</picture>
 					<div class="cart-item-details">
 						<div class="cart-item-name">${item.nombre}</div>
 						<div class="cart-item-description">
@@ -51,7 +56,7 @@ const CartManager = {
 							<button class="quantity-btn" onclick="CartManager.changeQuantity(this, 1)">+</button>
 						</div>
 					</div>
-					<div class="cart-item-remove" onclick="CartManager.removeItem(${item.id}); location.reload();">
+					<div class="cart-item-remove" onclick="CartManager.removeItem(${item.id})">
 						<i class="fas fa-times"></i>
 					</div>
 				</div>
@@ -109,51 +114,55 @@ const CartManager = {
 
 
 
-	async updateQuantity(itemId, newQuantity) {
+	// Cambios pendientes de enviar: los clics seguidos en +/- se juntan y se
+	// mandan en un solo request a /carrito/batch/
+	pendientes: new Map(),
+	timerBatch: null,
+	DEMORA_BATCH: 400,
+
+	updateQuantity(itemId, newQuantity) {
 		if (newQuantity < 1) return;
+		this.encolar(itemId, { op: "actualizar", item_id: itemId, cantidad: newQuantity });
+	},
 
-		try {
-			const response = await fetch(window.CART_URLS.actualizarCantidad, {
-				method: "POST",
-				headers: {
-					"Content-Type": "application/json",
-					"X-CSRFToken": this.getCookie("csrftoken"),
-				},
-				body: JSON.stringify({
-					item_id: itemId,
-					cantidad: newQuantity,
-				}),
-			});
+	removeItem(itemId) {
+		const itemElement = document.querySelector(`.cart-item[data-item-id="${itemId}"]`);
+		if (itemElement) itemElement.remove();
+		this.encolar(itemId, { op: "eliminar", item_id: itemId }, 0);
+	},
 
-			if (response.ok) {
-				await this.loadCart();
-			} else {
-			console.error("Error al actualizar cantidad");
-			}
-		} catch (error) {
-			console.error("Error actualizando cantidad:", error);
-		}
+	encolar(itemId, operacion, demora = this.DEMORA_BATCH) {
+		// Para un mismo item sólo cuenta la última operación
+		this.pendientes.set(String(itemId), operacion);
+		clearTimeout(this.timerBatch);
+		this.timerBatch = setTimeout(() => this.enviarPendientes(), demora);
 	},
 
-	async removeItem(itemId) {
+	async enviarPendientes() {
+		if (this.pendientes.size === 0) return;
+		const operaciones = Array.from(this.pendientes.values());
+		this.pendientes.clear();
+
 		try {
-			const response = await fetch(window.CART_URLS.eliminarDelCarrito, {
+			const response = await fetch(window.CART_URLS.carritoBatch, {
 				method: "POST",
 				headers: {
 					"Content-Type": "application/json",
 					"X-CSRFToken": this.getCookie("csrftoken"),
 				},
-				body: JSON.stringify({
-					item_id: itemId,
-				}),
+				body: JSON.stringify({ operaciones }),
 			});
 
 			const data = await response.json();
 			if (data.success) {
+				this.updateCartUI(data);
+			} else {
+				alert("❌ " + data.message);
 				this.loadCart();
 			}
 		} catch (error) {
-			console.error("Error eliminando item:", error);
+			console.error("Error actualizando carrito:", error);
+			this.loadCart();
 		}
 	},
 
@@ -180,6 +189,34 @@ const CartManager = {
 		}
 	},
 
+	// Tiempo real: el servidor avisa cuando cambia el carrito o el stock de
+	// los productos que muestra la página (sólo bajo ASGI; si no, no hace nada)
+	conectarEventos() {
+		if (!window.EventSource || !window.CART_URLS.eventos) return;
+		const productos = new Set(
+			Array.from(document.querySelectorAll("[data-stock-producto]")).map((el) => el.dataset.stockProducto)
+		);
+		const url = `${window.CART_URLS.eventos}?productos=${Array.from(productos).join(",")}`;
+		const fuente = new EventSource(url);
+
+		fuente.addEventListener("carrito", () => this.loadCart());
+		fuente.addEventListener("stock", (evento) => {
+			const datos = JSON.parse(evento.data);
+			datos.variantes.forEach((variante) => {
+				const celda = document.querySelector(
+					`[data-stock-producto="${datos.producto_id}"][data-color-id="${variante.color_id}"][data-talle-id="${variante.talle_id}"]`
+				);
+				if (celda) celda.innerHTML = this.badgeStock(variante.libre);
+			});
+		});
+	},
+
+	badgeStock(disponible) {
+		if (disponible > 5) return `<span class="badge bg-success">${disponible} unidades</span>`;
+		if (disponible > 0) return `<span class="badge bg-warning">${disponible} unidades</span>`;
+		return `<span class="badge bg-danger">Sin stock</span>`;
+	},
+
 	getCookie(name) {
 		let cookieValue = null;
 		if (document.cookie && document.cookie !== "") {
@@ -199,6 +236,7 @@ const CartManager = {
 // Cargar carrito cuando la página carga
 document.addEventListener("DOMContentLoaded", () => {
 	CartManager.loadCart();
+	CartManager.conectarEventos();
 
 	// Recargar carrito cuando se pasa el mouse sobre el ícono
 	const cartIcon = document.getElementById("cartIcon");